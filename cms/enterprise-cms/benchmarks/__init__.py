@@ -0,0 +1,7 @@
+"""
+Performance benchmarks for the CMS.
+
+Each module can be run from the project directory with
+``python -m benchmarks.<module>``. They run against a throwaway SQLite
+database and media directory, so they never touch real data.
+"""
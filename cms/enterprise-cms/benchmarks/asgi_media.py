@@ -0,0 +1,243 @@
+"""
+Compare serving private media through the WSGI view in a thread pool with
+the async view on a single event loop, against storage with network latency.
+
+    python -m benchmarks.asgi_media [--requests 400] [--threads 4]
+        [--concurrency 200] [--latency 20]
+
+The storage is a local fake: every round-trip (the metadata lookup and each
+chunk read) sleeps for ``--latency`` milliseconds, blocking a thread in the
+synchronous client and awaiting in the asynchronous one. The WSGI path runs
+``--threads`` requests at a time, as one gthread worker would; the ASGI path
+keeps up to ``--concurrency`` requests in flight on one event loop.
+
+Each runs production's MIDDLEWARE (and its request metrics and access log
+sampling) as it is configured for WSGI or ASGI: under ASGI, WhiteNoise
+serves static files in front of Django rather than as middleware. The last
+run uses the WSGI MIDDLEWARE under ASGI, to show what WhiteNoise's
+synchronous middleware alone costs the event loop.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.urls import path
+
+from benchmarks.base import BenchmarkEnvironment
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FILE_SIZE = 256 * 1024
+FILE_COUNT = 20
+
+
+def __getattr__(name):
+    # This module is also the URLconf, which is only loaded once Django has
+    # been set up and the views can be imported.
+    if name == "urlpatterns":
+        from cms.views import serve_private_media, serve_private_media_async
+
+        return [
+            path("wsgi/media/<path:path>", serve_private_media),
+            path("asgi/media/<path:path>", serve_private_media_async),
+        ]
+    raise AttributeError(name)
+
+
+class SlowStorage(FileSystemStorage):
+    """
+    Filesystem storage that behaves like a remote blob store ``latency``
+    seconds away, with both synchronous and asyncio clients.
+    """
+
+    latency = 0.02
+    timeout = 20
+
+    def _get_valid_path(self, name):
+        return name
+
+    def size(self, name):
+        time.sleep(self.latency)
+        return super().size(name)
+
+    def open(self, name, mode="rb"):
+        return SlowFile(super().open(name, mode).file, self.latency)
+
+    def get_async_client(self):
+        return SlowAsyncContainerClient(self)
+
+
+class SlowFile(File):
+    def __init__(self, file, latency):
+        super().__init__(file)
+        self.latency = latency
+
+    def read(self, *args):
+        time.sleep(self.latency)
+        return self.file.read(*args)
+
+
+class SlowAsyncContainerClient:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get_blob_client(self, name):
+        async def get_blob_properties(timeout=None):
+            await asyncio.sleep(self.storage.latency)
+            return SimpleNamespace(
+                size=FileSystemStorage.size(self.storage, name),
+                etag=name,
+                last_modified=datetime.datetime.now(datetime.timezone.utc),
+                content_settings=SimpleNamespace(content_type=None),
+            )
+
+        return SimpleNamespace(get_blob_properties=get_blob_properties)
+
+    async def download_blob(self, name, offset=0, length=None, timeout=None):
+        with FileSystemStorage.open(self.storage, name) as f:
+            f.seek(offset)
+            data = f.read(-1 if length is None else length)
+        stream = SimpleNamespace(position=0)
+
+        async def read(size):
+            await asyncio.sleep(self.storage.latency)
+            chunk = data[stream.position : stream.position + size]
+            stream.position += len(chunk)
+            return chunk
+
+        stream.read = read
+        return stream
+
+
+# Production settings that shape what the middleware does per request.
+PRODUCTION_SETTINGS = [
+    "MIDDLEWARE",
+    "REQUEST_METRICS_SAMPLE_RATE",
+    "REQUEST_METRICS_SERVER_TIMING",
+    "ACCESS_LOG_SAMPLE_RATE",
+    "ACCESS_LOG_SLOW_MS",
+    "ACCESS_LOG_RATE_LIMIT",
+]
+
+
+def get_production_settings(asgi):
+    """
+    Return the PRODUCTION_SETTINGS of ``cms.settings.production`` as they are
+    when it is loaded under WSGI, or under ASGI. The module is loaded in a
+    separate process, as loading it changes the base settings it imports.
+    """
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import json, cms.settings.production as s; "
+            "print(json.dumps({name: getattr(s, name) for name in %r}))"
+            % PRODUCTION_SETTINGS,
+        ],
+        cwd=PROJECT_DIR,
+        env={**os.environ, "ASGI": "true" if asgi else "false"},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def get_settings():
+    return {
+        "ROOT_URLCONF": "benchmarks.asgi_media",
+        "STORAGES": {
+            "default": {"BACKEND": "benchmarks.asgi_media.SlowStorage"},
+            "staticfiles": {
+                "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+            },
+        },
+        # Measure storage round-trips rather than the media cache.
+        "PRIVATE_MEDIA_CACHE_MEMORY_SIZE": 0,
+        "PRIVATE_MEDIA_CACHE_MAX_OBJECT_SIZE": 0,
+        "PRIVATE_MEDIA_CACHE_ALIAS": None,
+        "PRIVATE_MEDIA_SERVE_MODE": "proxy",
+    }
+
+
+def run_wsgi(user, request_count, threads):
+    from django.test import Client
+
+    def fetch(i):
+        client = Client()
+        client.force_login(user)
+        response = client.get("/wsgi/media/files/%d.bin" % (i % FILE_COUNT))
+        assert len(b"".join(response.streaming_content)) == FILE_SIZE
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(fetch, range(request_count)))
+
+
+def run_asgi(user, request_count, concurrency):
+    from django.test import AsyncClient
+
+    async def main():
+        client = AsyncClient()
+        await client.aforce_login(user)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(i):
+            async with semaphore:
+                response = await client.get("/asgi/media/files/%d.bin" % (i % FILE_COUNT))
+                body = b"".join([chunk async for chunk in response.streaming_content])
+                assert len(body) == FILE_SIZE
+
+        await asyncio.gather(*[fetch(i) for i in range(request_count)])
+
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=20, metavar="MS")
+    args = parser.parse_args()
+
+    with BenchmarkEnvironment() as env:
+        from django.contrib.auth import get_user_model
+        from django.test.utils import override_settings
+
+        SlowStorage.latency = args.latency / 1000
+        for i in range(FILE_COUNT):
+            env.write_media("files/%d.bin" % i, b"\0" * FILE_SIZE)
+
+        user = get_user_model().objects.create_user("editor", password="password")
+
+        wsgi_settings = get_production_settings(asgi=False)
+        asgi_settings = get_production_settings(asgi=True)
+        # Production's ASGI settings, with the WSGI MIDDLEWARE.
+        sync_middleware = {**asgi_settings, "MIDDLEWARE": wsgi_settings["MIDDLEWARE"]}
+        for name, run, width, production_settings in (
+            ("WSGI, %d threads" % args.threads, run_wsgi, args.threads, wsgi_settings),
+            ("ASGI, 1 event loop", run_asgi, args.concurrency, asgi_settings),
+            ("ASGI + sync WhiteNoise", run_asgi, args.concurrency, sync_middleware),
+        ):
+            with override_settings(**get_settings(), **production_settings):
+                start = time.perf_counter()
+                run(user, args.requests, width)
+                elapsed = time.perf_counter() - start
+            print(
+                "%-24s %7.1f req/s  (%d requests in %.2fs)"
+                % (name, args.requests / elapsed, args.requests, elapsed)
+            )
+
+
+if __name__ == "__main__":
+    main()
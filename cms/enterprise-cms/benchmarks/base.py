@@ -0,0 +1,61 @@
+"""
+Shared set-up for the benchmark scripts.
+"""
+
+import os
+import shutil
+import tempfile
+
+import django
+
+
+class BenchmarkEnvironment:
+    """
+    Configures Django against a temporary database and media root.
+
+    Use as a context manager; everything is removed again on exit.
+    """
+
+    def __init__(self, settings_module="cms.settings.dev"):
+        self.settings_module = settings_module
+
+    def __enter__(self):
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", self.settings_module)
+        self.tmpdir = tempfile.mkdtemp(prefix="cms-benchmark-")
+
+        from django.conf import settings
+
+        # The test database must live in a file so that forked workers can
+        # share it.
+        settings.DATABASES["default"]["TEST"] = {
+            "NAME": os.path.join(self.tmpdir, "db.sqlite3")
+        }
+        django.setup()
+
+        from django.db import connection
+        from django.test.utils import override_settings, setup_test_environment
+
+        setup_test_environment()
+        self._old_database_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0)
+
+        self.media_root = os.path.join(self.tmpdir, "media")
+        os.makedirs(self.media_root)
+        self._settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self._settings_override.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        from django.db import connection
+        from django.test.utils import teardown_test_environment
+
+        self._settings_override.disable()
+        connection.creation.destroy_test_db(self._old_database_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write_media(self, name, content):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
@@ -0,0 +1,142 @@
+"""
+Compare a per-process LocMemCache with database-backed sessions against a
+cache shared between workers with ``cached_db`` sessions.
+
+    python -m benchmarks.cache_sessions [--workers 4] [--requests 800]
+
+Each worker is a forked process serving an equal share of authenticated
+media requests, as gunicorn workers would. For each configuration the
+script reports the hit rate of the default cache and the average number of
+database queries per request.
+"""
+
+import argparse
+import multiprocessing
+import os
+
+from benchmarks.base import BenchmarkEnvironment
+
+FILE_COUNT = 50
+
+
+def get_scenarios(tmpdir):
+    return {
+        "locmem + db sessions": {
+            "per_process": True,
+            "settings": {
+                "CACHES": {
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                        "LOCATION": "unique-snowflake",
+                    }
+                },
+                "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+            },
+        },
+        "shared + cached_db sessions": {
+            "per_process": False,
+            "settings": {
+                "CACHES": {
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                        "LOCATION": os.path.join(tmpdir, "cache"),
+                    }
+                },
+                "SESSION_ENGINE": "django.contrib.sessions.backends.cached_db",
+            },
+        },
+    }
+
+
+def run_worker(args):
+    """
+    Serve ``request_count`` media requests in a freshly forked worker and
+    return its query and cache counters.
+    """
+    session_key, request_count, offset, per_process = args
+
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    if per_process:
+        # A new gunicorn worker starts with an empty local memory cache.
+        cache.clear()
+
+    stats = {"requests": 0, "queries": 0, "gets": 0, "hits": 0}
+    original_get = cache.get
+
+    def counting_get(key, default=None, version=None):
+        value = original_get(key, default, version)
+        stats["gets"] += 1
+        if value is not default:
+            stats["hits"] += 1
+        return value
+
+    cache.get = counting_get
+
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+    for i in range(request_count):
+        name = "images/%d.png" % ((offset + i) % FILE_COUNT)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/media/" + name)
+            b"".join(response.streaming_content)
+        assert response.status_code == 200, response.status_code
+        stats["requests"] += 1
+        stats["queries"] += len(queries)
+
+    return stats
+
+
+def run_scenario(env, scenario, workers, requests):
+    from django.contrib.auth import get_user_model
+    from django.db import connections
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    with override_settings(PRIVATE_MEDIA_CACHE_ALIAS="default", **scenario["settings"]):
+        user, _ = get_user_model().objects.get_or_create(username="benchmark")
+        client = Client()
+        client.force_login(user)
+        session_key = client.session.session_key
+
+        connections.close_all()
+        per_worker = requests // workers
+        jobs = [
+            (session_key, per_worker, i * per_worker, scenario["per_process"])
+            for i in range(workers)
+        ]
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            results = pool.map(run_worker, jobs)
+
+    totals = {key: sum(result[key] for result in results) for key in results[0]}
+    return {
+        "hit_rate": totals["hits"] / totals["gets"] if totals["gets"] else 0.0,
+        "queries_per_request": totals["queries"] / totals["requests"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=800)
+    args = parser.parse_args()
+
+    with BenchmarkEnvironment() as env:
+        for i in range(FILE_COUNT):
+            env.write_media("images/%d.png" % i, os.urandom(1024))
+
+        print("%-30s %10s %18s" % ("configuration", "hit rate", "queries/request"))
+        for label, scenario in get_scenarios(env.tmpdir).items():
+            result = run_scenario(env, scenario, args.workers, args.requests)
+            print(
+                "%-30s %9.1f%% %18.2f"
+                % (label, result["hit_rate"] * 100, result["queries_per_request"])
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Synthetic content for the benchmarks: a large page tree under the site's
+HomePage, indexed for search, and media files in local storage.
+"""
+
+import random
+from io import StringIO
+
+
+def get_home_page():
+    from home.models import HomePage
+
+    return HomePage.objects.get(depth=2)
+
+
+def create_page_tree(count, fanout=100, seed=0):
+    """
+    Add ``count`` live, indexed HomePages below the site's HomePage, with
+    ``fanout`` children per page (see the ``load_page_tree`` command).
+    """
+    from django.core.management import call_command
+
+    call_command(
+        "load_page_tree",
+        count,
+        parent=get_home_page().pk,
+        fanout=fanout,
+        seed=seed,
+        stdout=StringIO(),
+    )
+
+
+def create_media(env, sizes):
+    """
+    Write one file of each size in ``sizes`` (bytes) to the media root and
+    return their storage names.
+    """
+    names = []
+    for size in sizes:
+        name = "documents/benchmark-%d.bin" % size
+        env.write_media(name, random.Random(size).randbytes(size))
+        names.append(name)
+    return names
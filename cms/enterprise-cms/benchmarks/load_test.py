@@ -0,0 +1,178 @@
+"""
+Load test gunicorn with its defaults against ``gunicorn.conf.py``.
+
+    python -m benchmarks.load_test [--duration 10] [--concurrency 16]
+
+The defaults are the previous container command: one synchronous worker and
+no preloading. Each server runs the production settings against a temporary
+SQLite database with one home page, and is driven by ``--concurrency``
+keep-alive clients for ``--duration`` seconds per URL. The script reports
+requests per second and the 95th percentile latency.
+
+A local SQLite database answers in microseconds, which hides the time a
+production worker spends waiting on PostgreSQL over the network. Each query
+is therefore delayed by ``--query-latency`` milliseconds (default 2); pass 0
+to measure pure CPU throughput, where extra workers only help with more than
+one core.
+"""
+
+import argparse
+import http.client
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+URLS = ["/", "/search/?query=home"]
+
+SETTINGS = """
+import time
+
+from django.db import connection
+
+from cms.settings.production import *
+
+STATIC_ROOT = %r
+QUERY_LATENCY = %r
+
+
+def delay_queries(execute, sql, params, many, context):
+    time.sleep(QUERY_LATENCY)
+    return execute(sql, params, many, context)
+
+
+def simulate_query_latency(get_response):
+    def middleware(request):
+        with connection.execute_wrapper(delay_queries):
+            return get_response(request)
+
+    return middleware
+
+
+MIDDLEWARE = ["benchmark_settings.simulate_query_latency", *MIDDLEWARE]
+"""
+
+
+def prepare(tmpdir, query_latency):
+    with open(os.path.join(tmpdir, "benchmark_settings.py"), "w") as f:
+        f.write(SETTINGS % (os.path.join(tmpdir, "static"), query_latency))
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([tmpdir, PROJECT_DIR]),
+        "DJANGO_SETTINGS_MODULE": "benchmark_settings",
+        "DATABASE_URL": "sqlite:///%s" % os.path.join(tmpdir, "db.sqlite3"),
+        "CACHE_BACKEND": "locmem",
+        "DJANGO_SUPERUSER_USERNAME": "admin",
+        "DJANGO_SUPERUSER_EMAIL": "admin@example.com",
+        "DJANGO_SUPERUSER_PASSWORD": "benchmark",
+    }
+    for command in (["bootstrap"], ["collectstatic", "--noinput"]):
+        subprocess.run(
+            [sys.executable, "manage.py", *command],
+            cwd=PROJECT_DIR,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+    return env
+
+
+def start_server(env, port, config):
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "cms.wsgi:application",
+            "--config", config,
+            "--bind", "127.0.0.1:%d" % port,
+        ],
+        cwd=PROJECT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            return process
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start on port %d" % port)
+
+
+def run_client(port, url, stop_at, latencies):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        try:
+            connection.request("GET", url)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        if response.status == 200:
+            latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def load(port, url, duration, concurrency):
+    latencies = []
+    stop_at = time.monotonic() + duration
+    clients = [
+        threading.Thread(target=run_client, args=(port, url, stop_at, latencies))
+        for _ in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else 0
+    return len(latencies) / duration, p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--query-latency", type=float, default=2, metavar="MS")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="cms-benchmark-")
+    try:
+        env = prepare(tmpdir, args.query_latency / 1000)
+        defaults = os.path.join(tmpdir, "defaults.conf.py")
+        open(defaults, "w").close()
+
+        for name, config in (
+            ("gunicorn defaults", defaults),
+            ("gunicorn.conf.py", os.path.join(PROJECT_DIR, "gunicorn.conf.py")),
+        ):
+            server = start_server(env, args.port, config)
+            try:
+                for url in URLS:
+                    rate, p95 = load(args.port, url, args.duration, args.concurrency)
+                    print(
+                        "%-18s %-22s %8.1f req/s  p95 %6.1f ms"
+                        % (name, url, rate, p95 * 1000)
+                    )
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
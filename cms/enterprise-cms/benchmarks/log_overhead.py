@@ -0,0 +1,161 @@
+"""
+Measure what logging costs a request when stdout is slow to accept writes,
+as it is behind a container log driver.
+
+    python -m benchmarks.log_overhead [--threads 8] [--requests 20000]
+        [--write-latency-us 200]
+
+Each request goes through ``cms.log.RequestLogMiddleware`` to a view that
+logs two application records, from ``--threads`` threads at once as in a
+threaded gunicorn worker. Every write to the output stream takes
+``--write-latency-us``. "stream" is the previous configuration, a
+synchronous ``StreamHandler`` and an access line for every request; the
+"queue" configurations use ``cms.log.QueueHandler``, logging every request
+or a 10% sample. The script reports throughput, p50/p99 request latency and
+the number of lines written and dropped.
+"""
+
+import argparse
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+
+import django
+
+SCENARIOS = {
+    "stream, every request": {"queue": False, "sample_rate": 1.0},
+    "queue, every request": {"queue": True, "sample_rate": 1.0},
+    "queue, 10% sample": {"queue": True, "sample_rate": 0.1},
+}
+
+
+class SlowStream:
+    """
+    A stream that blocks for ``latency`` seconds on each write, one write at
+    a time, and counts the lines written and the records reported dropped.
+    """
+
+    dropped_re = re.compile(r"Dropped (\d+) log records")
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.lines = 0
+        self.dropped = 0
+
+    def write(self, text):
+        with self.lock:
+            time.sleep(self.latency)
+            self.lines += text.count("\n")
+            self.dropped += sum(int(n) for n in self.dropped_re.findall(text))
+
+    def flush(self):
+        pass
+
+
+def view(request):
+    from django.http import HttpResponse
+
+    logger = logging.getLogger("wagtail")
+    logger.info("Serving page %s", request.path)
+    logger.info("Rendered %s in %.1fms", "home/home_page.html", 1.0)
+    return HttpResponse("ok")
+
+
+def get_handler(scenario, stream):
+    from cms.log import QueueHandler
+
+    if scenario["queue"]:
+        return QueueHandler(stream=stream)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(name)s %(message)s"))
+    return handler
+
+
+def run_scenario(scenario, threads, requests, latency):
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+
+    from cms.log import RequestLogMiddleware
+
+    stream = SlowStream(latency)
+    handler = get_handler(scenario, stream)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+    middleware = RequestLogMiddleware(view)
+    factory = RequestFactory()
+    timings = [[] for _ in range(threads)]
+
+    def serve(timings):
+        for _ in range(requests // threads):
+            request = factory.get("/")
+            start = time.perf_counter()
+            middleware(request)
+            timings.append(time.perf_counter() - start)
+
+    try:
+        with override_settings(
+            ACCESS_LOG_SAMPLE_RATE=scenario["sample_rate"],
+            ACCESS_LOG_SLOW_MS=None,
+            ACCESS_LOG_RATE_LIMIT=None,
+        ):
+            start = time.perf_counter()
+            workers = [
+                threading.Thread(target=serve, args=(timings[i],))
+                for i in range(threads)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+    finally:
+        root.removeHandler(handler)
+        dropped = getattr(handler, "dropped", 0)
+        handler.flush()
+        handler.close()
+
+    latencies = sorted(t * 1000 for thread_timings in timings for t in thread_timings)
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "lines": stream.lines,
+        "dropped": stream.dropped + dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--write-latency-us", type=float, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cms.settings.dev")
+    django.setup()
+
+    for name, scenario in SCENARIOS.items():
+        result = run_scenario(
+            scenario, args.threads, args.requests, args.write_latency_us / 1e6
+        )
+        print(
+            "%-22s %8.0f req/s  p50 %6.3fms  p99 %7.3fms  %6d lines  %6d dropped"
+            % (
+                name,
+                result["throughput"],
+                result["p50_ms"],
+                result["p99_ms"],
+                result["lines"],
+                result["dropped"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare container start-up preparation before and after ``manage.py
+bootstrap``.
+
+    python -m benchmarks.startup [--runs 5]
+
+Both variants run against an already migrated SQLite database, as on every
+boot after the first. "migrate + createinitialsuperuser" is the old
+``startup.sh``: two Python processes, the first loading every migration.
+"bootstrap" is the new single process that checks for pending migrations
+with one query. The script reports the median wall-clock time of each.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VARIANTS = {
+    "migrate + createinitialsuperuser": [
+        ["migrate", "--noinput"],
+        ["createinitialsuperuser"],
+    ],
+    "bootstrap": [
+        ["bootstrap"],
+    ],
+}
+
+
+def get_environment(tmpdir):
+    return {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "cms.settings.production",
+        "DATABASE_URL": "sqlite:///%s" % os.path.join(tmpdir, "db.sqlite3"),
+        "CACHE_BACKEND": "locmem",
+        "DJANGO_SUPERUSER_USERNAME": "admin",
+        "DJANGO_SUPERUSER_EMAIL": "admin@example.com",
+        "DJANGO_SUPERUSER_PASSWORD": "benchmark",
+    }
+
+
+def manage(env, *args):
+    subprocess.run(
+        [sys.executable, "manage.py", *args],
+        cwd=PROJECT_DIR,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def time_variant(env, commands, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for command in commands:
+            manage(env, *command)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="cms-benchmark-")
+    try:
+        env = get_environment(tmpdir)
+        # The first boot migrates a fresh database either way.
+        manage(env, "bootstrap")
+
+        for name, commands in VARIANTS.items():
+            print("%-34s %6.2fs" % (name, time_variant(env, commands, args.runs)))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
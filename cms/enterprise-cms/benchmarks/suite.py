@@ -0,0 +1,257 @@
+"""
+Measure page serving, search and private media against a large synthetic
+site, and write the results as JSON for comparison across commits.
+
+    python -m benchmarks.suite [--pages 100000] [--requests 200]
+        [--output results.json] [--compare baseline.json] [--page-cache]
+
+The fixtures are a tree of ``--pages`` HomePages under the site's HomePage
+(100 children per page, created by the ``load_page_tree`` command), all
+indexed for search, and media files of 64 KB and 4 MB in local storage. Everything is generated from ``--seed``,
+so two runs with the same arguments serve the same content.
+
+For each scenario the suite reports throughput, p50/p99 latency, database
+queries per request (from ``cms.request_metrics``) and the peak memory
+allocated while serving a further ``--memory-requests`` requests under
+tracemalloc. Requests are made one at a time through the test client, so
+throughput is that of a single thread.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks.base import BenchmarkEnvironment
+from benchmarks.fixtures import create_media, create_page_tree
+
+MEDIA_SIZES = [64 * 1024, 4 * 1024 * 1024]
+
+SEARCH_QUERIES = ["report", "annual report", "finance", "health safety"]
+
+SEARCH_PAGES = [1, 2, 5, 10]
+
+# Compared by --compare; higher is better only for throughput.
+METRICS = ["throughput", "p50_ms", "p99_ms", "queries", "peak_memory_kb"]
+
+
+class MetricsHandler(logging.Handler):
+    """
+    Collects the values logged by ``cms.request_metrics`` for each request.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        metrics = getattr(record, "metrics", None)
+        if metrics is not None and record.levelno == logging.INFO:
+            self.records.append(metrics)
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fetch(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code)
+    if response.streaming:
+        for chunk in response.streaming_content:
+            pass
+    return response
+
+
+def run_scenario(client, urls, requests, memory_requests, handler):
+    for url in urls[: min(len(urls), 5)]:
+        fetch(client, url)
+
+    handler.records.clear()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        request_start = time.perf_counter()
+        fetch(client, urls[i % len(urls)])
+        latencies.append(time.perf_counter() - request_start)
+    elapsed = time.perf_counter() - start
+    queries = [metrics["queries"] for metrics in handler.records]
+
+    tracemalloc.start()
+    for i in range(memory_requests):
+        fetch(client, urls[i % len(urls)])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "throughput": round(requests / elapsed, 1),
+        "p50_ms": round(percentiles[49] * 1000, 2),
+        "p99_ms": round(percentiles[98] * 1000, 2),
+        "queries": round(statistics.mean(queries), 2) if queries else None,
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def get_scenarios(rng, media_names):
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from django.urls import reverse
+    from wagtail.models import Page
+
+    from benchmarks.fixtures import get_home_page
+
+    home = get_home_page()
+    leaf_paths = list(
+        Page.objects.filter(depth__gt=home.depth, numchild=0)
+        .order_by("path")
+        .values_list("url_path", flat=True)
+    )
+    page_urls = [
+        url_path[len(home.url_path) - 1 :]
+        for url_path in rng.sample(leaf_paths, min(len(leaf_paths), 1000))
+    ]
+    search_urls = [
+        "%s?query=%s&page=%d" % (reverse("search"), query.replace(" ", "+"), page)
+        for query in SEARCH_QUERIES
+        for page in SEARCH_PAGES
+    ]
+
+    editor = Client()
+    editor.force_login(
+        get_user_model().objects.create_user("editor", password="password")
+    )
+
+    scenarios = {
+        "homepage": (Client(), ["/"]),
+        "page": (Client(), page_urls),
+        "search": (Client(), search_urls),
+    }
+    for name, size in zip(media_names, MEDIA_SIZES):
+        scenarios["media %dkb" % (size // 1024)] = (
+            editor,
+            [reverse("serve_private_media", args=[name])],
+        )
+    return scenarios
+
+
+def compare(baseline, results):
+    print()
+    print("Compared with %s:" % (baseline["meta"].get("commit") or "baseline"))
+    for name, values in results["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        changes = []
+        for metric in METRICS:
+            if old.get(metric) and values.get(metric) is not None:
+                change = (values[metric] - old[metric]) / old[metric] * 100
+                changes.append("%s %+.1f%%" % (metric, change))
+        print("  %-12s %s" % (name, ", ".join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--memory-requests", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--page-cache",
+        action="store_true",
+        help="Serve pages through the page cache middleware, as in production.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="JSON results of an earlier run.")
+    args = parser.parse_args()
+
+    with BenchmarkEnvironment() as env:
+        from django.conf import settings
+        from django.test.utils import override_settings
+
+        from search import query_log
+
+        start = time.perf_counter()
+        create_page_tree(args.pages, seed=args.seed)
+        media_names = create_media(env, MEDIA_SIZES)
+        setup_time = time.perf_counter() - start
+        print("Created %d pages and media in %.1fs" % (args.pages, setup_time))
+
+        middleware = list(settings.MIDDLEWARE)
+        if args.page_cache:
+            middleware.append("cms.page_cache.PageCacheMiddleware")
+
+        handler = MetricsHandler()
+        logger = logging.getLogger("cms.request_metrics")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        results = {
+            "meta": {
+                "commit": get_commit(),
+                "timestamp": int(time.time()),
+                "python": platform.python_version(),
+                "pages": args.pages,
+                "requests": args.requests,
+                "seed": args.seed,
+                "page_cache": args.page_cache,
+                "setup_seconds": round(setup_time, 1),
+            },
+            "results": {},
+        }
+
+        with override_settings(
+            DEBUG=False,
+            MIDDLEWARE=middleware,
+            REQUEST_METRICS_SAMPLE_RATE=1.0,
+            SEARCH_HITS_FLUSH_INTERVAL=None,
+        ):
+            scenarios = get_scenarios(random.Random(args.seed), media_names)
+            for name, (client, urls) in scenarios.items():
+                result = run_scenario(
+                    client, urls, args.requests, args.memory_requests, handler
+                )
+                results["results"][name] = result
+                print(
+                    "%-12s %8.1f req/s  p50 %7.2fms  p99 %7.2fms  "
+                    "%5s queries  %8.1f KB peak"
+                    % (
+                        name,
+                        result["throughput"],
+                        result["p50_ms"],
+                        result["p99_ms"],
+                        result["queries"],
+                        result["peak_memory_kb"],
+                    )
+                )
+
+            # The search hits are of no interest and the database is about
+            # to be destroyed.
+            query_log.reset()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
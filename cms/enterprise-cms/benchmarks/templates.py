@@ -0,0 +1,106 @@
+"""
+Compare rendering ``home/home_page.html`` and ``search/search.html`` with and
+without the cached template loader and start-up warm-up.
+
+    python -m benchmarks.templates [--renders 500]
+
+For each configuration the script reports, per template, the time of the
+first render in a fresh worker and the median of ``--renders`` further
+renders. "uncached loader" parses the templates on every render, "cached
+loader" on the first one only, and "+ warm-up" has compiled them with
+``cms.template_cache.warm_templates()`` before the first request.
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks.base import BenchmarkEnvironment
+from benchmarks.fixtures import create_page_tree, get_home_page
+
+LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
+SCENARIOS = {
+    "uncached loader": {"cached": False, "warm": False},
+    "cached loader": {"cached": True, "warm": False},
+    "+ warm-up": {"cached": True, "warm": True},
+}
+
+
+def get_contexts():
+    from django.test import RequestFactory
+
+    from search.pagination import SearchPaginator
+
+    request = RequestFactory().get("/")
+    page = get_home_page()
+    # Fetch the results up front, so only rendering is timed.
+    results = SearchPaginator("report", 10).get_page(1)
+    results.object_list = list(results.object_list)
+    return request, {
+        "home/home_page.html": {"page": page, "self": page},
+        "search/search.html": {
+            "search_query": "report",
+            "search_results": results,
+            "search_promotions": [],
+        },
+    }
+
+
+def get_template_settings(cached):
+    from django.conf import settings
+
+    options = dict(settings.TEMPLATES[0]["OPTIONS"])
+    if cached:
+        options["loaders"] = [("django.template.loaders.cached.Loader", LOADERS)]
+    else:
+        options["loaders"] = LOADERS
+    return [{**settings.TEMPLATES[0], "APP_DIRS": False, "OPTIONS": options}]
+
+
+def time_render(name, context, request):
+    from django.template.loader import get_template
+
+    start = time.perf_counter()
+    get_template(name).render(context, request)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_scenario(scenario, contexts, request, renders):
+    from django.test.utils import override_settings
+
+    from cms.template_cache import warm_templates
+
+    with override_settings(TEMPLATES=get_template_settings(scenario["cached"])):
+        if scenario["warm"]:
+            warm_templates()
+        results = {}
+        for name, context in contexts.items():
+            first = time_render(name, context, request)
+            timings = [time_render(name, context, request) for _ in range(renders)]
+            results[name] = (first, statistics.median(timings))
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--renders", type=int, default=500)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    with BenchmarkEnvironment():
+        create_page_tree(args.pages)
+        request, contexts = get_contexts()
+
+        print("%-18s %-22s %10s %10s" % ("", "template", "first ms", "median ms"))
+        for scenario_name, scenario in SCENARIOS.items():
+            results = run_scenario(scenario, contexts, request, args.renders)
+            for name, (first, median) in results.items():
+                print("%-18s %-22s %10.2f %10.3f" % (scenario_name, name, first, median))
+
+
+if __name__ == "__main__":
+    main()
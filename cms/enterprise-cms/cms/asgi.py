@@ -0,0 +1,60 @@
+"""
+ASGI config for cms project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with uvicorn workers, e.g. by setting ``ASGI=true`` for
+``gunicorn.conf.py``. Under ASGI the media and search views are served by
+their async versions (see ``cms.urls``), so requests waiting on storage or
+the database do not each hold a thread. The project's middleware is async as
+well, and static files are served in front of Django rather than by
+WhiteNoise's synchronous middleware (see ``cms.staticfiles``), so the
+middleware chain does not hand each request to a thread either.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+
+from cms.media import aclose_async_clients
+from cms.staticfiles import StaticFilesApplication
+from cms.template_cache import warm_templates
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cms.settings.dev")
+os.environ.setdefault("ASGI", "true")
+
+django_application = get_asgi_application()
+http_application = StaticFilesApplication(django_application)
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI application, which does not handle the lifespan protocol.
+    Lifespan events are answered here, and on shutdown the storage clients
+    opened for the worker's event loop are closed, so their connections are
+    not left open.
+    """
+    if scope["type"] != "lifespan":
+        return await http_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await aclose_async_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+if getattr(settings, "TEMPLATE_WARMUP", False):
+    warm_templates()
+
+# Under gunicorn's preload this runs once in the master, and the workers
+# share the index.
+from search import autocomplete  # noqa: E402 (needs the app registry)
+
+autocomplete.warm()
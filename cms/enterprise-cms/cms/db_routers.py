@@ -0,0 +1,115 @@
+"""
+Read-replica routing for page views and search.
+
+When a ``replica`` database is configured, ``ReplicaRoutingMiddleware`` marks
+anonymous-safe read requests (GET/HEAD for Wagtail pages, search and
+autocomplete) and ``ReplicaRouter`` sends their queries to the replica. All
+other requests, writes and anything inside a transaction use the primary.
+
+Replicas lag slightly behind the primary, so an editor who has just saved
+something must not be served from one. Any request that writes to the
+database sets a short-lived cookie, and requests carrying it are pinned to
+the primary until it expires (DATABASE_REPLICA_PIN_SECONDS).
+"""
+
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import Resolver404, resolve
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICA_ALIAS = "replica"
+
+PIN_COOKIE_NAME = "db_primary"
+
+# URL names whose GET requests may be answered from the replica.
+REPLICA_URL_NAMES = {"wagtail_serve", "search", "search_autocomplete"}
+
+
+class RoutingState:
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+_state = ContextVar("db_routing_state", default=None)
+
+
+def is_replica_request(request):
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if PIN_COOKIE_NAME in request.COOKIES:
+        return False
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return False
+    return match.url_name in REPLICA_URL_NAMES
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.wrote:
+            return None
+        # Reads inside a transaction must see its uncommitted writes.
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == REPLICA_ALIAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """
+    Decide whether each request may read from the replica, and pin clients
+    to the primary after they write. Should come early in MIDDLEWARE, before
+    anything that queries the database.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = RoutingState(use_replica=is_replica_request(request))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin_if_written(state, response)
+
+    async def __acall__(self, request):
+        # Synchronous code called from here runs in a copy of this context,
+        # so the router sees the state and can record writes in it.
+        state = RoutingState(use_replica=is_replica_request(request))
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin_if_written(state, response)
+
+    def pin_if_written(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE_NAME,
+                "1",
+                max_age=getattr(settings, "DATABASE_REPLICA_PIN_SECONDS", 10),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
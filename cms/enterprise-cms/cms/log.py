@@ -0,0 +1,291 @@
+"""
+Structured logging that keeps log output off the request path.
+
+``QueueHandler`` puts log records on an in-memory queue, and a background
+thread in each process writes them to stderr as compact JSON lines, one per
+record. A request thread therefore never waits on stdout or stderr, which
+under a container log driver can block for milliseconds at a time. When the
+writer falls behind and the queue is full, records are dropped rather than
+blocking, and a warning with the number dropped is logged once there is room
+again.
+
+``RequestLogMiddleware`` gives each request an id (the incoming
+``X-Request-ID`` header, if it is sane, or a new one), returns it in the
+response and adds it to every record logged while the request is handled,
+so all log lines of one request can be found together. It also writes the
+access log to the ``cms.access`` logger: a ACCESS_LOG_SAMPLE_RATE sample of
+requests, plus every server error and every request slower than
+ACCESS_LOG_SLOW_MS, at most ACCESS_LOG_RATE_LIMIT lines per second per
+process. Lines held back by the limit are counted in the next line written.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+from uuid import uuid4
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+access_logger = logging.getLogger("cms.access")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Accept incoming ids from a proxy or load balancer only if they cannot be
+# used to inject anything into the logs.
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# Attributes of every LogRecord; anything else was passed in ``extra``.
+RECORD_ATTRIBUTES = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "request_id"}
+
+# Deliberately never reset, like the request metrics: every request replaces
+# the value.
+_request_id = ContextVar("request_id", default=None)
+
+_handlers = weakref.WeakSet()
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format a record as one line of JSON, with the request id and any
+    ``extra`` values as top-level keys.
+    """
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            data["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str, separators=(",", ":"))
+
+    def formatTime(self, record, datefmt=None):
+        return "%s.%03dZ" % (
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)),
+            record.msecs,
+        )
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to a background thread that writes them to ``stream``
+    (stderr by default) with ``JSONFormatter``. At most ``maxsize`` records
+    wait; further ones are dropped.
+    """
+
+    def __init__(self, maxsize=10000, stream=None):
+        self.maxsize = maxsize
+        self.target = logging.StreamHandler(stream)
+        self.target.setFormatter(JSONFormatter())
+        self.dropped = 0
+        super().__init__(queue.Queue(maxsize))
+        self.start()
+        _handlers.add(self)
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def restart(self):
+        """
+        Start a new queue and writer thread in a forked child, which
+        inherits neither the parent's thread nor a usable queue lock.
+        """
+        self.queue = queue.Queue(self.maxsize)
+        self.dropped = 0
+        self.start()
+
+    def prepare(self, record):
+        # Only what has to happen in the logging thread: fix the message and
+        # traceback, which may refer to objects that change later, and note
+        # the request. Formatting as JSON is left to the writer thread.
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        if not hasattr(record, "request_id"):
+            record.request_id = get_request_id()
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            try:
+                self.queue.put_nowait(
+                    logging.makeLogRecord(
+                        {
+                            "name": __name__,
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": "Dropped %d log records" % self.dropped,
+                        }
+                    )
+                )
+            except queue.Full:
+                self.dropped += 1
+                return
+            self.dropped = 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        # Wait for the writer to catch up, e.g. before the process exits.
+        if self.listener._thread is not None and self.listener._thread.is_alive():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
+
+
+def restart_handlers_after_fork():
+    for handler in list(_handlers):
+        handler.restart()
+
+
+def stop_handlers():
+    for handler in list(_handlers):
+        if handler.listener._thread is not None:
+            handler.listener.stop()
+
+
+os.register_at_fork(after_in_child=restart_handlers_after_fork)
+atexit.register(stop_handlers)
+
+
+class AccessLogLimiter:
+    """
+    Allow at most ``rate`` lines per second, and count those held back.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.second = None
+        self.count = 0
+        self.suppressed = 0
+
+    def allow(self, rate):
+        """
+        Return ``None`` if a line may not be written now, otherwise the
+        number of lines held back since the last one.
+        """
+        second = int(time.monotonic())
+        with self.lock:
+            if second != self.second:
+                self.second = second
+                self.count = 0
+            if rate is not None and self.count >= rate:
+                self.suppressed += 1
+                return None
+            self.count += 1
+            suppressed, self.suppressed = self.suppressed, 0
+            return suppressed
+
+
+_limiter = AccessLogLimiter()
+
+
+def get_request_id_from(request):
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    if REQUEST_ID_RE.match(request_id):
+        return request_id
+    return uuid4().hex
+
+
+def should_log_access(status, duration_ms):
+    if status >= 500:
+        return True
+    slow_ms = getattr(settings, "ACCESS_LOG_SLOW_MS", None)
+    if slow_ms is not None and duration_ms >= slow_ms:
+        return True
+    rate = getattr(settings, "ACCESS_LOG_SAMPLE_RATE", 1.0)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def log_access(request, response, start):
+    duration_ms = round((time.perf_counter() - start) * 1000, 1)
+    if not should_log_access(response.status_code, duration_ms):
+        return
+    suppressed = _limiter.allow(getattr(settings, "ACCESS_LOG_RATE_LIMIT", None))
+    if suppressed is None:
+        return
+
+    values = {
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "duration_ms": duration_ms,
+    }
+    if suppressed:
+        values["suppressed"] = suppressed
+    access_logger.info(
+        '"%s %s" %s %sms',
+        request.method,
+        request.path,
+        response.status_code,
+        duration_ms,
+        extra={"access": values},
+    )
+
+
+class RequestLogMiddleware(MiddlewareMixin):
+    """
+    Tag log records with a request id and write a sampled access log.
+    Should come first in MIDDLEWARE, so that every record logged while
+    handling the request has the id.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        request.request_id = get_request_id_from(request)
+        _request_id.set(request.request_id)
+        response = self.get_response(request)
+        response[REQUEST_ID_HEADER] = request.request_id
+        log_access(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        request.request_id = get_request_id_from(request)
+        _request_id.set(request.request_id)
+        response = await self.get_response(request)
+        response[REQUEST_ID_HEADER] = request.request_id
+        log_access(request, response, start)
+        return response
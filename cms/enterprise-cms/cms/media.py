@@ -0,0 +1,517 @@
+"""
+Helpers for serving files held in ``default_storage`` through Django.
+
+Files are never read into memory in one go; instead they are yielded in
+bounded chunks so that a worker's memory use does not depend on the size of
+the file being served. Responses carry ``ETag``/``Last-Modified`` validators
+taken from the storage metadata and honour conditional and range requests.
+
+Alternatively the bytes can be offloaded entirely, either by redirecting to a
+short-lived signed storage URL or by handing the file to a fronting proxy with
+``X-Accel-Redirect``/``X-Sendfile``.
+
+Each storage helper has an ``a``-prefixed coroutine counterpart for async
+views. These use the storage's asyncio blob client where it provides one
+(see ``cms.storage``) and otherwise run the synchronous call in a thread.
+"""
+
+import mimetypes
+import re
+from collections import namedtuple
+from urllib.parse import quote, urlsplit
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import storages
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import (
+    add_never_cache_headers,
+    get_conditional_response,
+    patch_cache_control,
+)
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from cms.request_metrics import record_storage_bytes
+
+# Size of each read from storage while streaming a response.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# How long signed URLs handed out in "redirect" mode stay valid, in seconds.
+DEFAULT_REDIRECT_EXPIRY = 60
+
+# Requests asking for more ranges than this are served the whole file.
+MAX_RANGES = 16
+
+RANGE_SPEC_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+FileMetadata = namedtuple(
+    "FileMetadata", ["size", "etag", "last_modified", "content_type"]
+)
+
+
+def get_chunk_size():
+    return getattr(settings, "PRIVATE_MEDIA_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+
+
+def get_max_age():
+    return getattr(settings, "PRIVATE_MEDIA_MAX_AGE", 0)
+
+
+def get_serve_mode():
+    """
+    Return how private media bytes are delivered:
+
+    - ``"proxy"`` (default): stream the file through the worker.
+    - ``"redirect"``: 302 to a short-lived signed storage URL.
+    - ``"accel"``: hand off to nginx with ``X-Accel-Redirect``.
+    - ``"sendfile"``: hand off to Apache/lighttpd with ``X-Sendfile``.
+    """
+    return getattr(settings, "PRIVATE_MEDIA_SERVE_MODE", "proxy")
+
+
+def guess_content_type(name):
+    content_type, _ = mimetypes.guess_type(name)
+    return content_type or "application/octet-stream"
+
+
+def get_file_metadata(storage, name):
+    """
+    Return the size, validators and content type of ``name``.
+
+    Azure blobs supply all of these from a single properties request; other
+    storages fall back to ``size()``/``get_modified_time()`` and an ETag
+    derived from them. Raises if the file does not exist.
+    """
+    client = getattr(storage, "client", None)
+
+    if hasattr(client, "get_blob_client"):
+        properties = client.get_blob_client(
+            storage._get_valid_path(name)
+        ).get_blob_properties(timeout=storage.timeout)
+        return get_blob_metadata(name, properties)
+
+    size = storage.size(name)
+    try:
+        last_modified = int(storage.get_modified_time(name).timestamp())
+    except NotImplementedError:
+        last_modified = None
+    etag = quote_etag("%x-%x" % (last_modified, size)) if last_modified else None
+    return FileMetadata(
+        size=size,
+        etag=etag,
+        last_modified=last_modified,
+        content_type=guess_content_type(name),
+    )
+
+
+def get_blob_metadata(name, properties):
+    return FileMetadata(
+        size=properties.size,
+        etag=quote_etag(properties.etag),
+        last_modified=int(properties.last_modified.timestamp()),
+        content_type=(
+            properties.content_settings.content_type or guess_content_type(name)
+        ),
+    )
+
+
+def get_async_client(storage):
+    """
+    Return the asyncio blob container client for ``storage``, or ``None`` if
+    it does not provide one.
+    """
+    get_client = getattr(storage, "get_async_client", None)
+    return get_client() if get_client is not None else None
+
+
+async def aclose_async_clients():
+    """
+    Close the asyncio clients that the configured storages opened for the
+    running event loop, as the ASGI worker shuts down.
+    """
+    for alias in settings.STORAGES:
+        close = getattr(storages[alias], "aclose_async_clients", None)
+        if close is not None:
+            await close()
+
+
+async def aget_file_metadata(storage, name):
+    client = get_async_client(storage)
+    if client is None:
+        return await sync_to_async(get_file_metadata, thread_sensitive=False)(
+            storage, name
+        )
+
+    properties = await client.get_blob_client(
+        storage._get_valid_path(name)
+    ).get_blob_properties(timeout=storage.timeout)
+    return get_blob_metadata(name, properties)
+
+
+def parse_range_header(header, size):
+    """
+    Parse a ``Range`` header against a file of ``size`` bytes.
+
+    Returns a list of inclusive ``(start, end)`` byte positions, an empty
+    list if none of the ranges can be satisfied, or ``None`` if the header
+    should be ignored and the whole file served.
+    """
+    if not header.startswith("bytes="):
+        return None
+
+    ranges = []
+    for spec in header[len("bytes=") :].split(","):
+        match = RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = int(last) if last else size - 1
+            ranges.append((start, min(end, size - 1)))
+        elif last:
+            suffix_length = int(last)
+            if suffix_length and size:
+                ranges.append((max(size - suffix_length, 0), size - 1))
+        else:
+            return None
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def if_range_passes(request, metadata):
+    """
+    Return whether a ``Range`` header may be honoured given ``If-Range``.
+    """
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return metadata.etag is not None and if_range == metadata.etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and if_range_date == metadata.last_modified
+
+
+def set_validator_headers(response, metadata):
+    if metadata.etag:
+        response["ETag"] = metadata.etag
+    if metadata.last_modified:
+        response["Last-Modified"] = http_date(metadata.last_modified)
+    patch_cache_control(response, private=True, max_age=get_max_age())
+
+
+def iter_storage_chunks(storage, name, chunk_size=None, start=0, length=None):
+    """
+    Yield the contents of ``name`` from ``storage`` in chunks of at most
+    ``chunk_size`` bytes, starting at ``start`` and stopping after ``length``
+    bytes (or at the end of the file).
+
+    Azure storage is read straight from the blob download stream, as opening
+    the file through the storage API would first spool the whole blob to a
+    temporary file.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    client = getattr(storage, "client", None)
+
+    if hasattr(client, "download_blob"):
+        stream = client.download_blob(
+            storage._get_valid_path(name),
+            offset=start,
+            length=length,
+            timeout=storage.timeout,
+        )
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            record_storage_bytes(len(chunk))
+            yield chunk
+        return
+
+    remaining = length
+    with storage.open(name, "rb") as file:
+        if start:
+            file.seek(start)
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = file.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            record_storage_bytes(len(chunk))
+            yield chunk
+
+
+async def aiter_storage_chunks(storage, name, chunk_size=None, start=0, length=None):
+    """
+    Asynchronous version of ``iter_storage_chunks``.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    client = get_async_client(storage)
+
+    if client is not None:
+        stream = await client.download_blob(
+            storage._get_valid_path(name),
+            offset=start,
+            length=length,
+            timeout=storage.timeout,
+        )
+        while True:
+            chunk = await stream.read(chunk_size)
+            if not chunk:
+                break
+            record_storage_bytes(len(chunk))
+            yield chunk
+        return
+
+    chunks = iter_storage_chunks(storage, name, chunk_size, start, length)
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+
+
+def get_signed_url(storage, name, expire, parameters=None):
+    """
+    Return an absolute, time-limited URL for ``name``, or ``None`` if the
+    storage cannot produce one (e.g. a filesystem storage whose URLs point
+    back at this site). ``parameters`` are signed into the URL, e.g. the
+    ``content_disposition`` the storage service should respond with.
+    """
+    kwargs = {"expire": expire}
+    if parameters:
+        kwargs["parameters"] = parameters
+    try:
+        url = storage.url(name, **kwargs)
+    except (TypeError, NotImplementedError):
+        return None
+    if not urlsplit(url).scheme:
+        return None
+    return url
+
+
+def offload_file(storage, name, mode=None, content_disposition=None):
+    """
+    Return a response that leaves delivery of ``name`` to something other
+    than this worker, or ``None`` if the file should be proxied.
+
+    No storage round-trip is made here, so the cost of the response does not
+    depend on the size of the file. Modes that the storage cannot support
+    fall back to proxying. A ``content_disposition`` is passed on to the
+    client whichever way the file is delivered.
+    """
+    mode = mode or get_serve_mode()
+
+    if mode == "redirect":
+        expire = getattr(
+            settings, "PRIVATE_MEDIA_REDIRECT_EXPIRY", DEFAULT_REDIRECT_EXPIRY
+        )
+        parameters = None
+        if content_disposition:
+            parameters = {"content_disposition": content_disposition}
+        url = get_signed_url(storage, name, expire, parameters)
+        if url is None:
+            return None
+        response = HttpResponseRedirect(url)
+        # The signed URL expires, so the redirect itself must not be cached.
+        add_never_cache_headers(response)
+        return response
+
+    if mode == "accel":
+        if ".." in name.split("/"):
+            # Let the proxy path reject traversal attempts with a 404.
+            return None
+        prefix = getattr(
+            settings, "PRIVATE_MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/"
+        )
+        response = HttpResponse(content_type=guess_content_type(name))
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(name)
+        if content_disposition:
+            response["Content-Disposition"] = content_disposition
+        return response
+
+    if mode == "sendfile":
+        try:
+            local_path = storage.path(name)
+        except NotImplementedError:
+            return None
+        response = HttpResponse(content_type=guess_content_type(name))
+        response["X-Sendfile"] = local_path
+        if content_disposition:
+            response["Content-Disposition"] = content_disposition
+        return response
+
+    return None
+
+
+def iter_multipart_ranges(read, parts, boundary):
+    for header, (start, end) in parts:
+        yield header
+        yield from read(start, end - start + 1)
+        yield b"\r\n"
+    yield ("--%s--\r\n" % boundary).encode("ascii")
+
+
+async def aiter_multipart_ranges(read, parts, boundary):
+    for header, (start, end) in parts:
+        yield header
+        async for chunk in read(start, end - start + 1):
+            yield chunk
+        yield b"\r\n"
+    yield ("--%s--\r\n" % boundary).encode("ascii")
+
+
+def evaluate_preconditions(request, metadata):
+    """
+    Return a ``(response, ranges)`` pair for a request for a file described
+    by ``metadata``. ``response`` is set if the request can be answered
+    without the file's content (304, 412 or 416); otherwise ``ranges`` holds
+    the byte ranges to serve, or ``None`` for the whole file.
+    """
+    response = get_conditional_response(
+        request, etag=metadata.etag, last_modified=metadata.last_modified
+    )
+    if response is not None:
+        set_validator_headers(response, metadata)
+        return response, None
+
+    ranges = None
+    if "HTTP_RANGE" in request.META and if_range_passes(request, metadata):
+        ranges = parse_range_header(request.META["HTTP_RANGE"], metadata.size)
+
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */%d" % metadata.size
+        return response, None
+
+    return None, ranges
+
+
+def build_file_response(request, metadata, ranges, read, multipart, empty):
+    """
+    Build the streaming response for ``ranges`` of a file. ``read(start,
+    length)`` returns an iterable of the file's content and ``multipart`` is
+    ``iter_multipart_ranges`` or its asynchronous version, to match it.
+    ``empty`` is the body used for HEAD requests.
+    """
+    size = metadata.size
+    content_range = None
+    if not ranges:
+        status = 200
+        content_type = metadata.content_type
+        content_length = size
+        body = read()
+    elif len(ranges) == 1:
+        status = 206
+        content_type = metadata.content_type
+        start, end = ranges[0]
+        content_length = end - start + 1
+        content_range = "bytes %d-%d/%d" % (start, end, size)
+        body = read(start, content_length)
+    else:
+        status = 206
+        boundary = uuid4().hex
+        content_type = "multipart/byteranges; boundary=%s" % boundary
+        parts = [
+            (
+                (
+                    "--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n"
+                    % (boundary, metadata.content_type, start, end, size)
+                ).encode("ascii"),
+                (start, end),
+            )
+            for start, end in ranges
+        ]
+        content_length = sum(
+            len(header) + (end - start + 1) + 2 for header, (start, end) in parts
+        ) + len("--%s--\r\n" % boundary)
+        body = multipart(read, parts, boundary)
+
+    if request.method == "HEAD":
+        # The storage iterators are lazy, so nothing has been read yet.
+        body = empty
+
+    response = StreamingHttpResponse(body, status=status, content_type=content_type)
+    response["Content-Length"] = content_length
+    if content_range:
+        response["Content-Range"] = content_range
+    response["Accept-Ranges"] = "bytes"
+    set_validator_headers(response, metadata)
+    return response
+
+
+def serve_file(request, storage, name, metadata=None, cache=None):
+    """
+    Build a streaming response for ``name`` in ``storage``.
+
+    Answers conditional requests with 304/412, single ranges with a 206 and
+    multiple ranges with a ``multipart/byteranges`` 206. The caller is
+    responsible for access control and for turning a missing file into a 404.
+
+    If a ``cms.media_cache.MediaCache`` is given, small files are served from
+    it rather than read from storage.
+    """
+    if metadata is None:
+        metadata = get_file_metadata(storage, name)
+
+    response, ranges = evaluate_preconditions(request, metadata)
+    if response is not None:
+        return response
+
+    content = None
+    if cache is not None and request.method != "HEAD":
+        content = cache.get_content(storage, name, metadata)
+
+    def read(start=0, length=None):
+        if content is not None:
+            return [content[start : None if length is None else start + length]]
+        return iter_storage_chunks(storage, name, start=start, length=length)
+
+    return build_file_response(
+        request, metadata, ranges, read, iter_multipart_ranges, []
+    )
+
+
+async def aserve_file(request, storage, name, metadata=None, cache=None):
+    """
+    Asynchronous version of ``serve_file``, for async views. The response
+    body is an asynchronous iterator, so the event loop is free while
+    waiting on storage.
+    """
+    if metadata is None:
+        metadata = await aget_file_metadata(storage, name)
+
+    response, ranges = evaluate_preconditions(request, metadata)
+    if response is not None:
+        return response
+
+    content = None
+    if cache is not None and request.method != "HEAD":
+        content = await cache.aget_content(storage, name, metadata)
+
+    async def read(start=0, length=None):
+        if content is not None:
+            yield content[start : None if length is None else start + length]
+            return
+        async for chunk in aiter_storage_chunks(
+            storage, name, start=start, length=length
+        ):
+            yield chunk
+
+    async def empty():
+        return
+        yield
+
+    return build_file_response(
+        request, metadata, ranges, read, aiter_multipart_ranges, empty()
+    )
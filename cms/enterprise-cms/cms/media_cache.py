@@ -0,0 +1,271 @@
+"""
+Two-tier cache for private media metadata and small file bodies.
+
+The first tier is a per-process, size-bounded LRU held in memory; the second
+is an optional shared Django cache (see PRIVATE_MEDIA_CACHE_ALIAS) so that
+other workers and instances can reuse what one of them has fetched. Entries
+are keyed by the storage (its class, container and location) as well as the
+file name, and expire after PRIVATE_MEDIA_CACHE_TIMEOUT seconds.
+
+When a file is replaced or deleted, the signal handlers in
+``home.signal_handlers`` drop its entries from the shared tier and from the
+memory tier of the process that changed it. Other processes' memory tiers
+cannot be reached, so with a shared tier, metadata is only cached there:
+bodies are kept in memory with the ETag they were read with, and are only
+served while the current metadata has the same ETag. Without a shared tier
+(a single process) metadata is cached in memory too.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from cms.media import (
+    aget_file_metadata,
+    aiter_storage_chunks,
+    get_file_metadata,
+    iter_storage_chunks,
+)
+from cms.request_metrics import record_cache
+
+# Rough in-memory cost of a metadata entry, used for LRU accounting.
+METADATA_ENTRY_SIZE = 512
+
+
+def get_storage_key(storage):
+    """
+    Identify ``storage`` by its class, container and location, so that files
+    of the same name in different storages do not share cache entries.
+    """
+    cls = storage.__class__
+    return "%s.%s:%s:%s" % (
+        cls.__module__,
+        cls.__qualname__,
+        getattr(storage, "azure_container", None) or "",
+        getattr(storage, "location", None) or "",
+    )
+
+
+class LRUCache:
+    """
+    A thread-safe mapping that evicts the least recently used entries once
+    the total size of its values exceeds ``max_size`` bytes.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, size, expires = item
+            if expires < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, size):
+        if size > self.max_size:
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (value, size, time.monotonic() + self.timeout)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self.size -= evicted_size
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+
+class MediaCache:
+    """
+    Caches ``FileMetadata`` for any file and the body of files no larger
+    than ``max_object_size`` bytes.
+    """
+
+    def __init__(self, memory_size, max_object_size, timeout, cache_alias=None):
+        self.memory = LRUCache(memory_size, timeout)
+        self.max_object_size = max_object_size
+        self.timeout = timeout
+        self.shared = caches[cache_alias] if cache_alias else None
+
+    def _memory_key(self, kind, storage, name):
+        return kind, get_storage_key(storage), name
+
+    def _shared_key(self, kind, storage, name):
+        key = "%s:%s" % (get_storage_key(storage), name)
+        return "private-media:%s:%s" % (
+            kind,
+            hashlib.sha1(key.encode("utf-8")).hexdigest(),
+        )
+
+    def _use_memory(self, kind):
+        # Metadata held in memory could not be invalidated from other
+        # processes; bodies are checked against the current ETag.
+        return kind == "body" or self.shared is None
+
+    def _get(self, kind, storage, name):
+        memory_key = self._memory_key(kind, storage, name)
+        use_memory = self._use_memory(kind)
+        value = self.memory.get(memory_key) if use_memory else None
+        if value is None and self.shared is not None:
+            value = self.shared.get(self._shared_key(kind, storage, name))
+            if value is not None and use_memory:
+                self.memory.set(memory_key, value, self._entry_size(kind, value))
+        return value
+
+    def _set(self, kind, storage, name, value):
+        if self._use_memory(kind):
+            self.memory.set(
+                self._memory_key(kind, storage, name),
+                value,
+                self._entry_size(kind, value),
+            )
+        if self.shared is not None:
+            self.shared.set(self._shared_key(kind, storage, name), value, self.timeout)
+
+    async def _aget(self, kind, storage, name):
+        memory_key = self._memory_key(kind, storage, name)
+        use_memory = self._use_memory(kind)
+        value = self.memory.get(memory_key) if use_memory else None
+        if value is None and self.shared is not None:
+            value = await self.shared.aget(self._shared_key(kind, storage, name))
+            if value is not None and use_memory:
+                self.memory.set(memory_key, value, self._entry_size(kind, value))
+        return value
+
+    async def _aset(self, kind, storage, name, value):
+        if self._use_memory(kind):
+            self.memory.set(
+                self._memory_key(kind, storage, name),
+                value,
+                self._entry_size(kind, value),
+            )
+        if self.shared is not None:
+            await self.shared.aset(
+                self._shared_key(kind, storage, name), value, self.timeout
+            )
+
+    def _entry_size(self, kind, value):
+        if kind == "body":
+            return len(value[1]) + METADATA_ENTRY_SIZE
+        return METADATA_ENTRY_SIZE
+
+    def get_metadata(self, storage, name):
+        """
+        Return the ``FileMetadata`` for ``name``, fetching it from storage on
+        a miss. Raises if the file does not exist.
+        """
+        metadata = self._get("meta", storage, name)
+        record_cache(metadata is not None)
+        if metadata is None:
+            metadata = get_file_metadata(storage, name)
+            self._set("meta", storage, name, metadata)
+        return metadata
+
+    def get_content(self, storage, name, metadata):
+        """
+        Return the body of ``name`` as bytes, or ``None`` if it is too large
+        to cache and should be streamed instead.
+        """
+        if metadata.size > self.max_object_size:
+            return None
+
+        # Bodies are stored alongside the ETag they were read with, so a body
+        # cached before the file was replaced is never served.
+        cached = self._get("body", storage, name)
+        hit = cached is not None and cached[0] == metadata.etag
+        record_cache(hit)
+        if hit:
+            return cached[1]
+
+        content = b"".join(iter_storage_chunks(storage, name))
+        self._set("body", storage, name, (metadata.etag, content))
+        return content
+
+    async def aget_metadata(self, storage, name):
+        metadata = await self._aget("meta", storage, name)
+        record_cache(metadata is not None)
+        if metadata is None:
+            metadata = await aget_file_metadata(storage, name)
+            await self._aset("meta", storage, name, metadata)
+        return metadata
+
+    async def aget_content(self, storage, name, metadata):
+        if metadata.size > self.max_object_size:
+            return None
+
+        cached = await self._aget("body", storage, name)
+        hit = cached is not None and cached[0] == metadata.etag
+        record_cache(hit)
+        if hit:
+            return cached[1]
+
+        content = b"".join([chunk async for chunk in aiter_storage_chunks(storage, name)])
+        await self._aset("body", storage, name, (metadata.etag, content))
+        return content
+
+    def invalidate(self, storage, name):
+        for kind in ("meta", "body"):
+            self.memory.delete(self._memory_key(kind, storage, name))
+            if self.shared is not None:
+                self.shared.delete(self._shared_key(kind, storage, name))
+
+
+_media_cache = None
+
+
+def get_media_cache():
+    global _media_cache
+    if _media_cache is None:
+        _media_cache = MediaCache(
+            memory_size=getattr(
+                settings, "PRIVATE_MEDIA_CACHE_MEMORY_SIZE", 32 * 1024 * 1024
+            ),
+            max_object_size=getattr(
+                settings, "PRIVATE_MEDIA_CACHE_MAX_OBJECT_SIZE", 256 * 1024
+            ),
+            timeout=getattr(settings, "PRIVATE_MEDIA_CACHE_TIMEOUT", 60),
+            cache_alias=getattr(settings, "PRIVATE_MEDIA_CACHE_ALIAS", None),
+        )
+    return _media_cache
+
+
+@receiver(setting_changed)
+def reset_media_cache(*, setting, **kwargs):
+    global _media_cache
+    if setting.startswith("PRIVATE_MEDIA_CACHE") or setting in (
+        "CACHES",
+        "MEDIA_ROOT",
+        "STORAGES",
+    ):
+        _media_cache = None
@@ -0,0 +1,238 @@
+"""
+Full-page response cache for anonymous Wagtail page views.
+
+Responses are stored per URL (scheme, host and path) together with the id of
+the page that produced them. Every page has a generation token in the cache,
+as does the site as a whole; a cached response is only served while the
+tokens it was stored with are still current. Publishing, unpublishing, moving
+or deleting a page replaces the tokens of the page and its ancestors (see
+``home.signal_handlers``), so exactly the affected URLs are re-rendered.
+
+Requests carrying a session cookie bypass the cache altogether, which covers
+logged-in editors, the userbar and password-protected pages, so a hit costs a
+couple of cache reads and no database queries.
+"""
+
+import hashlib
+from fnmatch import fnmatch
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.urls import Resolver404, resolve
+from django.utils.cache import cc_delim_re
+from django.utils.deprecation import MiddlewareMixin
+
+from wagtail.models import Page
+
+from cms.request_metrics import record_cache
+
+SITE_GENERATION_KEY = "page-cache:generation:site"
+
+# Query parameters that do not change the rendered page.
+DEFAULT_IGNORED_QUERY_PARAMS = ["utm_*", "gclid", "fbclid"]
+
+
+def get_cache():
+    return caches[getattr(settings, "PAGE_CACHE_ALIAS", "default")]
+
+
+def get_timeout():
+    return getattr(settings, "PAGE_CACHE_TIMEOUT", 300)
+
+
+def get_generation_key(page_id):
+    return "page-cache:generation:page:%s" % page_id
+
+
+def get_url_key(request):
+    url = "%s://%s%s" % (request.scheme, request.get_host(), request.path)
+    return "page-cache:url:%s" % hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def get_variant_key(request, vary_headers):
+    return tuple(
+        request.headers.get(header, "") for header in sorted(vary_headers)
+    )
+
+
+def get_generations(cache, page_id, create=False):
+    """
+    Return the current (site, page) generation tokens, or ``None`` if either
+    is missing. With ``create``, missing tokens are initialised instead.
+    """
+    keys = [SITE_GENERATION_KEY, get_generation_key(page_id)]
+    generations = cache.get_many(keys)
+    if len(generations) < len(keys):
+        if not create:
+            return None
+        for key in keys:
+            if key not in generations:
+                cache.add(key, uuid4().hex, None)
+                generations[key] = cache.get(key)
+    return tuple(generations.get(key) for key in keys)
+
+
+def is_cacheable_request(request):
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return False
+
+    ignored_params = getattr(
+        settings, "PAGE_CACHE_IGNORED_QUERY_PARAMS", DEFAULT_IGNORED_QUERY_PARAMS
+    )
+    for param in request.GET:
+        if not any(fnmatch(param, pattern) for pattern in ignored_params):
+            return False
+
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return False
+    return match.url_name == "wagtail_serve"
+
+
+def is_cacheable_response(request, response):
+    if request.method != "GET" or response.status_code != 200:
+        return False
+    if response.streaming or response.cookies:
+        return False
+    if getattr(request, "page_cache_generations", None) is None:
+        return False
+    # The page used a CSRF token, so its content is specific to this visitor.
+    if request.META.get("CSRF_COOKIE_NEEDS_UPDATE"):
+        return False
+
+    cache_control = response.get("Cache-Control", "").lower()
+    if any(
+        directive in cache_control for directive in ("private", "no-cache", "no-store")
+    ):
+        return False
+    return "*" not in response.get("Vary", "")
+
+
+def mark_page_served(request, page):
+    """
+    Record that ``page`` is being served for ``request``, making the
+    response eligible for caching unless the page has view restrictions.
+    Called from the ``before_serve_page`` hook.
+
+    The generation tokens are read before the page is rendered, so that a
+    publish that lands mid-render leaves the stored response already stale.
+    """
+    if not getattr(request, "page_cache_candidate", False):
+        return
+    if not page.get_view_restrictions().exists():
+        request.page_cache_page_id = page.id
+        request.page_cache_generations = get_generations(
+            get_cache(), page.id, create=True
+        )
+
+
+class PageCacheMiddleware(MiddlewareMixin):
+    """
+    Serve anonymous Wagtail page views from the page cache.
+
+    Should come last in MIDDLEWARE so that the response headers added by the
+    other middleware are applied to cached responses as well.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not is_cacheable_request(request):
+            return self.get_response(request)
+
+        cache = get_cache()
+        url_key = get_url_key(request)
+        entry, response = self.lookup(cache, url_key, request)
+        record_cache(response is not None)
+        if response is not None:
+            return response
+
+        request.page_cache_candidate = True
+        response = self.get_response(request)
+        if is_cacheable_response(request, response):
+            self.store(cache, url_key, entry, request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not is_cacheable_request(request):
+            return await self.get_response(request)
+
+        cache = get_cache()
+        url_key = get_url_key(request)
+        entry, response = await sync_to_async(self.lookup)(cache, url_key, request)
+        record_cache(response is not None)
+        if response is not None:
+            return response
+
+        request.page_cache_candidate = True
+        response = await self.get_response(request)
+        if is_cacheable_response(request, response):
+            await sync_to_async(self.store)(cache, url_key, entry, request, response)
+        return response
+
+    def lookup(self, cache, url_key, request):
+        """
+        Return the cache entry for the URL, and the response stored in it for
+        this request if it is still current.
+        """
+        entry = cache.get(url_key)
+        if entry is not None:
+            response = entry["variants"].get(
+                get_variant_key(request, entry["vary"])
+            )
+            if response is not None and entry["generations"] == get_generations(
+                cache, entry["page_id"]
+            ):
+                return entry, response
+        return entry, None
+
+    def store(self, cache, url_key, entry, request, response):
+        page_id = request.page_cache_page_id
+        generations = request.page_cache_generations
+        # Anonymous requests with a session cookie are never cached, so
+        # responses cannot differ by Cookie here.
+        vary = sorted(
+            header.lower()
+            for header in cc_delim_re.split(response.get("Vary", ""))
+            if header and header.lower() != "cookie"
+        )
+
+        if (
+            entry is None
+            or entry["page_id"] != page_id
+            or entry["generations"] != generations
+            or entry["vary"] != vary
+        ):
+            entry = {
+                "page_id": page_id,
+                "generations": generations,
+                "vary": vary,
+                "variants": {},
+            }
+        entry["variants"][get_variant_key(request, vary)] = response
+        cache.set(url_key, entry, get_timeout())
+
+
+def invalidate_pages(page_ids):
+    get_cache().set_many(
+        {get_generation_key(page_id): uuid4().hex for page_id in page_ids}, None
+    )
+
+
+def invalidate_page(page):
+    """
+    Invalidate cached responses for ``page`` and all of its ancestors, whose
+    listings may include it.
+    """
+    invalidate_pages(
+        [page.id, *Page.objects.ancestor_of(page).values_list("id", flat=True)]
+    )
+
+
+def invalidate_site():
+    get_cache().set(SITE_GENERATION_KEY, uuid4().hex, None)
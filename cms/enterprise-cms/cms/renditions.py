@@ -0,0 +1,254 @@
+"""
+Pre-generation of image renditions.
+
+Wagtail creates a rendition the first time a template asks for it, so the
+first viewer of a page waits while the original is downloaded from storage,
+resized and the result uploaded. Here the filter specs in
+RENDITION_WARMUP_FILTERS are rendered ahead of time: for new and changed
+images by ``manage.py process_rendition_queue``, and for existing images by
+the ``warm_renditions`` management command.
+
+Creating an image, or changing its file or focal point, only records it in
+the ``RenditionQueueEntry`` table, in the same transaction (see
+``home.signal_handlers``), so the editor's request does no rendering. The
+worker claims queued images in batches with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` where the database supports it, so several workers can share the
+queue. Warming up is best effort: an image
+that cannot be rendered is logged and dropped from the queue, and its
+renditions are created on demand as before.
+
+Resizing is CPU-bound, so both commands render in a pool of
+RENDITION_WARMUP_WORKERS processes (``0`` renders in the command's process).
+Workers only turn the original's bytes into the rendition's bytes; reading
+the original, uploading the results and saving the ``Rendition`` rows stay
+in the calling process. Saved renditions are put in Wagtail's rendition
+cache, so the first ``{% image %}`` lookup does not query for them either.
+"""
+
+import logging
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from wagtail.images import get_image_model
+from wagtail.images.models import Filter
+
+from home.models import RenditionQueueEntry
+
+logger = logging.getLogger(__name__)
+
+# The image fields its renditions are made from.
+SOURCE_FIELDS = [
+    "file",
+    "focal_point_x",
+    "focal_point_y",
+    "focal_point_width",
+    "focal_point_height",
+]
+
+
+def get_filter_specs():
+    return list(getattr(settings, "RENDITION_WARMUP_FILTERS", []))
+
+
+def get_workers():
+    workers = getattr(settings, "RENDITION_WARMUP_WORKERS", None)
+    return os.cpu_count() if workers is None else workers
+
+
+def create_executor(workers):
+    """
+    Return a process pool of ``workers`` processes, or ``None`` to render in
+    the calling process. The caller shuts it down.
+    """
+    if not workers:
+        return None
+    return ProcessPoolExecutor(workers)
+
+
+def render(image, source, spec):
+    """
+    Render ``spec`` for ``image`` from the original's bytes in ``source`` and
+    return the rendition's focal point key, file name and bytes. Runs in a
+    worker process.
+    """
+    filter = Filter(spec=spec)
+    file = image.generate_rendition_file(
+        filter, source=File(BytesIO(source), name=image.file.name)
+    )
+    file.seek(0)
+    return filter.get_cache_key(image), file.name, file.read()
+
+
+def submit(executor, image, source, spec):
+    """
+    Render ``spec`` in ``executor``, or straight away if it is ``None``, and
+    return a future of the result.
+    """
+    if executor is not None:
+        return executor.submit(render, image, source, spec)
+    future = Future()
+    try:
+        future.set_result(render(image, source, spec))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def get_missing_filters(image, specs):
+    filters = [image.clean_filter_for_svg(Filter(spec=spec)) for spec in specs]
+    existing = image.find_existing_renditions(*filters)
+    return [filter for filter in filters if filter not in existing]
+
+
+def get_existing_keys(renditions):
+    Rendition = get_image_model().get_rendition_model()
+    lookup = Q()
+    for rendition in renditions:
+        lookup |= Q(
+            image=rendition.image,
+            filter_spec=rendition.filter_spec,
+            focal_point_key=rendition.focal_point_key,
+        )
+    return set(
+        Rendition.objects.filter(lookup).values_list(
+            "image_id", "filter_spec", "focal_point_key"
+        )
+    )
+
+
+def save_rendition(rendition):
+    """
+    Save ``rendition``, uploading its file, and return whether it was
+    created. If a page view created the same rendition in the meantime, the
+    file just uploaded is deleted again.
+    """
+    try:
+        with transaction.atomic():
+            rendition.save()
+    except IntegrityError:
+        rendition.file.delete(save=False)
+        return False
+    return True
+
+
+def warm_renditions(images, specs=None, executor=None):
+    """
+    Create the renditions for ``specs`` (by default RENDITION_WARMUP_FILTERS)
+    that ``images`` do not have yet, and return how many were created.
+    Images that cannot be read or rendered are logged and skipped.
+
+    All renditions of the batch are rendered at once, so pass as many images
+    as there are workers, or more, to keep the pool busy.
+    """
+    specs = get_filter_specs() if specs is None else specs
+    Rendition = get_image_model().get_rendition_model()
+
+    jobs = []
+    for image in images:
+        try:
+            filters = get_missing_filters(image, specs)
+            if not filters:
+                continue
+            with image.open_file() as f:
+                source = f.read()
+        except Exception:
+            logger.exception("Could not read image %s", image.pk)
+            continue
+        for filter in filters:
+            jobs.append(
+                (image, filter.spec, submit(executor, image, source, filter.spec))
+            )
+
+    renditions = []
+    for image, spec, future in jobs:
+        try:
+            focal_point_key, name, content = future.result()
+        except Exception:
+            logger.exception("Could not render %s for image %s", spec, image.pk)
+            continue
+        renditions.append(
+            Rendition(
+                image=image,
+                filter_spec=spec,
+                focal_point_key=focal_point_key,
+                file=ContentFile(content, name=name),
+            )
+        )
+
+    if not renditions:
+        return 0
+
+    # Skip any that a page view has created in the meantime without
+    # uploading their files; save_rendition() handles those created since.
+    existing = get_existing_keys(renditions)
+    created = [
+        rendition
+        for rendition in renditions
+        if (rendition.image.pk, rendition.filter_spec, rendition.focal_point_key)
+        not in existing
+        and save_rendition(rendition)
+    ]
+    Rendition.cache_backend.set_many(
+        {
+            Rendition.construct_cache_key(
+                rendition.image, rendition.focal_point_key, rendition.filter_spec
+            ): rendition
+            for rendition in created
+        }
+    )
+    return len(created)
+
+
+def enqueue(image):
+    """
+    Queue ``image`` for warming up, or move its entry to the back of the
+    queue.
+    """
+    RenditionQueueEntry.objects.bulk_create(
+        [RenditionQueueEntry(image_id=image.pk, queued_at=timezone.now())],
+        update_conflicts=True,
+        unique_fields=["image"],
+        update_fields=["queued_at"],
+    )
+
+
+def get_pending_count():
+    return RenditionQueueEntry.objects.count()
+
+
+def claim_images(batch_size):
+    """
+    Remove up to ``batch_size`` images from the queue, oldest first, and
+    return them. Rendering happens outside the transaction, so that no row
+    locks are held meanwhile; an image saved again while it is being
+    rendered is queued again.
+    """
+    with transaction.atomic():
+        queryset = RenditionQueueEntry.objects.order_by("queued_at", "pk")
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        entries = list(queryset[:batch_size])
+        RenditionQueueEntry.objects.filter(
+            pk__in=[entry.pk for entry in entries]
+        ).delete()
+    image_ids = [entry.image_id for entry in entries]
+    images = get_image_model().objects.in_bulk(image_ids)
+    return [images[pk] for pk in image_ids if pk in images]
+
+
+def process_batch(batch_size, executor=None):
+    """
+    Warm up to ``batch_size`` queued images and return the number of images
+    claimed and renditions created.
+    """
+    images = claim_images(batch_size)
+    if not images:
+        return 0, 0
+    return len(images), warm_renditions(images, executor=executor)
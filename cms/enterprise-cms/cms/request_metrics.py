@@ -0,0 +1,235 @@
+"""
+Per-request metrics: database queries and time, cache hits and misses,
+storage bytes read and total latency.
+
+``RequestMetricsMiddleware`` collects them for a sample of requests
+(REQUEST_METRICS_SAMPLE_RATE), reports them to the browser in a
+``Server-Timing`` header and logs them to the ``cms.request_metrics`` logger,
+with the values attached to the log record as ``metrics``. Requests outside
+the sample pay for one random number and nothing else.
+
+The cache layers (page cache, media cache, search results) and the storage
+readers in ``cms.media`` report through ``record_cache`` and
+``record_storage_bytes``, which do nothing outside a sampled request.
+
+REQUEST_BUDGETS sets per-view limits, keyed by URL name, e.g.::
+
+    REQUEST_BUDGETS = {"search": {"queries": 10, "duration_ms": 300}}
+
+A request over budget is logged as a warning or, with REQUEST_BUDGETS_STRICT
+(for tests), raises ``BudgetExceeded``.
+"""
+
+import logging
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger("cms.request_metrics")
+
+BUDGET_KEYS = ("queries", "db_time_ms", "duration_ms", "storage_bytes")
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.storage_bytes = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        return {
+            "queries": self.db_queries,
+            "db_time_ms": round(self.db_time * 1000, 1),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "storage_bytes": self.storage_bytes,
+            "duration_ms": round(self.elapsed() * 1000, 1),
+        }
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed as a database execute wrapper for the request.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+# Deliberately never reset: streamed responses are read from storage after
+# the middleware has returned, and every request replaces the value.
+_current = ContextVar("request_metrics", default=None)
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+def record_storage_bytes(count):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.storage_bytes += count
+
+
+def is_sampled():
+    rate = getattr(settings, "REQUEST_METRICS_SAMPLE_RATE", 1.0)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def get_view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        # Responses from the page cache are returned before URL resolution.
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+    return match.url_name
+
+
+def format_server_timing(metrics):
+    db_time = metrics.db_time * 1000
+    entries = [
+        'db;dur=%.1f;desc="%d queries"' % (db_time, metrics.db_queries),
+        'cache;desc="%d hits, %d misses"' % (metrics.cache_hits, metrics.cache_misses),
+    ]
+    if metrics.storage_bytes:
+        entries.append('storage;desc="%d bytes"' % metrics.storage_bytes)
+    entries.append("app;dur=%.1f" % (metrics.elapsed() * 1000 - db_time))
+    entries.append("total;dur=%.1f" % (metrics.elapsed() * 1000))
+    return ", ".join(entries)
+
+
+def check_budget(view_name, values):
+    budget = getattr(settings, "REQUEST_BUDGETS", {}).get(view_name)
+    if not budget:
+        return
+
+    exceeded = [
+        "%s %s > %s" % (key, values[key], budget[key])
+        for key in BUDGET_KEYS
+        if key in budget and values[key] > budget[key]
+    ]
+    if exceeded:
+        message = "%s over budget: %s" % (view_name, ", ".join(exceeded))
+        if getattr(settings, "REQUEST_BUDGETS_STRICT", False):
+            raise BudgetExceeded(message)
+        logger.warning(message, extra={"metrics": values})
+
+
+def report(request, response, metrics):
+    view_name = get_view_name(request)
+    values = {
+        "method": request.method,
+        "path": request.path,
+        "view": view_name,
+        "status": response.status_code,
+        **metrics.as_dict(),
+    }
+    logger.info(
+        " ".join("%s=%s" % (key, value) for key, value in values.items()),
+        extra={"metrics": values},
+    )
+    check_budget(view_name, values)
+
+
+def iter_then_report(content, callback):
+    try:
+        yield from content
+    finally:
+        callback()
+
+
+async def aiter_then_report(content, callback):
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        callback()
+
+
+def install_execute_wrappers(stack, metrics):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(metrics))
+
+
+class RequestMetricsMiddleware(MiddlewareMixin):
+    """
+    Measure a sample of requests. Should come first in MIDDLEWARE so that
+    the time spent in other middleware is included.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not is_sampled():
+            _current.set(None)
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        _current.set(metrics)
+        with ExitStack() as stack:
+            install_execute_wrappers(stack, metrics)
+            response = self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not is_sampled():
+            _current.set(None)
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        _current.set(metrics)
+        # Database connections belong to the thread that synchronous code
+        # (and the async ORM) runs in for this request, so the wrappers are
+        # installed, and removed, there.
+        stack = ExitStack()
+        await sync_to_async(install_execute_wrappers)(stack, metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        if getattr(settings, "REQUEST_METRICS_SERVER_TIMING", True):
+            response["Server-Timing"] = format_server_timing(metrics)
+
+        if response.streaming:
+            # Log once the body has been sent, so storage reads are counted.
+            def callback():
+                report(request, response, metrics)
+
+            if response.is_async:
+                response.streaming_content = aiter_then_report(
+                    response.streaming_content, callback
+                )
+            else:
+                response.streaming_content = iter_then_report(
+                    response.streaming_content, callback
+                )
+        else:
+            report(request, response, metrics)
+        return response
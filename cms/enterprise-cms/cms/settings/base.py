@@ -28,6 +28,7 @@ INSTALLED_APPS = [
     "search",
     "wagtail.contrib.forms",
     "wagtail.contrib.redirects",
+    "wagtail.contrib.search_promotions",
     "wagtail.embeds",
     "wagtail.sites",
     "wagtail.users",
@@ -49,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "cms.log.RequestLogMiddleware",
+    "cms.request_metrics.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -56,7 +59,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "wagtail.contrib.redirects.middleware.RedirectMiddleware",
+    "cms.site_index.RedirectMiddleware",
+    "cms.site_index.SiteMiddleware",
 ]
 
 ROOT_URLCONF = "cms.urls"
@@ -179,3 +183,19 @@ WAGTAILADMIN_BASE_URL = "http://example.com"
 # if untrusted users are allowed to upload files -
 # see https://docs.wagtail.org/en/stable/advanced_topics/deploying.html#user-uploaded-files
 WAGTAILDOCS_EXTENSIONS = ['csv', 'docx', 'key', 'odt', 'pdf', 'pptx', 'rtf', 'txt', 'xlsx', 'zip']
+
+# Renditions rendered by "manage.py process_rendition_queue" when an image is
+# saved (and by "manage.py warm_renditions" for existing images): the admin's listing
+# thumbnail and edit view preview. Add the specs used by page templates.
+RENDITION_WARMUP_FILTERS = ["max-165x165", "max-800x600"]
+
+# Request metrics
+# Database query limits per URL name, checked by cms.request_metrics. Requests
+# over budget are logged, or fail tests that set REQUEST_BUDGETS_STRICT.
+REQUEST_BUDGETS = {
+    "wagtail_serve": {"queries": 15},
+    "search": {"queries": 10},
+    "search_autocomplete": {"queries": 5},
+    "serve_private_media": {"queries": 10},
+    "wagtaildocs_serve": {"queries": 10},
+}
@@ -1,11 +1,16 @@
 import os
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 from .base import *
 
 DEBUG = False
 
 # Add WhiteNoise middleware for static files
 MIDDLEWARE = [
+    # Request ids for log records, and the sampled access log; keep this first
+    "cms.log.RequestLogMiddleware",
+    # Query, cache and latency metrics for a sample of requests
+    "cms.request_metrics.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  # Add this after SecurityMiddleware
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -14,9 +19,47 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "wagtail.contrib.redirects.middleware.RedirectMiddleware",
+    # Resolve sites and redirects from an in-process index, not the database
+    "cms.site_index.RedirectMiddleware",
+    "cms.site_index.SiteMiddleware",
+    # Serve anonymous page views from the cache; keep this last
+    "cms.page_cache.PageCacheMiddleware",
 ]
 
+# WhiteNoise's middleware is synchronous; under ASGI, cms.asgi serves the
+# static files in front of Django instead.
+if os.environ.get('ASGI', 'false').lower() == 'true':
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
+
+# Seconds an anonymous page response stays cached. Publishing, unpublishing
+# or moving a page invalidates it (and its ancestors) straight away.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 300))
+
+# Sites and redirects are held in memory by each worker. A change made in one
+# worker is picked up by the others within SITE_INDEX_REFRESH_INTERVAL seconds.
+SITE_INDEX_REFRESH_INTERVAL = int(os.environ.get('SITE_INDEX_REFRESH_INTERVAL', 5))
+
+# Django's cached template loader (on when DEBUG is off) keeps compiled
+# templates for the life of the worker. Compile the project's templates when
+# the application loads (in the gunicorn master with preload) rather than on
+# each worker's first requests.
+TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', 'true').lower() == 'true'
+
+# Measure REQUEST_METRICS_SAMPLE_RATE of requests (0 to 1): database queries,
+# cache hits and latency are logged to cms.request_metrics. Latency budgets are
+# added to the query budgets in base. The Server-Timing header would show them
+# to any client, so it is off unless REQUEST_METRICS_SERVER_TIMING is set.
+REQUEST_METRICS_SAMPLE_RATE = float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', 0.05))
+REQUEST_METRICS_SERVER_TIMING = os.environ.get('REQUEST_METRICS_SERVER_TIMING', 'false').lower() == 'true'
+for url_name, duration_ms in {
+    'wagtail_serve': 500,
+    'search': 500,
+    'search_autocomplete': 100,
+    'serve_private_media': 1000,
+    'wagtaildocs_serve': 1000,
+}.items():
+    REQUEST_BUDGETS[url_name] = {**REQUEST_BUDGETS[url_name], 'duration_ms': duration_ms}
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-change-me')
 
@@ -30,15 +73,42 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 # Database configuration for PostgreSQL
+# Each worker process keeps a psycopg connection pool shared by its threads,
+# instead of one persistent connection per thread. DATABASE_POOL=false goes
+# back to persistent connections.
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+DATABASE_POOL = os.environ.get('DATABASE_POOL', 'true').lower() == 'true'
+
+
+def database_config(url):
+    config = dj_database_url.parse(
+        url,
+        conn_max_age=0 if DATABASE_POOL else 600,
+        conn_health_checks=not DATABASE_POOL,
+    )
+    if DATABASE_POOL and config['ENGINE'] == 'django.db.backends.postgresql':
+        config.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 8)),
+            'timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        }
+    return config
+
+
 if DATABASE_URL:
     DATABASES = {
-        'default': dj_database_url.parse(
-            DATABASE_URL,
-            conn_max_age=600,
-            conn_health_checks=True
-        )
+        'default': database_config(DATABASE_URL),
     }
+
+    # Serve page views and search from a read replica, pinning clients to
+    # the primary for DATABASE_REPLICA_PIN_SECONDS after they write.
+    if DATABASE_REPLICA_URL:
+        DATABASES['replica'] = database_config(DATABASE_REPLICA_URL)
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+        DATABASE_ROUTERS = ['cms.db_routers.ReplicaRouter']
+        DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', 10))
+        MIDDLEWARE.insert(2, 'cms.db_routers.ReplicaRoutingMiddleware')
 else:
     # Fallback to SQLite for now to get the app running
     DATABASES = {
@@ -48,25 +118,61 @@ else:
         }
     }
 
+# What "manage.py bootstrap" does about migrations at container start-up:
+# "auto" applies them only when some are pending, "check" refuses to start
+# with pending migrations, "skip" does not look.
+STARTUP_MIGRATIONS = os.environ.get('STARTUP_MIGRATIONS', 'auto')
+
+# Search
+# On PostgreSQL, use full-text search over stored, GIN-indexed tsvectors with
+# weighted title/body fields, ranked in SQL. Index entries are updated as
+# pages are published; rebuild with "manage.py rebuild_search_index".
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    WAGTAILSEARCH_BACKENDS = {
+        'default': {
+            'BACKEND': 'search.backends',
+            'SEARCH_CONFIG': os.environ.get('SEARCH_CONFIG', 'english'),
+        }
+    }
+
+# With SEARCH_INDEX_QUEUE, saves only queue index updates and a separate
+# "manage.py process_search_queue" worker applies them in batches, so the
+# backends no longer update the index in the request.
+SEARCH_INDEX_QUEUE = os.environ.get('SEARCH_INDEX_QUEUE', 'false').lower() == 'true'
+if SEARCH_INDEX_QUEUE:
+    for backend in WAGTAILSEARCH_BACKENDS.values():
+        backend['AUTO_UPDATE'] = False
+
+# Search query hits are buffered per worker and written in bulk every
+# SEARCH_HITS_FLUSH_INTERVAL seconds, or once SEARCH_HITS_FLUSH_SIZE are waiting.
+SEARCH_HITS_FLUSH_INTERVAL = int(os.environ.get('SEARCH_HITS_FLUSH_INTERVAL', 30))
+SEARCH_HITS_FLUSH_SIZE = int(os.environ.get('SEARCH_HITS_FLUSH_SIZE', 100))
+
 # Azure Blob Storage configuration
 AZURE_ACCOUNT_NAME = os.environ.get('AZURE_STORAGE_ACCOUNT_NAME')
 AZURE_ACCOUNT_KEY = os.environ.get('AZURE_STORAGE_ACCOUNT_KEY')
 
-# Serve static files from container, media files from Azure Storage
+# Serve static files from container, media files from Azure Storage.
+# collectstatic writes Brotli and gzip variants of the hashed files in
+# STATICFILES_COMPRESS_WORKERS processes (default: one per CPU) and lists them
+# in STATIC_ROOT/cdn-manifest.json; WhiteNoise serves hashed names as immutable.
 STORAGES = {
     "staticfiles": {
-        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+        "BACKEND": "cms.staticfiles.StaticFilesStorage",
     },
 }
+STATICFILES_COMPRESS_WORKERS = int(os.environ.get('STATICFILES_COMPRESS_WORKERS', 0)) or None
 
 # Static files served from container using WhiteNoise
 STATIC_URL = '/static/'
 STATIC_ROOT = '/app/staticfiles'
 
+AZURE_UPLOAD_BLOCK_SIZE = int(os.environ.get('AZURE_UPLOAD_BLOCK_SIZE_MB', 4)) * 1024 * 1024
+
 if AZURE_ACCOUNT_NAME and AZURE_ACCOUNT_KEY:
     # Use Azure Blob Storage for media files only
     STORAGES["default"] = {
-        "BACKEND": "storages.backends.azure_storage.AzureStorage",
+        "BACKEND": "cms.storage.AzureMediaStorage",
         "OPTIONS": {
             "azure_container": "media",
             "account_name": AZURE_ACCOUNT_NAME,
@@ -75,6 +181,13 @@ if AZURE_ACCOUNT_NAME and AZURE_ACCOUNT_KEY:
             "azure_ssl": True,
             "expiration_secs": 3600,  # URLs expire after 1 hour
             "custom_domain": None,  # Don't use custom domain for private storage
+            # The Azure SDK uploads files larger than one block in blocks of
+            # this many MB, upload_max_conn of them at once
+            "client_options": {
+                "max_single_put_size": AZURE_UPLOAD_BLOCK_SIZE,
+                "max_block_size": AZURE_UPLOAD_BLOCK_SIZE,
+            },
+            "upload_max_conn": int(os.environ.get('AZURE_UPLOAD_MAX_CONN', 8)),
         },
     }
     
@@ -93,6 +206,31 @@ else:
     MEDIA_URL = '/media/'
     MEDIA_ROOT = '/app/media'
 
+# How authenticated media requests are delivered: "proxy" streams the file
+# through the worker, "redirect" sends a 302 to a short-lived signed Azure URL,
+# "accel"/"sendfile" hand the file to a fronting nginx/Apache.
+PRIVATE_MEDIA_SERVE_MODE = os.environ.get('PRIVATE_MEDIA_SERVE_MODE', 'proxy')
+PRIVATE_MEDIA_REDIRECT_EXPIRY = int(os.environ.get('PRIVATE_MEDIA_REDIRECT_EXPIRY', 60))
+PRIVATE_MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('PRIVATE_MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# How /documents/ downloads are delivered, after Wagtail's collection privacy
+# checks; same values as PRIVATE_MEDIA_SERVE_MODE. Unset, documents in Azure
+# are redirected to signed URLs and local ones follow PRIVATE_MEDIA_SERVE_MODE.
+DOCUMENT_SERVE_MODE = os.environ.get('DOCUMENT_SERVE_MODE')
+
+# Cache media metadata and files up to 256 KB per process, backed by the
+# default cache so other workers can reuse what one of them has fetched
+PRIVATE_MEDIA_CACHE_ALIAS = 'default'
+PRIVATE_MEDIA_CACHE_MEMORY_SIZE = 32 * 1024 * 1024
+PRIVATE_MEDIA_CACHE_MAX_OBJECT_SIZE = 256 * 1024
+
+# Processes that render queued images' RENDITION_WARMUP_FILTERS renditions in
+# each "manage.py process_rendition_queue" worker; web workers only queue them.
+RENDITION_WARMUP_WORKERS = int(os.environ.get('RENDITION_WARMUP_WORKERS', 2))
+
+# Use the async media and search views; set by cms.asgi when running under ASGI.
+ASYNC_VIEWS = os.environ.get('ASGI', 'false').lower() == 'true'
+
 # Security settings for production
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -106,12 +244,20 @@ SESSION_COOKIE_SECURE = False  # Set to False for Azure App Service testing
 CSRF_COOKIE_SECURE = False     # Set to False for Azure App Service testing
 
 # Logging configuration
+# Records are queued and written to stderr as JSON lines by a background
+# thread, tagged with the request id. The access log (cms.access) is a
+# ACCESS_LOG_SAMPLE_RATE sample plus all 5xx responses and requests slower
+# than ACCESS_LOG_SLOW_MS, at most ACCESS_LOG_RATE_LIMIT lines a second per worker.
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 0.1))
+ACCESS_LOG_SLOW_MS = int(os.environ.get('ACCESS_LOG_SLOW_MS', 1000))
+ACCESS_LOG_RATE_LIMIT = int(os.environ.get('ACCESS_LOG_RATE_LIMIT', 100))
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            '()': 'cms.log.QueueHandler',
+            'maxsize': int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
         },
     },
     'root': {
@@ -144,13 +290,54 @@ if APPLICATIONINSIGHTS_CONNECTION_STRING:
         'ikey': APPLICATIONINSIGHTS_CONNECTION_STRING,
     }
 
-# Cache configuration (optional - using local memory cache)
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Cache configuration
+# Use Redis when REDIS_URL is set so every worker and instance shares one cache;
+# otherwise fall back to a file-based cache shared by the workers of this
+# container. CACHE_BACKEND=locmem restores the old per-process cache.
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'redis' if REDIS_URL else 'filebased')
+if CACHE_BACKEND == 'redis':
+    if not REDIS_URL:
+        raise ImproperlyConfigured('CACHE_BACKEND=redis requires REDIS_URL to be set.')
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'cms',
+            'TIMEOUT': 300,
+        }
     }
-}
+elif CACHE_BACKEND == 'filebased':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', '/tmp/django_cache'),
+            'TIMEOUT': 300,
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
+    }
+
+# Wagtail caches rendition lookups for {% image %} in a "renditions" cache if
+# there is one. Its keys include the image's file hash, so entries can be kept
+# for a day; deleting a rendition removes its entry.
+CACHES['renditions'] = {**CACHES['default'], 'TIMEOUT': 24 * 60 * 60}
+if CACHE_BACKEND == 'filebased':
+    CACHES['renditions']['LOCATION'] = os.path.join(CACHES['default']['LOCATION'], 'renditions')
+elif CACHE_BACKEND == 'locmem':
+    CACHES['renditions']['LOCATION'] = 'renditions'
+
+# Sessions are read from the cache and only written through to the database,
+# so authenticated requests no longer pay for a session query
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
 
 # Email configuration (you may want to configure this for your email provider)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -0,0 +1,271 @@
+"""
+In-process index of sites, their root pages and redirects.
+
+Wagtail resolves the ``Site`` for every request with a database query (and
+another to load the root page's specific object), and its redirect
+middleware queries for a matching ``Redirect`` on every 404. Here all of
+them are loaded once into memory: ``SiteMiddleware`` hands each request a
+copy of its site before the view runs, and ``RedirectMiddleware`` looks 404s
+up in a dict of normalised old paths. In steady state neither makes a query.
+
+The index is built on first use and dropped by the signal handlers in
+``home.signal_handlers`` when a site or redirect changes, when a site root
+page, one of its children or a page containing a redirect target is saved,
+published, unpublished or deleted, and when any page is moved. They also
+bump a version number in the shared cache, which other processes check at
+most every SITE_INDEX_REFRESH_INTERVAL seconds.
+"""
+
+import copy
+import threading
+import time
+from urllib.parse import urlparse
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django import http
+from django.conf import settings
+from django.core.cache import cache
+from django.http.request import split_domain_port
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.encoding import uri_to_iri
+
+from wagtail.contrib.redirects.models import Redirect
+from wagtail.models import Page, Site
+from wagtail.models.sites import (
+    MATCH_DEFAULT,
+    MATCH_HOSTNAME,
+    MATCH_HOSTNAME_DEFAULT,
+    MATCH_HOSTNAME_PORT,
+)
+
+VERSION_CACHE_KEY = "site-index:version"
+
+
+class SiteIndex:
+    def __init__(self, version=None):
+        self.version = version
+        self.sites = []
+        self.root_url_paths = set()
+        self.redirects = {}
+        self.redirect_page_paths = set()
+
+    @classmethod
+    def build(cls, version=None):
+        index = cls(version)
+        sites = list(Site.objects.order_by("pk"))
+        root_pages = Page.objects.filter(
+            pk__in=[site.root_page_id for site in sites]
+        ).specific()
+        root_pages = {page.pk: page for page in root_pages}
+        for site in sites:
+            site.root_page = root_pages[site.root_page_id]
+        index.sites = sites
+        index.root_url_paths = {page.url_path for page in root_pages.values()}
+
+        for redirect in Redirect.objects.select_related("redirect_page"):
+            index.redirects[(redirect.site_id, redirect.old_path)] = redirect
+            if redirect.redirect_page is not None:
+                index.redirect_page_paths.add(redirect.redirect_page.path)
+        return index
+
+    def find_site(self, hostname, port):
+        """
+        Return the site for ``hostname`` and ``port`` (a string, as from
+        ``request.get_port()``) by the same rules as
+        ``wagtail.models.sites.get_site_for_hostname``, or ``None``.
+        """
+        matches = []
+        for site in self.sites:
+            if site.hostname == hostname:
+                if str(site.port) == port:
+                    match = MATCH_HOSTNAME_PORT
+                elif site.is_default_site:
+                    match = MATCH_HOSTNAME_DEFAULT
+                else:
+                    match = MATCH_HOSTNAME
+            elif site.is_default_site:
+                match = MATCH_DEFAULT
+            else:
+                continue
+            matches.append((match, site))
+
+        if not matches:
+            return None
+        matches.sort(key=lambda item: item[0])
+        if len(matches) == 1 or matches[0][0] in (
+            MATCH_HOSTNAME_PORT,
+            MATCH_HOSTNAME_DEFAULT,
+        ):
+            return matches[0][1]
+        if matches[0][0] == MATCH_DEFAULT:
+            # Prefer a single site on the hostname to the default site.
+            return matches[len(matches) == 2][1]
+        return None
+
+    def get_site_for_request(self, request):
+        """
+        Return a copy of the site for ``request``, with its own copy of the
+        root page, so that nothing a request caches on them is shared.
+        """
+        hostname = split_domain_port(request._get_raw_host())[0]
+        site = self.find_site(hostname, request.get_port())
+        if site is None:
+            return None
+        root_page = copy.copy(site.root_page)
+        site = copy.copy(site)
+        site.root_page = root_page
+        return site
+
+    def get_redirect(self, site, path):
+        """
+        Return the redirect for ``path``, preferring one specific to
+        ``site`` over one for all sites, as Wagtail's middleware does.
+        """
+        if "\0" in path:
+            return None
+        for candidate in (path, uri_to_iri(path)):
+            if site is not None:
+                redirect = self.redirects.get((site.pk, candidate))
+                if redirect is not None:
+                    return redirect
+            redirect = self.redirects.get((None, candidate))
+            if redirect is not None:
+                return redirect
+        return None
+
+    def affects(self, page):
+        """
+        Whether a change to ``page`` makes the index stale: it is a site root
+        page or a child of one (changing the root's ``numchild``), or it is
+        or contains the target of a redirect, whose URL may have changed.
+        """
+        if page.url_path in self.root_url_paths:
+            return True
+        parent_url_path = page.url_path.rstrip("/").rpartition("/")[0] + "/"
+        if parent_url_path in self.root_url_paths:
+            return True
+        return any(path.startswith(page.path) for path in self.redirect_page_paths)
+
+
+_index = None
+_index_lock = threading.Lock()
+_last_version_check = 0
+
+
+def get_site_index():
+    """
+    Return the current index, building it on first use or once another
+    process has published changes.
+    """
+    global _index, _last_version_check
+
+    index = _index
+    interval = getattr(settings, "SITE_INDEX_REFRESH_INTERVAL", 5)
+    stale = index is None
+    if (
+        not stale
+        and interval is not None
+        and time.monotonic() - _last_version_check >= interval
+    ):
+        _last_version_check = time.monotonic()
+        stale = cache.get(VERSION_CACHE_KEY) != index.version
+
+    if stale:
+        with _index_lock:
+            # Another thread may have rebuilt it while this one waited.
+            if _index is index or _index is None:
+                _index = SiteIndex.build(cache.get(VERSION_CACHE_KEY))
+                _last_version_check = time.monotonic()
+            index = _index
+    return index
+
+
+def invalidate():
+    """
+    Discard the index in this process and tell other processes to do the
+    same.
+    """
+    global _index
+    _index = None
+    cache.set(VERSION_CACHE_KEY, uuid4().hex, None)
+
+
+def invalidate_for_page(page):
+    index = _index
+    if index is None or index.affects(page):
+        invalidate()
+
+
+def reset():
+    global _index
+    _index = None
+
+
+def find_site_for_request(request):
+    """
+    Like ``Site.find_for_request``, but from the index. The result is stored
+    on the request where ``Site.find_for_request`` looks for it, so later
+    lookups (page routing, ``{% wagtail_site %}``) make no query either.
+    """
+    if not hasattr(request, "_wagtail_site"):
+        request._wagtail_site = get_site_index().get_site_for_request(request)
+    return request._wagtail_site
+
+
+class SiteMiddleware(MiddlewareMixin):
+    """
+    Resolve the Wagtail site for each request from the index.
+
+    This is done just before the view runs, so responses served by the page
+    cache never touch the index.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        find_site_for_request(request)
+
+
+class RedirectMiddleware(MiddlewareMixin):
+    """
+    Replacement for ``wagtail.contrib.redirects.middleware.RedirectMiddleware``
+    that looks redirects up in the index.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if response.status_code != 404:
+            return response
+        return self.redirect_not_found(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if response.status_code != 404:
+            return response
+        # The index may need (re)loading from the database.
+        return await sync_to_async(self.redirect_not_found)(request, response)
+
+    def redirect_not_found(self, request, response):
+        """
+        Return a redirect for the path of a 404 ``response``, if there is one,
+        or the response itself.
+        """
+        index = get_site_index()
+        site = find_site_for_request(request)
+        path = Redirect.normalise_path(request.get_full_path())
+        redirect = index.get_redirect(site, path)
+        if redirect is None:
+            path_without_query = urlparse(path).path
+            if path == path_without_query:
+                return response
+            redirect = index.get_redirect(site, path_without_query)
+            if redirect is None:
+                return response
+
+        link = redirect.link
+        if link is None:
+            return response
+        if redirect.is_permanent:
+            return http.HttpResponsePermanentRedirect(link)
+        return http.HttpResponseRedirect(link)
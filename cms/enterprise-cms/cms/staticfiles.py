@@ -0,0 +1,163 @@
+"""
+Static files storage for production: hashed names, Brotli and gzip variants
+compressed in parallel, and a manifest of the hashed files for the CDN.
+
+WhiteNoise's ``CompressedManifestStaticFilesStorage`` compresses every file
+twice over, under its original and its hashed name, in threads of the
+``collectstatic`` process. Brotli at its highest quality is CPU-bound, so on
+the image build this step takes longer than everything else together. Here
+only the hashed files are compressed (the names ``{% static %}`` produces;
+the originals are still collected and served, uncompressed) and the work is
+spread over STATICFILES_COMPRESS_WORKERS processes.
+
+Hashed names are cached by WhiteNoise with ``max-age`` of ten years and
+``immutable``. Once the files are compressed, STATICFILES_CDN_MANIFEST (a
+JSON file in STATIC_ROOT) lists each of them with its URL, size and
+precompressed encodings, for preloading a CDN ahead of a release.
+
+``WhiteNoiseMiddleware`` is synchronous, so under ASGI Django would run it,
+and the rest of the middleware chain with it, in a thread for every request.
+There ``StaticFilesApplication`` serves the same files, with the same
+headers, in front of Django instead (see ``cms.asgi``).
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import HashedFilesMixin
+from django.core.files.base import ContentFile
+
+from whitenoise.compress import Compressor
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+ENCODINGS = {".br": "br", ".gz": "gzip"}
+
+
+def compress_file(path, extensions):
+    """
+    Write the compressed variants of the file at ``path`` and return their
+    paths. Runs in a worker process.
+    """
+    return Compressor(extensions=extensions, quiet=True).compress(path)
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    def post_process(self, *args, **kwargs):
+        self.compressed_names = {}
+        yield from super().post_process(*args, **kwargs)
+
+        manifest_name = getattr(settings, "STATICFILES_CDN_MANIFEST", "cdn-manifest.json")
+        if manifest_name and not kwargs.get("dry_run"):
+            self.save_cdn_manifest(manifest_name)
+
+    def compress_files(self, paths):
+        extensions = getattr(settings, "WHITENOISE_SKIP_COMPRESS_EXTENSIONS", None)
+        compressor = Compressor(extensions=extensions, quiet=True)
+        hashed_names = set(self.hashed_files.values())
+        paths = sorted(
+            path
+            for path in paths
+            if path in hashed_names and compressor.should_compress(path)
+        )
+        if not paths:
+            return
+
+        workers = getattr(settings, "STATICFILES_COMPRESS_WORKERS", None)
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(
+                compress_file,
+                [self.path(path) for path in paths],
+                [extensions] * len(paths),
+                chunksize=8,
+            )
+            for path, compressed_paths in zip(paths, results):
+                full_path = self.path(path)
+                for compressed_path in compressed_paths:
+                    compressed_name = path + compressed_path[len(full_path) :]
+                    self.compressed_names.setdefault(path, []).append(compressed_name)
+                    yield path, compressed_name
+
+    def save_cdn_manifest(self, manifest_name):
+        files = {}
+        for name in sorted(set(self.hashed_files.values())):
+            encodings = {
+                ENCODINGS[os.path.splitext(compressed_name)[1]]: self.size(
+                    compressed_name
+                )
+                for compressed_name in self.compressed_names.get(name, [])
+            }
+            # The name is hashed already, so skip the manifest lookup.
+            url = super(HashedFilesMixin, self).url(name)
+            files[url] = {"size": self.size(name), "encodings": encodings}
+
+        if self.exists(manifest_name):
+            self.delete(manifest_name)
+        contents = json.dumps({"version": 1, "files": files}, indent=1)
+        self._save(manifest_name, ContentFile(contents.encode()))
+
+
+class StaticFilesApplication:
+    """
+    ASGI application that serves static files as ``WhiteNoiseMiddleware``
+    would, configured by the same settings, and passes other requests on to
+    ``application``. Static requests never reach Django's middleware.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, application):
+        self.application = application
+        self.whitenoise = WhiteNoiseMiddleware()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            static_file = self.find_file(scope)
+            if static_file is not None:
+                return await self.serve(static_file, scope, send)
+        return await self.application(scope, receive, send)
+
+    def find_file(self, scope):
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path) :]
+        if self.whitenoise.autorefresh:
+            return self.whitenoise.find_file(path)
+        return self.whitenoise.files.get(path)
+
+    async def serve(self, static_file, scope, send):
+        # WhiteNoise reads request headers from a WSGI environ.
+        environ = {
+            "HTTP_%s" % name.decode("latin-1").upper().replace("-", "_"): value.decode(
+                "latin-1"
+            )
+            for name, value in scope["headers"]
+        }
+        response = static_file.get_response(scope["method"], environ)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": int(response.status),
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in response.headers
+                ],
+            }
+        )
+        if response.file is None:
+            await send({"type": "http.response.body"})
+            return
+
+        read = sync_to_async(response.file.read, thread_sensitive=False)
+        try:
+            while chunk := await read(self.chunk_size):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            await send({"type": "http.response.body"})
+        finally:
+            response.file.close()
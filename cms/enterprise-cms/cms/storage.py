@@ -0,0 +1,83 @@
+"""
+Azure Blob storage for media, with an asyncio client for async views.
+
+``AzureStorage`` only has a synchronous client, so an async view would have to
+hand every blob request to a thread. ``AzureMediaStorage`` also builds an
+``azure.storage.blob.aio`` container client, with the same account and
+credentials, for the running event loop; the ``a``-prefixed helpers in
+``cms.media`` use it when present. The client keeps its connection pool for
+the life of the loop, i.e. of the ASGI worker, and is closed when the worker
+shuts down (see ``cms.asgi``).
+"""
+
+import asyncio
+import weakref
+
+from storages.backends.azure_storage import AzureStorage
+
+
+class AzureMediaStorage(AzureStorage):
+    def __init__(self, **settings):
+        super().__init__(**settings)
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_service_clients = weakref.WeakKeyDictionary()
+
+    def _get_async_service_client(self):
+        from azure.storage.blob.aio import BlobServiceClient
+
+        if self.connection_string is not None:
+            return BlobServiceClient.from_connection_string(self.connection_string)
+
+        if self.account_key:
+            credential = {
+                "account_name": self.account_name,
+                "account_key": self.account_key,
+            }
+        elif self.sas_token:
+            credential = self.sas_token
+        else:
+            # Token credentials are synchronous objects and cannot be used by
+            # the asyncio client.
+            return None
+
+        account_url = "%s://%s.blob.%s" % (
+            self.azure_protocol,
+            self.account_name,
+            self.endpoint_suffix,
+        )
+        return BlobServiceClient(
+            account_url, credential=credential, **self.client_options
+        )
+
+    def get_async_client(self):
+        """
+        Return the asyncio container client for the running event loop, or
+        ``None`` outside of one.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+        client = self._async_clients.get(loop)
+        if client is None:
+            service_client = self._get_async_service_client()
+            if service_client is None:
+                return None
+            client = service_client.get_container_client(self.azure_container)
+            self._async_clients[loop] = client
+            # The container client shares the service client's transport,
+            # which only the service client closes.
+            self._async_service_clients[loop] = service_client
+        return client
+
+    async def aclose_async_clients(self):
+        """
+        Close the asyncio client of the running event loop, and its
+        connection pool.
+        """
+        loop = asyncio.get_running_loop()
+        self._async_clients.pop(loop, None)
+        service_client = self._async_service_clients.pop(loop, None)
+        if service_client is not None:
+            await service_client.close()
@@ -0,0 +1,60 @@
+"""
+Template compilation at start-up.
+
+Django's cached template loader compiles each template the first time it is
+rendered in a process, so the first requests of every new worker pay for
+parsing ``base.html`` and the page templates (and, with ``max_requests``,
+workers are replaced regularly). With TEMPLATE_WARMUP, ``warm_templates()``
+compiles every template in the project's own template directories when the
+application is loaded (see ``cms.wsgi``); with gunicorn's ``preload_app`` that
+happens once in the master, and the workers share the compiled templates.
+"""
+
+import logging
+import os
+
+from django.conf import settings
+from django.template import TemplateSyntaxError, engines
+
+logger = logging.getLogger(__name__)
+
+
+def get_project_template_dirs(engine):
+    """
+    Return the template directories of ``engine`` that belong to the project,
+    leaving out those of installed packages such as the Wagtail admin.
+    """
+    project_dir = os.path.realpath(settings.BASE_DIR)
+    dirs = []
+    for loader in engine.template_loaders:
+        for directory in loader.get_dirs():
+            directory = os.path.realpath(directory)
+            if (
+                os.path.commonpath([project_dir, directory]) == project_dir
+                and directory not in dirs
+            ):
+                dirs.append(directory)
+    return dirs
+
+
+def warm_templates(using="django"):
+    """
+    Compile every template in the project's template directories, so that
+    the cached loader has them before the first request, and return how
+    many were loaded.
+    """
+    engine = engines[using].engine
+    count = 0
+    for directory in get_project_template_dirs(engine):
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(root, filename), directory)
+                try:
+                    engine.get_template(name.replace(os.sep, "/"))
+                except TemplateSyntaxError:
+                    # Left for the request that renders it to report.
+                    logger.exception("Could not compile template %s", name)
+                    continue
+                count += 1
+    return count
+
@@ -0,0 +1,1088 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+import tempfile
+import tracemalloc
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.http import HttpResponse
+from django.templatetags.static import static
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import path, re_path, reverse
+
+from wagtail.documents import get_document_model
+from wagtail.images import get_image_model
+from wagtail.images.models import Filter
+from wagtail.images.tests.utils import get_test_image_file
+from wagtail.models import CollectionViewRestriction, Page
+
+from cms import log, renditions
+from cms.db_routers import (
+    PIN_COOKIE_NAME,
+    ReplicaRouter,
+    ReplicaRoutingMiddleware,
+)
+from cms.log import RequestLogMiddleware
+from cms.media_cache import (
+    LRUCache,
+    MediaCache,
+    get_media_cache,
+    get_storage_key,
+)
+from cms.page_cache import PageCacheMiddleware
+from cms.request_metrics import BudgetExceeded, RequestMetricsMiddleware
+from cms.site_index import RedirectMiddleware, SiteMiddleware
+from cms.staticfiles import StaticFilesApplication
+from cms.views import serve_document_async, serve_private_media_async
+from home.models import RenditionQueueEntry
+
+# Routes for the async views, which cms.urls only uses under ASGI.
+urlpatterns = [
+    path(
+        "media/<path:path>",
+        serve_private_media_async,
+        name="serve_private_media",
+    ),
+    re_path(r"^documents/(\d+)/(.*)$", serve_document_async, name="wagtaildocs_serve"),
+]
+
+
+class PrivateMediaTestCase(TestCase):
+    """
+    Base class for tests against the private media view, backed by a
+    temporary MEDIA_ROOT on the local filesystem.
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, REQUEST_BUDGETS_STRICT=True
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = get_user_model().objects.create_user(
+            username="editor", password="password"
+        )
+        self.client.force_login(self.user)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+    def media_url(self, name):
+        return reverse("serve_private_media", args=[name])
+
+
+class ServePrivateMediaTests(PrivateMediaTestCase):
+    """
+    Tests for streaming private media files.
+    """
+
+    def test_anonymous_user_redirected_to_login(self):
+        self.client.logout()
+        self.write_file("images/a.png", b"png")
+        response = self.client.get(self.media_url("images/a.png"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_missing_file_returns_404(self):
+        response = self.client.get(self.media_url("images/missing.png"))
+        self.assertEqual(response.status_code, 404)
+
+    def test_file_is_streamed(self):
+        content = os.urandom(200 * 1024)
+        self.write_file("documents/report.pdf", content)
+        response = self.client.get(self.media_url("documents/report.pdf"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(response["Content-Length"], str(len(content)))
+        self.assertEqual(b"".join(response.streaming_content), content)
+
+    @override_settings(PRIVATE_MEDIA_CHUNK_SIZE=64 * 1024)
+    def test_peak_memory_flat_as_file_size_grows(self):
+        def peak_memory(size):
+            name = "documents/%d.bin" % size
+            self.write_file(name, b"\0" * size)
+            response = self.client.get(self.media_url(name))
+            tracemalloc.start()
+            try:
+                for chunk in response.streaming_content:
+                    pass
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                response.close()
+
+        small = peak_memory(1024 * 1024)
+        large = peak_memory(32 * 1024 * 1024)
+        # Peak usage is bounded by the chunk size, not the file size.
+        self.assertLess(large, 1024 * 1024)
+        self.assertLess(large, small * 2)
+
+
+class PrivateMediaValidatorTests(PrivateMediaTestCase):
+    """
+    Tests for conditional and range requests against private media.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.write_file("documents/report.pdf", self.content)
+        self.url = self.media_url("documents/report.pdf")
+
+    def test_validators_sent(self):
+        response = self.client.get(self.url)
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_if_modified_since_returns_304(self):
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_single_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/1024")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+
+    def test_suffix_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-100")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.content[-100:])
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9,100-109")
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges"))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        self.assertIn(b"Content-Range: bytes 0-9/1024\r\n\r\n" + self.content[:10], body)
+        self.assertIn(
+            b"Content-Range: bytes 100-109/1024\r\n\r\n" + self.content[100:110], body
+        )
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_stale_if_range_serves_whole_file(self):
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+
+class SignedURLStorage(FileSystemStorage):
+    """
+    Stand-in for a remote storage backend that hands out signed URLs.
+    """
+
+    def url(self, name, expire=None, parameters=None):
+        url = "https://blob.example.com/media/%s?se=%d" % (name, expire)
+        for key, value in (parameters or {}).items():
+            url += "&%s=%s" % (key, value)
+        return url
+
+
+class RemoteSignedURLStorage(SignedURLStorage):
+    """
+    Like ``SignedURLStorage``, without local paths, as for Azure.
+    """
+
+    def path(self, name):
+        raise NotImplementedError
+
+
+class PrivateMediaOffloadTests(PrivateMediaTestCase):
+    """
+    Tests for the offloaded private media serve modes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write_file("images/a.png", b"png")
+        self.url = self.media_url("images/a.png")
+
+    @override_settings(
+        PRIVATE_MEDIA_SERVE_MODE="redirect",
+        PRIVATE_MEDIA_REDIRECT_EXPIRY=30,
+        STORAGES={"default": {"BACKEND": "cms.tests.SignedURLStorage"}},
+    )
+    def test_redirect_to_signed_url(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response["Location"], "https://blob.example.com/media/images/a.png?se=30"
+        )
+        self.assertIn("no-store", response["Cache-Control"])
+
+    @override_settings(PRIVATE_MEDIA_SERVE_MODE="redirect")
+    def test_redirect_falls_back_to_proxy_without_signed_urls(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"png")
+
+    @override_settings(PRIVATE_MEDIA_SERVE_MODE="redirect")
+    def test_redirect_requires_login(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertTrue(response["Location"].startswith("/accounts/login/"))
+
+    @override_settings(
+        PRIVATE_MEDIA_SERVE_MODE="accel",
+        PRIVATE_MEDIA_ACCEL_REDIRECT_PREFIX="/internal/",
+    )
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/internal/images/a.png")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response.content, b"")
+
+    @override_settings(PRIVATE_MEDIA_SERVE_MODE="sendfile")
+    def test_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response["X-Sendfile"], os.path.join(self.media_root, "images", "a.png")
+        )
+
+
+class ServeDocumentTests(PrivateMediaTestCase):
+    """
+    Tests for serving Wagtail documents through the private media helpers.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.logout()
+        self.content = os.urandom(100 * 1024)
+        self.document = get_document_model().objects.create(
+            title="Report", file=ContentFile(self.content, name="report.zip")
+        )
+        self.url = self.document.url
+
+    def test_document_streamed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertIn("filename=report.zip", response["Content-Disposition"])
+        self.assertEqual(response["Content-Security-Policy"], "default-src 'none'")
+        self.assertEqual(response["X-Content-Type-Options"], "nosniff")
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_range_request(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+
+    def test_wrong_filename_returns_404(self):
+        response = self.client.get(
+            reverse("wagtaildocs_serve", args=[self.document.pk, "other.zip"])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_collection_view_restriction_applies(self):
+        CollectionViewRestriction.objects.create(
+            collection=self.document.collection,
+            restriction_type=CollectionViewRestriction.LOGIN,
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("login", response["Location"])
+
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(
+        DOCUMENT_SERVE_MODE="redirect",
+        STORAGES={"default": {"BACKEND": "cms.tests.SignedURLStorage"}},
+    )
+    def test_redirect_to_signed_url(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(
+            response["Location"].startswith(
+                "https://blob.example.com/media/documents/report.zip?se=60"
+            )
+        )
+        self.assertIn("content_disposition=attachment", response["Location"])
+
+    @override_settings(
+        STORAGES={"default": {"BACKEND": "cms.tests.RemoteSignedURLStorage"}}
+    )
+    def test_remote_storage_redirects_by_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(
+            response["Location"].startswith("https://blob.example.com/media/")
+        )
+
+    @override_settings(DOCUMENT_SERVE_MODE="accel")
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected-media/documents/report.zip"
+        )
+        self.assertIn("filename=report.zip", response["Content-Disposition"])
+        self.assertEqual(response.content, b"")
+
+
+class CountingStorage(FileSystemStorage):
+    """
+    Local stand-in for a remote storage backend that counts round-trips.
+    """
+
+    calls = 0
+
+    def size(self, name):
+        CountingStorage.calls += 1
+        return super().size(name)
+
+    def open(self, name, mode="rb"):
+        CountingStorage.calls += 1
+        return super().open(name, mode)
+
+
+class LRUCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=10, timeout=60)
+        cache.set("a", "a", 4)
+        cache.set("b", "b", 4)
+        cache.get("a")
+        cache.set("c", "c", 4)
+        self.assertEqual(cache.get("a"), "a")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.size, 8)
+
+    def test_oversized_value_not_stored(self):
+        cache = LRUCache(max_size=10, timeout=60)
+        cache.set("a", "a", 11)
+        self.assertEqual(len(cache), 0)
+
+
+@override_settings(STORAGES={"default": {"BACKEND": "cms.tests.CountingStorage"}})
+class MediaCacheTests(PrivateMediaTestCase):
+    """
+    Tests for the metadata and small-object cache in front of storage.
+    """
+
+    def setUp(self):
+        super().setUp()
+        CountingStorage.calls = 0
+
+    def test_small_file_served_from_cache(self):
+        self.write_file("images/a.png", b"png")
+        url = self.media_url("images/a.png")
+        self.assertEqual(b"".join(self.client.get(url).streaming_content), b"png")
+        calls = CountingStorage.calls
+
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), b"png")
+        self.assertEqual(CountingStorage.calls, calls)
+
+    @override_settings(PRIVATE_MEDIA_CACHE_MAX_OBJECT_SIZE=2)
+    def test_large_file_streamed_from_storage(self):
+        self.write_file("images/a.png", b"png")
+        url = self.media_url("images/a.png")
+        b"".join(self.client.get(url).streaming_content)
+        calls = CountingStorage.calls
+
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), b"png")
+        self.assertEqual(CountingStorage.calls, calls + 1)
+
+    @override_settings(
+        PRIVATE_MEDIA_CACHE_ALIAS="default",
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_shared_tier_used_when_memory_tier_empty(self):
+        self.write_file("images/a.png", b"png")
+        url = self.media_url("images/a.png")
+        b"".join(self.client.get(url).streaming_content)
+        get_media_cache().memory.clear()
+        calls = CountingStorage.calls
+
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), b"png")
+        self.assertEqual(CountingStorage.calls, calls)
+
+    @override_settings(
+        PRIVATE_MEDIA_CACHE_ALIAS="default",
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_file_replaced_in_another_process_is_served(self):
+        self.write_file("images/a.png", b"png")
+        url = self.media_url("images/a.png")
+        b"".join(self.client.get(url).streaming_content)
+
+        # Another process replaces the file and invalidates the shared tier;
+        # this process's memory tier is not told.
+        other = MediaCache(1024 * 1024, 1024, 60, cache_alias="default")
+        self.write_file("images/a.png", b"new png")
+        other.invalidate(default_storage, "images/a.png")
+
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), b"new png")
+
+    def test_entries_are_per_storage(self):
+        other_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_root)
+        files = [
+            (default_storage, b"one"),
+            (FileSystemStorage(location=other_root), b"two"),
+        ]
+        for storage, content in files:
+            storage.save("images/a.png", ContentFile(content))
+
+        cache = get_media_cache()
+        for storage, content in files:
+            metadata = cache.get_metadata(storage, "images/a.png")
+            self.assertEqual(
+                cache.get_content(storage, "images/a.png", metadata), content
+            )
+
+    def test_document_delete_invalidates_cache(self):
+        document = get_document_model().objects.create(
+            title="Report", file=ContentFile(b"v1", name="report.txt")
+        )
+        url = self.media_url(document.file.name)
+        self.assertEqual(b"".join(self.client.get(url).streaming_content), b"v1")
+        key = ("meta", get_storage_key(document.file.storage), document.file.name)
+        self.assertIsNotNone(get_media_cache().memory.get(key))
+
+        document.delete()
+        self.assertIsNone(get_media_cache().memory.get(key))
+
+
+class AsyncBlobStorage(FileSystemStorage):
+    """
+    Local stand-in for Azure storage that provides an asyncio blob client,
+    counting the requests made through it.
+    """
+
+    timeout = 20
+    calls = 0
+    closed = 0
+
+    def _get_valid_path(self, name):
+        return name
+
+    def get_async_client(self):
+        return FakeAsyncContainerClient(self)
+
+    async def aclose_async_clients(self):
+        AsyncBlobStorage.closed += 1
+
+
+class FakeAsyncContainerClient:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get_blob_client(self, name):
+        storage = self.storage
+
+        async def get_blob_properties(timeout=None):
+            AsyncBlobStorage.calls += 1
+            return SimpleNamespace(
+                size=storage.size(name),
+                etag="0x8D0",
+                last_modified=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+                content_settings=SimpleNamespace(content_type=None),
+            )
+
+        return SimpleNamespace(get_blob_properties=get_blob_properties)
+
+    async def download_blob(self, name, offset=0, length=None, timeout=None):
+        AsyncBlobStorage.calls += 1
+        with self.storage.open(name) as f:
+            f.seek(offset)
+            data = f.read(-1 if length is None else length)
+        stream = SimpleNamespace(position=0)
+
+        async def read(size):
+            chunk = data[stream.position : stream.position + size]
+            stream.position += len(chunk)
+            return chunk
+
+        stream.read = read
+        return stream
+
+
+@override_settings(ROOT_URLCONF="cms.tests")
+class AsyncPrivateMediaTests(PrivateMediaTestCase):
+    """
+    Tests for the async private media view served under ASGI.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+        self.content = os.urandom(100 * 1024)
+        self.write_file("documents/report.pdf", self.content)
+        self.url = self.media_url("documents/report.pdf")
+
+    async def read(self, response):
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    async def test_file_is_streamed(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(await self.read(response), self.content)
+
+    async def test_anonymous_user_redirected_to_login(self):
+        await self.async_client.alogout()
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    async def test_document_is_streamed(self):
+        document = await get_document_model().objects.acreate(
+            title="Report", file=ContentFile(self.content, name="report.zip")
+        )
+        response = await self.async_client.get(document.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertEqual(await self.read(response), self.content)
+
+    async def test_multiple_ranges(self):
+        response = await self.async_client.get(
+            self.url, headers={"Range": "bytes=0-9,20-29"}
+        )
+        self.assertEqual(response.status_code, 206)
+        body = await self.read(response)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        self.assertIn(self.content[20:30], body)
+
+    @override_settings(
+        STORAGES={"default": {"BACKEND": "cms.tests.AsyncBlobStorage"}},
+        PRIVATE_MEDIA_CACHE_MAX_OBJECT_SIZE=0,
+    )
+    async def test_async_blob_client_used(self):
+        AsyncBlobStorage.calls = 0
+        response = await self.async_client.get(self.url, headers={"Range": "bytes=10-"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["ETag"], '"0x8D0"')
+        self.assertEqual(await self.read(response), self.content[10:])
+        self.assertEqual(AsyncBlobStorage.calls, 2)
+
+    @override_settings(STORAGES={"default": {"BACKEND": "cms.tests.AsyncBlobStorage"}})
+    async def test_lifespan_shutdown_closes_async_clients(self):
+        with mock.patch.dict(os.environ), mock.patch("search.autocomplete.warm"):
+            from cms.asgi import application
+
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        AsyncBlobStorage.closed = 0
+        await application({"type": "lifespan"}, receive, send)
+        self.assertEqual(
+            sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+        self.assertEqual(AsyncBlobStorage.closed, 1)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    Tests for routing page and search reads to the read replica.
+    """
+
+    databases = {"default"}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request, write=False):
+        """
+        Pass ``request`` through the middleware and return the database its
+        reads were routed to, and the response.
+        """
+        routed = []
+
+        def get_response(request):
+            if write:
+                self.router.db_for_write(Page)
+            routed.append(self.router.db_for_read(Page))
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(get_response)(request)
+        return routed[0], response
+
+    def test_page_and_search_reads_use_replica(self):
+        for url in ("/", "/some/page/", "/search/?query=report"):
+            with self.subTest(url=url):
+                self.assertEqual(self.route(self.factory.get(url))[0], "replica")
+
+    def test_other_requests_use_primary(self):
+        self.assertIsNone(self.route(self.factory.post("/"))[0])
+        self.assertIsNone(self.route(self.factory.get("/admin/"))[0])
+        self.assertIsNone(self.router.db_for_read(Page))
+
+    def test_reads_in_transaction_use_primary(self):
+        def get_response(request):
+            with transaction.atomic():
+                return HttpResponse(self.router.db_for_read(Page) or "default")
+
+        response = ReplicaRoutingMiddleware(get_response)(self.factory.get("/"))
+        self.assertEqual(response.content, b"default")
+
+    def test_writes_pin_client_to_primary(self):
+        database, response = self.route(self.factory.post("/admin/pages/"), write=True)
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+
+        request = self.factory.get("/")
+        request.COOKIES[PIN_COOKIE_NAME] = "1"
+        database, response = self.route(request)
+        self.assertIsNone(database)
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+
+    def test_reads_after_write_in_same_request_use_primary(self):
+        database, response = self.route(self.factory.get("/"), write=True)
+        self.assertIsNone(database)
+
+    async def test_writes_in_sync_code_pin_async_requests(self):
+        @sync_to_async
+        def get_response(request):
+            self.router.db_for_write(Page)
+            return HttpResponse()
+
+        response = await ReplicaRoutingMiddleware(get_response)(self.factory.get("/"))
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+
+    def test_replica_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica", "wagtailcore"))
+        self.assertIsNone(self.router.allow_migrate("default", "wagtailcore"))
+
+
+class RequestMetricsTests(PrivateMediaTestCase):
+    """
+    Tests for the per-request query, cache and latency metrics.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write_file("documents/report.txt", b"x" * 1000)
+        self.url = self.media_url("documents/report.txt")
+
+    def get(self):
+        with self.assertLogs("cms.request_metrics", "INFO") as logs:
+            response = self.client.get(self.url)
+            response.getvalue()
+        return response, logs.records[0].metrics
+
+    def test_metrics_logged_and_sent_in_server_timing(self):
+        response, metrics = self.get()
+        self.assertEqual(metrics["view"], "serve_private_media")
+        self.assertEqual(metrics["status"], 200)
+        self.assertEqual(metrics["storage_bytes"], 1000)
+        # The file's metadata and body were both looked up in the media cache.
+        self.assertEqual(metrics["cache_misses"], 2)
+        self.assertGreater(metrics["queries"], 0)
+
+        server_timing = response["Server-Timing"]
+        self.assertIn('db;dur=', server_timing)
+        self.assertIn('%d queries' % metrics["queries"], server_timing)
+        self.assertIn("total;dur=", server_timing)
+
+    def test_cache_hits_counted(self):
+        self.get()
+        response, metrics = self.get()
+        self.assertEqual(metrics["cache_hits"], 2)
+        self.assertEqual(metrics["storage_bytes"], 0)
+
+    async def test_async_requests_measured(self):
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs("cms.request_metrics", "INFO") as logs:
+            response = await self.async_client.get(self.url)
+            response.getvalue()
+        metrics = logs.records[0].metrics
+        self.assertGreater(metrics["queries"], 0)
+        self.assertEqual(metrics["storage_bytes"], 1000)
+        self.assertIn("%d queries" % metrics["queries"], response["Server-Timing"])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_not_measured(self):
+        with self.assertNoLogs("cms.request_metrics"):
+            response = self.client.get(self.url)
+            response.getvalue()
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(REQUEST_BUDGETS={"serve_private_media": {"queries": 0}})
+    def test_budget_exceeded_fails_in_strict_mode(self):
+        response = self.client.get(self.url)
+        with self.assertRaisesMessage(BudgetExceeded, "serve_private_media over budget"):
+            response.getvalue()
+
+    @override_settings(
+        REQUEST_BUDGETS={"serve_private_media": {"queries": 0}},
+        REQUEST_BUDGETS_STRICT=False,
+    )
+    def test_budget_exceeded_logged(self):
+        with self.assertLogs("cms.request_metrics", "WARNING") as logs:
+            response = self.client.get(self.url)
+            response.getvalue()
+        self.assertIn("queries", logs.records[0].getMessage())
+
+
+class RequestLogTests(TestCase):
+    """
+    Tests for request ids, the sampled access log and queued JSON logging.
+    """
+
+    def get(self, **headers):
+        return self.client.get("/", headers=headers)
+
+    def test_request_id_returned_and_access_logged(self):
+        with self.assertLogs("cms.access", "INFO") as logs:
+            response = self.get(**{"X-Request-ID": "abc-123"})
+        self.assertEqual(response["X-Request-ID"], "abc-123")
+        self.assertEqual(log.get_request_id(), "abc-123")
+        self.assertEqual(logs.records[0].access["status"], 200)
+        self.assertIn('"GET /" 200', logs.records[0].getMessage())
+
+    def test_unsafe_request_id_replaced(self):
+        response = self.get(**{"X-Request-ID": "abc 123"})
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+
+    @override_settings(ACCESS_LOG_SAMPLE_RATE=0)
+    def test_unsampled_requests_not_logged(self):
+        with self.assertNoLogs("cms.access"):
+            response = self.get()
+        self.assertIn("X-Request-ID", response)
+
+    @override_settings(ACCESS_LOG_SAMPLE_RATE=0, ACCESS_LOG_SLOW_MS=0)
+    def test_slow_requests_always_logged(self):
+        with self.assertLogs("cms.access", "INFO"):
+            self.get()
+
+    def test_rate_limit(self):
+        limiter = log.AccessLogLimiter()
+        with mock.patch("time.monotonic", return_value=100.0):
+            self.assertEqual([limiter.allow(2) for _ in range(4)], [0, 0, None, None])
+        with mock.patch("time.monotonic", return_value=101.0):
+            self.assertEqual(limiter.allow(2), 2)
+
+    def get_handler(self, **kwargs):
+        stream = StringIO()
+        handler = log.QueueHandler(stream=stream, **kwargs)
+        self.addCleanup(handler.close)
+        logger = logging.getLogger("cms.tests.log")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        logger.propagate = False
+        self.addCleanup(setattr, logger, "propagate", True)
+        return handler, logger, stream
+
+    def read_lines(self, handler, stream):
+        handler.flush()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_records_written_as_json(self):
+        handler, logger, stream = self.get_handler()
+        token = log._request_id.set("req-1")
+        self.addCleanup(log._request_id.reset, token)
+        logger.warning("Hello %s", "world", extra={"page_id": 3})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("Failed")
+
+        first, second = self.read_lines(handler, stream)
+        self.assertEqual(first["message"], "Hello world")
+        self.assertEqual(first["level"], "WARNING")
+        self.assertEqual(first["request_id"], "req-1")
+        self.assertEqual(first["page_id"], 3)
+        self.assertIn("ZeroDivisionError", second["exception"])
+
+    def test_records_dropped_when_queue_is_full(self):
+        handler, logger, stream = self.get_handler(maxsize=2)
+        # Stop the writer, so that the queue fills up.
+        handler.listener.stop()
+        for message in ("a", "b", "c"):
+            logger.warning(message)
+        self.assertEqual(handler.dropped, 1)
+
+        handler.start()
+        logger.warning("d")
+        messages = [line["message"] for line in self.read_lines(handler, stream)]
+        self.assertEqual(messages, ["a", "b", "Dropped 1 log records", "d"])
+
+
+class AsyncMiddlewareTests(SimpleTestCase):
+    """
+    Tests that the project's middleware does not need a thread under ASGI.
+    """
+
+    def test_middleware_is_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for middleware in (
+            RequestLogMiddleware,
+            RequestMetricsMiddleware,
+            ReplicaRoutingMiddleware,
+            RedirectMiddleware,
+            SiteMiddleware,
+            PageCacheMiddleware,
+        ):
+            with self.subTest(middleware=middleware.__name__):
+                self.assertTrue(middleware.async_capable)
+                self.assertTrue(iscoroutinefunction(middleware(get_response)))
+
+
+class StaticFilesStorageTests(SimpleTestCase):
+    """
+    Tests for the precompressing static files storage and CDN manifest.
+    """
+
+    def setUp(self):
+        source = tempfile.mkdtemp()
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, self.static_root)
+        os.makedirs(os.path.join(source, "css"))
+        with open(os.path.join(source, "css", "site.css"), "w") as f:
+            f.write("body { background: url('../logo.svg'); }\n" * 100)
+        with open(os.path.join(source, "logo.svg"), "w") as f:
+            f.write("<svg xmlns='http://www.w3.org/2000/svg'></svg>\n" * 100)
+        with open(os.path.join(source, "photo.jpg"), "wb") as f:
+            f.write(b"\xff\xd8" * 1000)
+
+        settings_override = override_settings(
+            STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+            STATIC_ROOT=self.static_root,
+            STORAGES={"staticfiles": {"BACKEND": "cms.staticfiles.StaticFilesStorage"}},
+            STATICFILES_COMPRESS_WORKERS=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+    def test_hashed_files_compressed(self):
+        hashed_css = staticfiles_storage.stored_name("css/site.css")
+        self.assertNotEqual(hashed_css, "css/site.css")
+        for name in (hashed_css + ".br", hashed_css + ".gz"):
+            self.assertTrue(staticfiles_storage.exists(name), name)
+        # Originals are collected but not compressed.
+        self.assertTrue(staticfiles_storage.exists("css/site.css"))
+        self.assertFalse(staticfiles_storage.exists("css/site.css.gz"))
+        hashed_jpg = staticfiles_storage.stored_name("photo.jpg")
+        self.assertFalse(staticfiles_storage.exists(hashed_jpg + ".gz"))
+
+    def test_cdn_manifest(self):
+        with staticfiles_storage.open("cdn-manifest.json") as f:
+            files = json.load(f)["files"]
+        css_url = static("css/site.css")
+        self.assertEqual(set(files), {css_url, static("logo.svg"), static("photo.jpg")})
+        hashed_css = staticfiles_storage.stored_name("css/site.css")
+        self.assertEqual(files[css_url]["size"], staticfiles_storage.size(hashed_css))
+        self.assertEqual(set(files[css_url]["encodings"]), {"br", "gzip"})
+        self.assertEqual(files[static("photo.jpg")]["encodings"], {})
+
+    def test_hashed_files_served_immutable_and_compressed(self):
+        with override_settings(
+            MIDDLEWARE=["whitenoise.middleware.WhiteNoiseMiddleware"],
+            WHITENOISE_AUTOREFRESH=False,
+        ):
+            response = self.client.get(
+                static("css/site.css"), headers={"accept-encoding": "gzip, br"}
+            )
+            self.assertEqual(response["Content-Encoding"], "br")
+            self.assertIn("immutable", response["Cache-Control"])
+
+            response = self.client.get("/static/css/site.css")
+            self.assertNotIn("immutable", response["Cache-Control"])
+
+    async def call_static_application(self, path, headers=()):
+        async def fallback(scope, receive, send):
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body"})
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        with override_settings(WHITENOISE_AUTOREFRESH=False):
+            application = StaticFilesApplication(fallback)
+        scope = {"type": "http", "method": "GET", "path": path, "headers": headers}
+        await application(scope, None, send)
+        headers = {
+            name.decode(): value.decode() for name, value in messages[0]["headers"]
+        }
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        return messages[0]["status"], headers, body
+
+    async def test_asgi_application_serves_static_files(self):
+        status, headers, body = await self.call_static_application(
+            static("css/site.css"), [(b"accept-encoding", b"gzip, br")]
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-encoding"], "br")
+        self.assertIn("immutable", headers["cache-control"])
+        hashed_css = staticfiles_storage.stored_name("css/site.css")
+        with staticfiles_storage.open(hashed_css + ".br") as f:
+            self.assertEqual(body, f.read())
+
+        status, headers, body = await self.call_static_application("/media/a.png")
+        self.assertEqual(status, 404)
+
+
+@override_settings(
+    RENDITION_WARMUP_FILTERS=["max-165x165", "fill-50x50"],
+    RENDITION_WARMUP_WORKERS=0,
+)
+class RenditionWarmupTests(PrivateMediaTestCase):
+    """
+    Tests for pre-generating image renditions.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Rendition cache keys repeat across tests, as image ids are reused.
+        cache.clear()
+
+    def create_image(self):
+        return get_image_model().objects.create(
+            title="Test image", file=get_test_image_file()
+        )
+
+    def process_queue(self):
+        stdout = StringIO()
+        call_command("process_rendition_queue", "--once", stdout=stdout)
+        return stdout.getvalue()
+
+    def test_uploads_are_queued(self):
+        image = self.create_image()
+        self.assertEqual(renditions.get_pending_count(), 1)
+        # The request that saved the image does not render anything.
+        self.assertFalse(image.renditions.exists())
+
+    def test_only_source_changes_are_queued(self):
+        image = self.create_image()
+        RenditionQueueEntry.objects.all().delete()
+        image.title = "Renamed"
+        image.save()
+        image.save(update_fields=["title"])
+        self.assertEqual(renditions.get_pending_count(), 0)
+
+        image.focal_point_x = 10
+        image.save()
+        self.assertEqual(renditions.get_pending_count(), 1)
+
+        RenditionQueueEntry.objects.all().delete()
+        image.file = get_test_image_file(filename="other.png")
+        image.save()
+        self.assertEqual(renditions.get_pending_count(), 1)
+
+    def test_worker_renders_queued_images(self):
+        image = self.create_image()
+        output = self.process_queue()
+        self.assertIn("Created 2 renditions of 1 images", output)
+        self.assertEqual(renditions.get_pending_count(), 0)
+        self.assertEqual(
+            set(image.renditions.values_list("filter_spec", flat=True)),
+            {"max-165x165", "fill-50x50"},
+        )
+        rendition = image.renditions.get(filter_spec="fill-50x50")
+        self.assertEqual((rendition.width, rendition.height), (50, 50))
+        self.assertTrue(os.path.exists(rendition.file.path))
+
+        # Lookups are answered from the rendition cache.
+        image = get_image_model().objects.get(pk=image.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(image.get_rendition("fill-50x50").url, rendition.url)
+
+    def test_worker_skips_unreadable_images(self):
+        broken, image = self.create_image(), self.create_image()
+        broken.file.storage.delete(broken.file.name)
+        with self.assertLogs("cms.renditions", "ERROR"):
+            output = self.process_queue()
+        self.assertIn("Created 2 renditions of 2 images", output)
+        self.assertEqual(renditions.get_pending_count(), 0)
+        self.assertEqual(image.renditions.count(), 2)
+
+    @override_settings(RENDITION_WARMUP_FILTERS=[])
+    def test_no_filters_configured(self):
+        self.create_image()
+        self.assertEqual(renditions.get_pending_count(), 0)
+
+    def test_conflicting_rendition_file_is_deleted(self):
+        image = self.create_image()
+        existing = image.get_rendition("max-165x165")
+        all_filters = [Filter(spec=spec) for spec in renditions.get_filter_specs()]
+        # As if a page view created the rendition after the existence checks.
+        with mock.patch.object(
+            renditions, "get_missing_filters", return_value=all_filters
+        ), mock.patch.object(renditions, "get_existing_keys", return_value=set()):
+            self.assertEqual(renditions.warm_renditions([image]), 1)
+        self.assertEqual(image.renditions.get(pk=existing.pk).file, existing.file)
+        self.assertEqual(
+            set(os.listdir(os.path.dirname(existing.file.path))),
+            {
+                os.path.basename(rendition.file.name)
+                for rendition in image.renditions.all()
+            },
+        )
+
+    def test_command_backfills_missing_renditions(self):
+        images = [self.create_image() for i in range(3)]
+        images[0].get_rendition("max-165x165")
+        stdout = StringIO()
+        call_command("warm_renditions", "--workers", "2", stdout=stdout)
+        self.assertIn("Created 5 renditions", stdout.getvalue())
+        for image in images:
+            self.assertEqual(image.renditions.count(), 2)
+
+        stdout = StringIO()
+        call_command(
+            "warm_renditions", "--filter", "width-40", "--workers", "0", stdout=stdout
+        )
+        self.assertIn("Created 3 renditions", stdout.getvalue())
+
+    def test_command_rejects_invalid_filter(self):
+        with self.assertRaises(CommandError):
+            call_command("warm_renditions", "--filter", "bogus-10", stdout=StringIO())
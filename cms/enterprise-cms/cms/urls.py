@@ -1,55 +1,53 @@
 from django.conf import settings
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.contrib import admin
-from django.views.static import serve
-from django.contrib.auth.decorators import login_required
-import os
 
 from wagtail.admin import urls as wagtailadmin_urls
 from wagtail import urls as wagtail_urls
-from wagtail.documents import urls as wagtaildocs_urls
+from wagtail.documents.views.serve import authenticate_with_password
 
+from cms.views import (
+    serve_document,
+    serve_document_async,
+    serve_private_media,
+    serve_private_media_async,
+)
 from search import views as search_views
 
-# Custom view to serve private media files from Azure Storage
-def serve_private_media(request, path):
-    """
-    Serve media files from Azure Storage with authentication.
-    Only authenticated users (or superusers for admin) can access media files.
-    """
-    from django.core.files.storage import default_storage
-    from django.http import HttpResponse, Http404
-    from django.contrib.auth.decorators import user_passes_test
-    
-    # Check if user is authenticated (for Wagtail admin)
-    if not request.user.is_authenticated:
-        from django.contrib.auth.views import redirect_to_login
-        return redirect_to_login(request.get_full_path())
-    
-    try:
-        file = default_storage.open(path)
-        # Get the file content
-        content = file.read()
-        file.close()
-        
-        # Determine content type
-        import mimetypes
-        content_type, _ = mimetypes.guess_type(path)
-        if content_type is None:
-            content_type = 'application/octet-stream'
-        
-        response = HttpResponse(content, content_type=content_type)
-        return response
-    except Exception:
-        raise Http404("Media file not found")
+# Under ASGI, serve search and media with views that await I/O instead of
+# blocking a thread (see cms.asgi).
+if getattr(settings, "ASYNC_VIEWS", False):
+    search_view = search_views.search_async
+    media_view = serve_private_media_async
+    document_view = serve_document_async
+else:
+    search_view = search_views.search
+    media_view = serve_private_media
+    document_view = serve_document
+
+# Wagtail's document URLs, with documents streamed or offloaded like private
+# media (see cms.views.serve_document).
+wagtaildocs_urls = [
+    re_path(r"^(\d+)/(.*)$", document_view, name="wagtaildocs_serve"),
+    path(
+        "authenticate_with_password/<int:restriction_id>/",
+        authenticate_with_password,
+        name="wagtaildocs_authenticate_with_password",
+    ),
+]
 
 urlpatterns = [
     path("django-admin/", admin.site.urls),
     path("admin/", include(wagtailadmin_urls)),
     path("documents/", include(wagtaildocs_urls)),
-    path("search/", search_views.search, name="search"),
+    path("search/", search_view, name="search"),
+    path(
+        "search/autocomplete/",
+        search_views.autocomplete,
+        name="search_autocomplete",
+    ),
     # Serve private media files through Django
-    path("media/<path:path>", serve_private_media, name="serve_private_media"),
+    path("media/<path:path>", media_view, name="serve_private_media"),
 ]
 
 
@@ -0,0 +1,177 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_safe
+
+from wagtail import hooks
+from wagtail.documents import get_document_model
+from wagtail.documents.models import document_served
+
+from cms.media import aserve_file, get_serve_mode, offload_file, serve_file
+from cms.media_cache import get_media_cache
+
+
+# Custom view to serve private media files from Azure Storage
+@require_safe
+def serve_private_media(request, path):
+    """
+    Serve media files from Azure Storage with authentication.
+    Only authenticated users (or superusers for admin) can access media files.
+
+    The file is streamed to the client in bounded chunks rather than being
+    read into memory, so large downloads do not inflate the worker. ETag and
+    Last-Modified validators come from the storage metadata, so repeat
+    requests can be answered with a 304 and viewers can seek with ranges.
+    Metadata and small files are cached in front of the storage backend.
+
+    When PRIVATE_MEDIA_SERVE_MODE is set to an offload mode, the bytes are
+    left to the storage service or a fronting proxy once the user has been
+    authenticated.
+    """
+    # Check if user is authenticated (for Wagtail admin)
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    response = offload_file(default_storage, path)
+    if response is not None:
+        return response
+
+    cache = get_media_cache()
+    try:
+        metadata = cache.get_metadata(default_storage, path)
+    except Exception:
+        raise Http404("Media file not found")
+
+    return serve_file(request, default_storage, path, metadata, cache=cache)
+
+
+@require_safe
+async def serve_private_media_async(request, path):
+    """
+    Asynchronous version of ``serve_private_media``, used when the site runs
+    under ASGI (see ``cms.asgi``). Storage requests are awaited rather than
+    blocking a thread, so one worker can stream many files at once.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    response = offload_file(default_storage, path)
+    if response is not None:
+        return response
+
+    cache = get_media_cache()
+    try:
+        metadata = await cache.aget_metadata(default_storage, path)
+    except Exception:
+        raise Http404("Media file not found")
+
+    return await aserve_file(request, default_storage, path, metadata, cache=cache)
+
+
+def get_document_serve_mode(storage):
+    """
+    Return how document bytes are delivered: DOCUMENT_SERVE_MODE, which takes
+    the same values as PRIVATE_MEDIA_SERVE_MODE. Unset, documents in a
+    storage without local paths (such as Azure) are redirected to, as by
+    Wagtail's own serve view, and others follow PRIVATE_MEDIA_SERVE_MODE.
+    """
+    mode = getattr(settings, "DOCUMENT_SERVE_MODE", None)
+    if mode:
+        return mode
+    try:
+        storage.path("")
+    except NotImplementedError:
+        return "redirect"
+    return get_serve_mode()
+
+
+def get_servable_document(request, document_id, document_filename):
+    """
+    Look up the document for a request and run the checks of Wagtail's own
+    serve view. Return the document and, if one of the
+    ``before_serve_document`` hooks (e.g. a collection's view restriction)
+    answered the request itself, that response.
+    """
+    Document = get_document_model()
+    document = get_object_or_404(Document, id=document_id)
+    if document.filename != document_filename:
+        raise Http404("This document does not match the given filename.")
+
+    for fn in hooks.get_hooks("before_serve_document"):
+        result = fn(document, request)
+        if isinstance(result, HttpResponse):
+            return document, result
+
+    document_served.send(sender=Document, instance=document, request=request)
+    return document, None
+
+
+def add_document_headers(response):
+    # Stop documents such as HTML or SVG files running scripts on this site.
+    if getattr(settings, "WAGTAILDOCS_BLOCK_EMBEDDED_CONTENT", True):
+        response["Content-Security-Policy"] = "default-src 'none'"
+    response["X-Content-Type-Options"] = "nosniff"
+    return response
+
+
+@require_safe
+def serve_document(request, document_id, document_filename):
+    """
+    Serve a Wagtail document in place of ``wagtail.documents.views.serve``.
+
+    Collection view restrictions and other ``before_serve_document`` hooks
+    apply as before. The file is then delivered like private media: offloaded
+    to a signed storage URL or a fronting proxy per DOCUMENT_SERVE_MODE, or
+    streamed in bounded chunks with range support, using the media cache
+    for storage metadata and small files. WAGTAILDOCS_SERVE_METHOD is not
+    used.
+    """
+    document, response = get_servable_document(
+        request, document_id, document_filename
+    )
+    if response is not None:
+        return response
+
+    storage, name = document.file.storage, document.file.name
+    response = offload_file(
+        storage, name, get_document_serve_mode(storage), document.content_disposition
+    )
+    if response is None:
+        cache = get_media_cache()
+        try:
+            metadata = cache.get_metadata(storage, name)
+        except Exception:
+            raise Http404("Document file not found")
+        response = serve_file(request, storage, name, metadata, cache=cache)
+        response["Content-Disposition"] = document.content_disposition
+    return add_document_headers(response)
+
+
+@require_safe
+async def serve_document_async(request, document_id, document_filename):
+    """
+    Asynchronous version of ``serve_document``, used under ASGI.
+    """
+    document, response = await sync_to_async(get_servable_document)(
+        request, document_id, document_filename
+    )
+    if response is not None:
+        return response
+
+    storage, name = document.file.storage, document.file.name
+    response = offload_file(
+        storage, name, get_document_serve_mode(storage), document.content_disposition
+    )
+    if response is None:
+        cache = get_media_cache()
+        try:
+            metadata = await cache.aget_metadata(storage, name)
+        except Exception:
+            raise Http404("Document file not found")
+        response = await aserve_file(request, storage, name, metadata, cache=cache)
+        response["Content-Disposition"] = document.content_disposition
+    return add_document_headers(response)
@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
+from cms.template_cache import warm_templates
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cms.settings.dev")
 
 application = get_wsgi_application()
+
+if getattr(settings, "TEMPLATE_WARMUP", False):
+    warm_templates()
+
+# Under gunicorn's preload this runs once in the master, and the workers
+# share the index.
+from search import autocomplete  # noqa: E402 (needs the app registry)
+
+autocomplete.warm()
@@ -0,0 +1,158 @@
+"""
+Gunicorn configuration for production, loaded automatically from the working
+directory.
+
+Workers and threads are sized from the CPUs and memory actually available to
+the container (cgroup limits, not the host's totals) and can be overridden
+with environment variables:
+
+- ``GUNICORN_WORKERS`` (or ``WEB_CONCURRENCY``): worker processes, default
+  ``2 * CPUs + 1`` capped by ``memory limit / GUNICORN_WORKER_MEMORY_MB``
+- ``GUNICORN_THREADS``: threads per worker, default 4
+- ``GUNICORN_WORKER_MEMORY_MB``: expected memory per worker, default 256
+- ``GUNICORN_PRELOAD``: import the application once in the master so workers
+  share its memory copy-on-write, default on
+- ``GUNICORN_TIMEOUT``, ``GUNICORN_KEEPALIVE``, ``GUNICORN_MAX_REQUESTS``
+- ``GUNICORN_ACCESSLOG``: also write gunicorn's access log, default off
+
+With ``ASGI=true`` the application is served from ``cms.asgi`` by uvicorn
+workers instead of from ``cms.wsgi`` by threaded workers.
+"""
+
+import gc
+import os
+
+
+def get_cpu_count():
+    """
+    Return the number of CPUs this process may use, honouring a cgroup CPU
+    quota where one is set.
+    """
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+
+    for quota_file, period_file in (
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+    ):
+        try:
+            with open(quota_file) as f:
+                values = f.read().split()
+            if period_file:
+                with open(period_file) as f:
+                    values.append(f.read().strip())
+        except OSError:
+            continue
+        if values[0] not in ("max", "-1"):
+            count = min(count, max(1, int(values[0]) // int(values[1])))
+        break
+    return count
+
+
+def get_memory_limit():
+    """
+    Return the container memory limit in bytes, or ``None`` if unlimited.
+    """
+    for limit_file in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        try:
+            with open(limit_file) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "unlimited" as a huge number.
+        if value != "max" and int(value) < 1 << 60:
+            return int(value)
+        return None
+    return None
+
+
+def get_worker_count():
+    configured = os.environ.get("GUNICORN_WORKERS") or os.environ.get(
+        "WEB_CONCURRENCY"
+    )
+    if configured:
+        return int(configured)
+
+    workers = 2 * get_cpu_count() + 1
+    memory_limit = get_memory_limit()
+    if memory_limit:
+        worker_memory = int(os.environ.get("GUNICORN_WORKER_MEMORY_MB", 256)) << 20
+        workers = min(workers, memory_limit // worker_memory)
+    return max(1, workers)
+
+
+asgi = os.environ.get("ASGI", "false").lower() == "true"
+
+wsgi_app = "cms.asgi:application" if asgi else "cms.wsgi:application"
+bind = "0.0.0.0:%s" % os.environ.get("PORT", "8000")
+
+workers = get_worker_count()
+worker_class = "uvicorn_worker.UvicornWorker" if asgi else "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# Keep idle connections from the Azure front end open between requests, and
+# recycle workers periodically to bound the growth of per-process caches.
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 75))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = max_requests // 10
+
+# Heartbeat files on tmpfs, so a slow container disk cannot stall workers.
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# The access log is written by cms.log.RequestLogMiddleware, sampled and off
+# the request thread; GUNICORN_ACCESSLOG=true adds gunicorn's own, one
+# synchronous line per request.
+gunicorn_accesslog = os.environ.get("GUNICORN_ACCESSLOG", "false").lower()
+accesslog = "-" if gunicorn_accesslog in ("1", "true", "yes") else None
+errorlog = "-"
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+
+    from django.core.cache import caches
+    from django.db import connections
+
+    # Warming up the application queried the database, but the master
+    # serves no requests: close its connections, and any connection pool
+    # with its background threads, rather than hold them for its lifetime.
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+        if hasattr(connection, "close_pool"):
+            connection.close_pool()
+    caches.close_all()
+
+    # Move everything allocated while preloading out of the garbage
+    # collector's reach, so collections in the workers do not touch (and
+    # copy) the shared pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Drop connections inherited from the master. With preload, anything the
+    application opened while importing would otherwise be shared between
+    workers.
+    """
+    from django.core.cache import caches
+    from django.db import connections
+
+    connections.close_all()
+    caches.close_all()
+
+    # Connection pools are filled by background threads, which do not
+    # survive the fork; let each worker create its own.
+    for connection in connections.all(initialized_only=True):
+        pools = getattr(type(connection), "_connection_pools", None)
+        if pools:
+            pools.clear()
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from cms.startup import get_unapplied_migrations, migration_lock
+
+MODES = ["auto", "check", "skip"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Prepare the database at container start-up: apply migrations if any "
+        "are pending, then create the initial superuser, in one process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            choices=MODES,
+            default=None,
+            help=(
+                "auto: migrate only when migrations are pending (default). "
+                "check: fail if migrations are pending. skip: do not look."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        mode = options["mode"] or getattr(settings, "STARTUP_MIGRATIONS", "auto")
+
+        if mode == "check":
+            unapplied = get_unapplied_migrations()
+            if unapplied:
+                raise CommandError(
+                    "%d migrations have not been applied, e.g. %s.%s"
+                    % ((len(unapplied),) + min(unapplied))
+                )
+        elif mode == "auto":
+            self.migrate()
+
+        call_command("createinitialsuperuser", stdout=self.stdout)
+
+    def migrate(self):
+        if not get_unapplied_migrations():
+            self.stdout.write("No migrations to apply.")
+            return
+
+        with migration_lock():
+            # Another instance may have migrated while we waited for the lock.
+            if get_unapplied_migrations():
+                call_command("migrate", interactive=False, stdout=self.stdout)
+            else:
+                self.stdout.write("No migrations to apply.")
@@ -0,0 +1,289 @@
+import random
+import time
+from uuid import uuid4
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import CharField, OuterRef, Subquery
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.text import slugify
+
+from wagtail.models import Page, Revision
+from wagtail.search.backends import get_search_backend
+
+from cms import site_index
+from cms.page_cache import invalidate_site
+from home.models import HomePage
+from search import autocomplete
+
+# Vocabulary for page titles, so that search queries match a predictable
+# share of the pages.
+WORDS = [
+    "annual", "report", "policy", "guidance", "finance", "budget", "health",
+    "safety", "training", "strategy", "research", "project", "update",
+    "review", "meeting", "minutes", "community", "energy", "transport",
+    "housing", "education", "digital", "service", "standard", "planning",
+    "consultation", "response", "summary", "statement", "framework",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-create a tree of live HomePages with synthetic titles under an "
+        "existing page, with revisions and search index entries. Tree paths "
+        "are computed in memory and rows inserted in batches, rather than "
+        "one add_child() per page."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pages", type=int, help="Number of pages to create.")
+        parser.add_argument(
+            "--parent",
+            type=int,
+            default=None,
+            help="Id of the page to add the tree under (default: the default site's root page).",
+        )
+        parser.add_argument(
+            "--fanout",
+            type=int,
+            default=100,
+            help="Children per page; the tree is filled breadth first.",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed for the generated titles."
+        )
+        parser.add_argument(
+            "--no-revisions",
+            action="store_false",
+            dest="revisions",
+            help="Do not create a revision for each page.",
+        )
+        parser.add_argument(
+            "--no-index",
+            action="store_false",
+            dest="index",
+            help="Do not add the pages to the search index.",
+        )
+
+    def handle(self, *args, **options):
+        if options["fanout"] < 1:
+            raise CommandError("--fanout must be at least 1.")
+
+        if options["parent"] is None:
+            parent = Page.objects.filter(sites_rooted_here__is_default_site=True).first()
+        else:
+            parent = Page.objects.filter(pk=options["parent"]).first()
+        if parent is None:
+            raise CommandError("Parent page not found.")
+
+        start = time.perf_counter()
+        self.content_type = ContentType.objects.get_for_model(HomePage)
+        self.now = timezone.now()
+        self.rng = random.Random(options["seed"])
+
+        with transaction.atomic():
+            # Lock the parent row so that concurrent tree changes wait.
+            parent = Page.objects.select_for_update().get(pk=parent.pk)
+            self.revision_rows = [] if options["revisions"] else None
+            page_ids = self.create_pages(
+                parent, options["pages"], options["fanout"], options["batch_size"]
+            )
+            if options["revisions"]:
+                self.create_revisions(self.revision_rows, options["batch_size"])
+
+        if options["index"]:
+            self.index_pages(page_ids, options["batch_size"])
+
+        # Bulk inserts send no signals, so clear the caches they would have.
+        autocomplete.invalidate()
+        invalidate_site()
+        site_index.invalidate()
+
+        self.stdout.write(
+            "Created %d pages in %.1fs." % (len(page_ids), time.perf_counter() - start)
+        )
+
+    def create_pages(self, parent, count, fanout, batch_size):
+        """
+        Insert ``count`` pages breadth first below ``parent`` and return
+        their ids. The k-th new page (from 0) is the parent of pages
+        ``fanout * (k + 1)`` to ``fanout * (k + 2) - 1``, so every path and
+        child count is known before anything is written.
+        """
+        last_child = parent.get_last_child()
+        first_step = (
+            Page._str2int(last_child.path[-Page.steplen :]) + 1 if last_child else 1
+        )
+        self.values = {
+            "content_type": self.content_type.pk,
+            "locale": parent.locale_id,
+            "live": True,
+            "first_published_at": self.now,
+            "last_published_at": self.now,
+            "latest_revision_created_at": self.now,
+        }
+
+        paths = []
+        url_paths = []
+        page_ids = []
+        batch = []
+        for k in range(count):
+            if k < fanout:
+                parent_path, parent_url_path = parent.path, parent.url_path
+                step = first_step + k
+            else:
+                parent_index = k // fanout - 1
+                parent_path = paths[parent_index]
+                parent_url_path = url_paths[parent_index]
+                step = k % fanout + 1
+
+            title = " ".join(self.rng.sample(WORDS, 3)).capitalize()
+            slug = "%s-%d" % (slugify(title), step)
+            path = parent_path + Page._int2str(step).rjust(Page.steplen, "0")
+            url_path = "%s%s/" % (parent_url_path, slug)
+            paths.append(path)
+            url_paths.append(url_path)
+
+            batch.append(
+                {
+                    "title": title,
+                    "draft_title": title,
+                    "slug": slug,
+                    "path": path,
+                    "depth": len(path) // Page.steplen,
+                    "numchild": max(0, min(fanout, count - fanout * (k + 1))),
+                    "url_path": url_path,
+                    "translation_key": uuid4(),
+                }
+            )
+            if len(batch) >= batch_size:
+                page_ids.extend(self.insert_pages(batch))
+                batch = []
+        page_ids.extend(self.insert_pages(batch))
+
+        Page.objects.filter(pk=parent.pk).update(
+            numchild=parent.numchild + min(fanout, count)
+        )
+        return page_ids
+
+    def insert_rows(self, model, rows, values):
+        """
+        Insert ``rows`` (dicts of field name to value) into the table of
+        ``model`` with a single executemany(), filling in the other fields
+        from ``values`` or their defaults. This skips building a model
+        instance per row, which is most of the cost of ``bulk_create()``.
+        """
+        fields = [
+            field
+            for field in model._meta.local_concrete_fields
+            if not field.primary_key or field.remote_field
+        ]
+        constants = {
+            field.name: field.get_db_prep_save(
+                values.get(field.name, field.get_default()), connection
+            )
+            for field in fields
+            if field.name not in rows[0]
+        }
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            connection.ops.quote_name(model._meta.db_table),
+            ", ".join(connection.ops.quote_name(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                sql,
+                [
+                    [
+                        field.get_db_prep_save(row[field.name], connection)
+                        if field.name in row
+                        else constants[field.name]
+                        for field in fields
+                    ]
+                    for row in rows
+                ],
+            )
+
+    def insert_pages(self, rows):
+        """
+        Insert the pages in ``rows`` and their HomePage rows, returning the
+        page ids. ``bulk_create`` does not support multi-table inheritance.
+        """
+        if not rows:
+            return []
+        self.insert_rows(Page, rows, self.values)
+        ids = dict(
+            Page.objects.filter(path__in=[row["path"] for row in rows]).values_list(
+                "path", "id"
+            )
+        )
+        self.insert_rows(
+            HomePage, [{"page_ptr": ids[row["path"]]} for row in rows], {}
+        )
+
+        for row in rows:
+            row["id"] = ids[row["path"]]
+        if self.revision_rows is not None:
+            self.revision_rows.extend(rows)
+        return [row["id"] for row in rows]
+
+    def create_revisions(self, rows, batch_size):
+        """
+        Give each page a revision of its current content and make it the
+        latest and live revision.
+        """
+        base_content_type = ContentType.objects.get_for_model(Page)
+        # Revision content is the page's field values, as serialised by
+        # Page.serializable_data().
+        content = {
+            field.name: self.values.get(field.name, field.get_default())
+            for field in HomePage._meta.fields
+            if field.serialize
+        }
+        values = {
+            "content_type": self.content_type.pk,
+            "base_content_type": base_content_type.pk,
+            "created_at": self.now,
+        }
+
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+            self.insert_rows(
+                Revision,
+                [
+                    {
+                        "object_id": str(row["id"]),
+                        "object_str": row["title"],
+                        "content": {
+                            **content,
+                            **{key: value for key, value in row.items() if key != "id"},
+                            "pk": row["id"],
+                            "translation_key": str(row["translation_key"]),
+                        },
+                    }
+                    for row in batch
+                ],
+                values,
+            )
+
+            revision_id = Subquery(
+                Revision.objects.filter(
+                    base_content_type=base_content_type,
+                    object_id=Cast(OuterRef("pk"), CharField()),
+                ).values("pk")[:1]
+            )
+            Page.objects.filter(pk__in=[row["id"] for row in batch]).update(
+                latest_revision_id=revision_id, live_revision_id=revision_id
+            )
+
+    def index_pages(self, page_ids, batch_size):
+        backend = get_search_backend()
+        for i in range(0, len(page_ids), batch_size):
+            with transaction.atomic():
+                backend.add_bulk(
+                    HomePage,
+                    list(HomePage.objects.filter(pk__in=page_ids[i : i + batch_size])),
+                )
@@ -0,0 +1,88 @@
+import logging
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cms import renditions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the RENDITION_WARMUP_FILTERS renditions of queued images in a "
+        "process pool, polling for more until stopped (or once with --once)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help=(
+                "Worker processes (default: RENDITION_WARMUP_WORKERS); 0 renders "
+                "in this process."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Number of queued images rendered at once.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling again when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling.",
+        )
+
+    def handle(self, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        workers = options["workers"]
+        if workers is None:
+            workers = renditions.get_workers()
+        executor = renditions.create_executor(workers)
+        try:
+            while not self.stopping:
+                close_old_connections()
+                start = time.perf_counter()
+                try:
+                    images, created = renditions.process_batch(
+                        options["batch_size"], executor
+                    )
+                except Exception:
+                    # E.g. the database is unavailable; try again later.
+                    if options["once"]:
+                        raise
+                    logger.exception("Could not process the rendition queue")
+                    time.sleep(options["interval"])
+                    continue
+                if images:
+                    self.stdout.write(
+                        "Created %d renditions of %d images in %.2fs."
+                        % (created, images, time.perf_counter() - start)
+                    )
+                elif options["once"]:
+                    break
+                else:
+                    time.sleep(options["interval"])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def stop(self, signum, frame):
+        # Finish the current batch, then exit.
+        self.stopping = True
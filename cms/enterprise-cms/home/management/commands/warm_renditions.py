@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wagtail.images import get_image_model
+from wagtail.images.exceptions import InvalidFilterSpecError
+from wagtail.images.models import Filter
+
+from cms.renditions import (
+    create_executor,
+    get_filter_specs,
+    get_workers,
+    warm_renditions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the renditions in RENDITION_WARMUP_FILTERS (or --filter) that "
+        "existing images do not have yet, rendering them in a process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--filter",
+            action="append",
+            dest="filters",
+            help="Filter spec to render, e.g. fill-300x200; may be repeated.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help=(
+                "Worker processes (default: RENDITION_WARMUP_WORKERS); 0 renders "
+                "in this process."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Images rendered at once (default: four per worker).",
+        )
+
+    def handle(self, *args, **options):
+        specs = options["filters"] or get_filter_specs()
+        if not specs:
+            raise CommandError(
+                "No filter specs: set RENDITION_WARMUP_FILTERS or pass --filter."
+            )
+        for spec in specs:
+            try:
+                Filter(spec=spec).operations
+            except (InvalidFilterSpecError, ValueError) as e:
+                raise CommandError("Invalid filter spec %r: %s" % (spec, e))
+
+        workers = get_workers() if options["workers"] is None else options["workers"]
+        batch_size = options["batch_size"] or max(workers, 1) * 4
+
+        start = time.perf_counter()
+        images = get_image_model().objects.order_by("pk")
+        created = 0
+        executor = create_executor(workers)
+        try:
+            batch = []
+            for image in images.iterator(chunk_size=batch_size):
+                batch.append(image)
+                if len(batch) >= batch_size:
+                    created += warm_renditions(batch, specs, executor)
+                    batch = []
+            created += warm_renditions(batch, specs, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(
+            "Created %d renditions in %.1fs." % (created, time.perf_counter() - start)
+        )
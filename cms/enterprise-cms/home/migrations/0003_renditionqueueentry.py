@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+from wagtail.images import get_image_model_string
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0002_create_homepage'),
+        migrations.swappable_dependency(get_image_model_string()),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenditionQueueEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued_at', models.DateTimeField()),
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=get_image_model_string())),
+            ],
+            options={
+                'verbose_name_plural': 'rendition queue entries',
+            },
+        ),
+    ]
@@ -1,7 +1,27 @@
 from django.db import models
 
+from wagtail.images import get_image_model_string
 from wagtail.models import Page
 
 
 class HomePage(Page):
     pass
+
+
+class RenditionQueueEntry(models.Model):
+    """
+    An image whose RENDITION_WARMUP_FILTERS renditions are waiting for
+    ``manage.py process_rendition_queue`` (see ``cms.renditions``). There is
+    at most one entry per image; queueing it again moves ``queued_at``.
+    """
+
+    image = models.OneToOneField(
+        get_image_model_string(), on_delete=models.CASCADE, related_name="+"
+    )
+    queued_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "rendition queue entries"
+
+    def __str__(self):
+        return str(self.image_id)
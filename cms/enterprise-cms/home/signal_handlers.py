@@ -0,0 +1,139 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from wagtail.contrib.redirects.models import Redirect
+from wagtail.documents import get_document_model
+from wagtail.images import get_image_model
+from wagtail.models import Page, Site
+from wagtail.signals import page_published, page_unpublished, post_page_move
+
+from cms import page_cache, renditions, site_index
+from cms.media_cache import get_media_cache
+
+
+def invalidate_file_cache(sender, instance, **kwargs):
+    """
+    Drop cached metadata and content for the file of a saved or deleted
+    image, rendition or document.
+    """
+    if instance.file:
+        get_media_cache().invalidate(instance.file.storage, instance.file.name)
+
+
+def invalidate_replaced_file_cache(sender, instance, **kwargs):
+    """
+    Drop cached entries for the file an image or document is about to stop
+    pointing at when its file is replaced.
+    """
+    if instance.pk:
+        for name in sender.objects.filter(pk=instance.pk).values_list(
+            "file", flat=True
+        ):
+            get_media_cache().invalidate(instance.file.storage, name)
+
+
+def invalidate_page_cache(sender, instance, **kwargs):
+    """
+    Drop cached responses for a published, unpublished or deleted page and
+    its ancestors.
+    """
+    if isinstance(instance, Page):
+        page_cache.invalidate_page(instance)
+
+
+def invalidate_moved_page_cache(
+    sender, instance, parent_page_before, parent_page_after, **kwargs
+):
+    """
+    Drop cached responses for a moved page's subtree, whose URLs have all
+    changed, and for its old and new ancestors.
+    """
+    page_cache.invalidate_pages(
+        Page.objects.descendant_of(instance, inclusive=True).values_list(
+            "id", flat=True
+        )
+    )
+    page_cache.invalidate_page(parent_page_before)
+    page_cache.invalidate_page(parent_page_after)
+
+
+def invalidate_site_page_cache(sender, instance, **kwargs):
+    page_cache.invalidate_site()
+
+
+def invalidate_site_index(sender, **kwargs):
+    site_index.invalidate()
+
+
+def invalidate_site_index_for_page(sender, instance, **kwargs):
+    """
+    Drop the site index when a change to a page may alter a site root page,
+    whose specific instance it holds, or the URL of a redirect target.
+    """
+    if isinstance(instance, Page):
+        site_index.invalidate_for_page(instance)
+
+
+def note_rendition_source_change(
+    sender, instance, raw=False, update_fields=None, **kwargs
+):
+    """
+    Note whether an image's file or focal point, which its renditions are
+    made from, is about to change, so that edits to its title, tags or
+    collection do not queue it.
+    """
+    if raw or not instance.pk or not renditions.get_filter_specs():
+        return
+    fields = renditions.SOURCE_FIELDS
+    if update_fields is not None and not set(update_fields) & set(fields):
+        instance._rendition_source_changed = False
+        return
+    current = tuple(
+        instance.file.name if field == "file" else getattr(instance, field)
+        for field in fields
+    )
+    instance._rendition_source_changed = (
+        sender.objects.filter(pk=instance.pk).values_list(*fields).first() != current
+    )
+
+
+def queue_image_renditions(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Queue a new image, or one whose file or focal point changed, for
+    process_rendition_queue, which renders its RENDITION_WARMUP_FILTERS
+    renditions so that its first viewers do not wait for them.
+    """
+    if raw or not renditions.get_filter_specs():
+        return
+    if created or getattr(instance, "_rendition_source_changed", True):
+        renditions.enqueue(instance)
+
+
+def register_signal_handlers():
+    Image = get_image_model()
+    Document = get_document_model()
+
+    for model in (Image, Document):
+        pre_save.connect(invalidate_replaced_file_cache, sender=model)
+
+    for model in (Image, Image.get_rendition_model(), Document):
+        post_save.connect(invalidate_file_cache, sender=model)
+        post_delete.connect(invalidate_file_cache, sender=model)
+
+    pre_save.connect(note_rendition_source_change, sender=Image)
+    post_save.connect(queue_image_renditions, sender=Image)
+
+    page_published.connect(invalidate_page_cache)
+    page_unpublished.connect(invalidate_page_cache)
+    post_delete.connect(invalidate_page_cache)
+    post_page_move.connect(invalidate_moved_page_cache)
+    post_save.connect(invalidate_site_page_cache, sender=Site)
+    post_delete.connect(invalidate_site_page_cache, sender=Site)
+
+    for model in (Site, Redirect):
+        post_save.connect(invalidate_site_index, sender=model)
+        post_delete.connect(invalidate_site_index, sender=model)
+    page_published.connect(invalidate_site_index_for_page)
+    page_unpublished.connect(invalidate_site_index_for_page)
+    post_save.connect(invalidate_site_index_for_page)
+    post_delete.connect(invalidate_site_index_for_page)
+    post_page_move.connect(invalidate_site_index)
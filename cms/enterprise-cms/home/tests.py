@@ -1,9 +1,28 @@
+import os
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.template import engines
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from home.models import HomePage
 
-from wagtail.models import Page
+from wagtail.contrib.redirects.models import Redirect
+from wagtail.models import Page, Site
 from wagtail.test.utils import WagtailPageTestCase
 
+from cms import site_index
+from cms.startup import get_disk_migrations, get_unapplied_migrations
+from cms.template_cache import warm_templates
+
 
 class HomeSetUpTests(WagtailPageTestCase):
     """
@@ -41,3 +60,320 @@ class HomeTests(WagtailPageTestCase):
     def test_homepage_template_used(self):
         response = self.client.get(reverse("home"))
         self.assertTemplateUsed(response, "home/home_page.html")
+
+
+@override_settings(
+    MIDDLEWARE=[*settings.MIDDLEWARE, "cms.page_cache.PageCacheMiddleware"],
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    REQUEST_BUDGETS_STRICT=True,
+)
+class PageCacheTests(WagtailPageTestCase):
+    """
+    Tests for the anonymous full-page response cache.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(site_index.reset)
+        self.homepage = HomePage.objects.get(slug="home")
+
+    def test_anonymous_view_served_from_cache(self):
+        self.client.get("/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Home")
+
+    async def test_async_view_served_from_cache(self):
+        await self.async_client.get("/")
+        response = await self.async_client.get("/")
+        self.assertTemplateNotUsed(response, "home/home_page.html")
+        self.assertContains(response, "Home")
+
+    def test_ignored_query_params_share_cache_entry(self):
+        self.client.get("/")
+        with self.assertNumQueries(0):
+            self.client.get("/?utm_source=newsletter")
+
+    def test_other_query_params_bypass_cache(self):
+        self.client.get("/?q=1")
+        response = self.client.get("/?q=1")
+        self.assertTemplateUsed(response, "home/home_page.html")
+
+    def test_authenticated_user_bypasses_cache(self):
+        self.client.get("/")
+        user = get_user_model().objects.create_superuser(
+            username="admin", email="admin@example.com", password="password"
+        )
+        self.client.force_login(user)
+        response = self.client.get("/")
+        self.assertTemplateUsed(response, "home/home_page.html")
+
+    def test_publish_invalidates_page(self):
+        self.client.get("/")
+        self.homepage.title = "Welcome"
+        self.homepage.save_revision().publish()
+        response = self.client.get("/")
+        self.assertContains(response, "Welcome")
+
+    def test_publishing_child_invalidates_parent(self):
+        child = HomePage(title="Child", slug="child")
+        self.homepage.add_child(instance=child)
+        self.client.get("/")
+        child.save_revision().publish()
+        response = self.client.get("/")
+        self.assertTemplateUsed(response, "home/home_page.html")
+
+    def test_publishing_parent_keeps_child_cached(self):
+        child = HomePage(title="Child", slug="child")
+        self.homepage.add_child(instance=child)
+        self.client.get("/child/")
+        self.homepage.save_revision().publish()
+        with self.assertNumQueries(0):
+            self.client.get("/child/")
+
+
+@override_settings(ALLOWED_HOSTS=["*"])
+class SiteIndexTests(WagtailPageTestCase):
+    """
+    Tests for the in-process site and redirect index.
+    """
+
+    def setUp(self):
+        # Rolling back a test's changes sends no signals.
+        site_index.reset()
+        self.addCleanup(site_index.reset)
+        self.homepage = HomePage.objects.get(slug="home")
+        self.site = Site.objects.get(is_default_site=True)
+
+    def get_table_queries(self, url, table, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **kwargs)
+        return response, [q["sql"] for q in queries if table in q["sql"]]
+
+    def test_page_render_makes_no_site_queries(self):
+        self.client.get("/")
+        response, queries = self.get_table_queries("/", "wagtailcore_site")
+        self.assertContains(response, "Home")
+        self.assertEqual(queries, [])
+
+    def test_404_redirect_makes_no_redirect_queries(self):
+        Redirect.objects.create(old_path="/old", redirect_link="https://example.com/")
+        self.client.get("/missing/")
+        response, queries = self.get_table_queries("/old/", "wagtailredirects")
+        self.assertRedirects(
+            response, "https://example.com/", 301, fetch_redirect_response=False
+        )
+        self.assertEqual(queries, [])
+
+        response, queries = self.get_table_queries("/missing/", "wagtailredirects")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(queries, [])
+
+    async def test_async_redirect(self):
+        await Redirect.objects.acreate(
+            old_path="/old", redirect_link="https://example.com/"
+        )
+        response = await self.async_client.get("/old/")
+        self.assertRedirects(
+            response, "https://example.com/", 301, fetch_redirect_response=False
+        )
+
+    def test_redirect_to_page(self):
+        child = HomePage(title="Child", slug="child")
+        self.homepage.add_child(instance=child)
+        Redirect.objects.create(
+            old_path="/old?a=1", redirect_page=child, is_permanent=False
+        )
+        response = self.client.get("/old/?a=1")
+        self.assertRedirects(response, "/child/", 302, fetch_redirect_response=False)
+        # Falls back to the path without the query string.
+        Redirect.objects.create(old_path="/other", redirect_page=child)
+        response = self.client.get("/other/?b=2")
+        self.assertRedirects(response, "/child/", 301, fetch_redirect_response=False)
+
+    def test_moving_redirect_target_updates_link(self):
+        child = HomePage(title="Child", slug="child")
+        other = HomePage(title="Other", slug="other")
+        self.homepage.add_child(instance=child)
+        self.homepage.add_child(instance=other)
+        Redirect.objects.create(old_path="/old", redirect_page=child)
+        self.client.get("/old/")
+        child.move(other, pos="last-child")
+        response = self.client.get("/old/")
+        self.assertRedirects(
+            response, "/other/child/", 301, fetch_redirect_response=False
+        )
+
+    def test_site_specific_redirect_preferred(self):
+        Redirect.objects.create(old_path="/old", redirect_link="https://all.example/")
+        Redirect.objects.create(
+            old_path="/old", site=self.site, redirect_link="https://site.example/"
+        )
+        response = self.client.get("/old/")
+        self.assertRedirects(
+            response, "https://site.example/", 301, fetch_redirect_response=False
+        )
+
+    def test_redirect_changes_invalidate_index(self):
+        self.assertEqual(self.client.get("/old/").status_code, 404)
+        redirect = Redirect.objects.create(
+            old_path="/old", redirect_link="https://example.com/"
+        )
+        self.assertEqual(self.client.get("/old/").status_code, 301)
+        redirect.delete()
+        self.assertEqual(self.client.get("/old/").status_code, 404)
+
+    def test_site_changes_invalidate_index(self):
+        other = HomePage(title="Other site", slug="other")
+        self.homepage.add_child(instance=other)
+        self.client.get("/", HTTP_HOST="other.example")
+        Site.objects.create(hostname="other.example", root_page=other)
+        response = self.client.get("/", HTTP_HOST="other.example")
+        self.assertContains(response, "Other site")
+        response = self.client.get("/", HTTP_HOST="localhost")
+        self.assertContains(response, "Home")
+
+    def test_site_matching(self):
+        other = Site.objects.create(hostname="other.example", port=8080, root_page=self.homepage)
+        index = site_index.get_site_index()
+        self.assertEqual(index.find_site("other.example", "8080"), other)
+        # The only site on the hostname is preferred to the default site.
+        self.assertEqual(index.find_site("other.example", "80"), other)
+        self.assertEqual(index.find_site("unknown.example", "80"), self.site)
+
+        Site.objects.create(hostname="other.example", port=8081, root_page=self.homepage)
+        index = site_index.get_site_index()
+        self.assertEqual(index.find_site("other.example", "80"), self.site)
+
+    @override_settings(SITE_INDEX_REFRESH_INTERVAL=0)
+    def test_changes_in_other_processes_picked_up(self):
+        index = site_index.get_site_index()
+        self.assertIs(site_index.get_site_index(), index)
+        cache.set(site_index.VERSION_CACHE_KEY, "changed elsewhere", None)
+        self.assertIsNot(site_index.get_site_index(), index)
+
+
+class TemplateWarmupTests(WagtailPageTestCase):
+    """
+    Tests for compiling the project's templates at start-up.
+    """
+
+    def test_warm_templates_compiles_project_templates(self):
+        loader = engines["django"].engine.template_loaders[0]
+        loader.reset()
+        self.assertGreaterEqual(warm_templates(), 6)
+        self.assertIn("home/home_page.html", loader.get_template_cache)
+        self.assertIn("search/search.html", loader.get_template_cache)
+        self.assertNotIn("wagtailadmin/base.html", loader.get_template_cache)
+
+
+@mock.patch.dict(
+    os.environ,
+    {
+        "DJANGO_SUPERUSER_USERNAME": "admin",
+        "DJANGO_SUPERUSER_EMAIL": "admin@example.com",
+        "DJANGO_SUPERUSER_PASSWORD": "password",
+    },
+)
+class BootstrapTests(TestCase):
+    """
+    Tests for the start-up migration check and superuser bootstrap.
+    """
+
+    def bootstrap(self, *args):
+        with mock.patch(
+            "home.management.commands.bootstrap.call_command",
+            wraps=call_command,
+        ) as mock_call_command:
+            call_command("bootstrap", *args, stdout=StringIO())
+        return [call.args[0] for call in mock_call_command.call_args_list]
+
+    def mark_unapplied(self, app_label, name):
+        MigrationRecorder(connection).record_unapplied(app_label, name)
+
+    def test_disk_migrations_found_without_importing(self):
+        migrations = get_disk_migrations()
+        self.assertIn(("home", "0002_create_homepage"), migrations)
+        self.assertIn(("wagtailcore", "0001_initial"), migrations)
+        self.assertEqual(get_unapplied_migrations(), set())
+
+    def test_up_to_date_database_is_not_migrated(self):
+        with self.assertNumQueries(4):
+            # Two for the migration check, two to create the superuser.
+            commands = self.bootstrap()
+        self.assertEqual(commands, ["createinitialsuperuser"])
+        self.assertTrue(get_user_model().objects.filter(username="admin").exists())
+
+    def test_pending_migrations_are_applied(self):
+        self.mark_unapplied("home", "0002_create_homepage")
+        with mock.patch(
+            "django.core.management.commands.migrate.Command.handle",
+            return_value="",
+        ):
+            commands = self.bootstrap()
+        self.assertEqual(commands, ["migrate", "createinitialsuperuser"])
+
+    def test_check_mode_fails_when_migrations_pending(self):
+        self.mark_unapplied("home", "0002_create_homepage")
+        with self.assertRaisesMessage(CommandError, "home.0002_create_homepage"):
+            self.bootstrap("--mode", "check")
+
+    def test_skip_mode(self):
+        self.mark_unapplied("home", "0002_create_homepage")
+        self.assertEqual(self.bootstrap("--mode", "skip"), ["createinitialsuperuser"])
+
+
+class LoadPageTreeTests(WagtailPageTestCase):
+    """
+    Tests for the bulk page tree loader.
+    """
+
+    def setUp(self):
+        self.addCleanup(site_index.reset)
+        self.homepage = HomePage.objects.get(slug="home")
+
+    def load(self, *args):
+        call_command("load_page_tree", *args, stdout=StringIO())
+
+    def test_tree_is_valid(self):
+        self.load("60", "--fanout", "5")
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+        self.homepage.refresh_from_db()
+        self.assertEqual(self.homepage.get_descendants().count(), 60)
+        self.assertEqual(self.homepage.get_children().count(), 5)
+
+        # The tree can be extended with the usual API afterwards.
+        leaf = self.homepage.get_descendants().filter(numchild=0).last()
+        leaf.add_child(instance=HomePage(title="Child", slug="child"))
+        self.load("10", "--fanout", "5")
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+        self.homepage.refresh_from_db()
+        self.assertEqual(self.homepage.get_children().count(), 10)
+
+    def test_pages_are_live_and_routable(self):
+        self.load("30", "--fanout", "3")
+        page = HomePage.objects.filter(depth=5).first()
+        self.assertTrue(page.live)
+        response = self.client.get(page.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, page.title)
+
+    def test_revisions_created(self):
+        self.load("20")
+        page = HomePage.objects.filter(depth=3).first()
+        self.assertEqual(page.live_revision_id, page.latest_revision_id)
+        revision = page.get_latest_revision_as_object()
+        self.assertEqual(revision.title, page.title)
+        self.assertEqual(revision.url_path, page.url_path)
+
+    def test_pages_indexed(self):
+        self.load("20")
+        page = HomePage.objects.filter(depth=3).first()
+        results = HomePage.objects.live().search(page.title.split()[0])
+        self.assertIn(page, list(results))
+
+    def test_pages_created_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.load("200")
+        self.assertLess(len(queries), 25)
@@ -0,0 +1,8 @@
+from wagtail import hooks
+
+from cms.page_cache import mark_page_served
+
+
+@hooks.register("before_serve_page")
+def mark_page_for_page_cache(page, request, serve_args, serve_kwargs):
+    mark_page_served(request, page)
@@ -0,0 +1,347 @@
+"""
+In-memory prefix index over live page titles for search autocomplete.
+
+Every word of every title is a key into a sorted array, so a lookup is a
+binary search followed by a short scan and never touches the database. The
+index is built when the application loads (see ``cms.wsgi``), or on first
+use otherwise, and kept current in the publishing process by the signal
+handlers in ``search.signal_handlers``.
+
+Those handlers also append the id of each published or unpublished page to
+a change log in the shared cache: a sequence number, and one short-lived
+entry per change. Other processes check the sequence at most every
+SEARCH_AUTOCOMPLETE_REFRESH_INTERVAL seconds and, in a background thread,
+reload just the changed pages. The index is only rebuilt from scratch when
+``invalidate()`` is called (for moves and view restrictions, which affect
+whole subtrees), when more than MAX_INCREMENTAL_CHANGES pages have changed,
+or when the log is incomplete, e.g. because entries expired. Requests are
+served from the previous index until a rebuild finishes.
+
+Pages in sections with view restrictions are left out, since the endpoint is
+public.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+
+from wagtail.models import Page, PageViewRestriction, Site
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CACHE_KEY = "search:autocomplete:generation"
+SEQUENCE_CACHE_KEY = "search:autocomplete:sequence"
+CHANGE_CACHE_KEY = "search:autocomplete:change:%d"
+
+# Processes that have not caught up within this many seconds rebuild.
+CHANGE_TIMEOUT = 60 * 60
+
+# Beyond this many changed pages, rebuilding is quicker than inserting each
+# title into the sorted array.
+MAX_INCREMENTAL_CHANGES = 1000
+
+
+def normalize(text):
+    return " ".join(text.casefold().split())
+
+
+def get_title_keys(title):
+    """
+    Return a key for each word of ``title``, running to the end of the title,
+    so that any word can be used as the start of a prefix.
+    """
+    words = normalize(title).split(" ")
+    return {" ".join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class AutocompleteIndex:
+    def __init__(self, generation=None, sequence=0):
+        self.generation = generation
+        self.sequence = sequence
+        self.entries = []
+        self.pages = {}
+        self.site_root_paths = []
+        self.restricted_paths = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, generation=None, sequence=0):
+        index = cls(generation, sequence)
+        index.site_root_paths = sorted(
+            Site.get_site_root_paths(), key=lambda root: -len(root.root_path)
+        )
+        index.restricted_paths = list(
+            PageViewRestriction.objects.values_list("page__path", flat=True)
+        )
+
+        entries = []
+        for page_id, title, path, url_path in (
+            get_live_pages().values_list("id", "title", "path", "url_path").iterator()
+        ):
+            url = index.get_url(path, url_path)
+            if url is None:
+                continue
+            index.pages[page_id] = (title, url)
+            entries.extend((key, page_id) for key in get_title_keys(title))
+
+        entries.sort()
+        index.entries = entries
+        return index
+
+    def get_url(self, path, url_path):
+        """
+        Return the URL of a page from its tree path and URL path, or ``None``
+        if it is not routable or is behind a view restriction.
+        """
+        if any(path.startswith(restricted) for restricted in self.restricted_paths):
+            return None
+
+        for root in self.site_root_paths:
+            if url_path.startswith(root.root_path):
+                page_path = url_path[len(root.root_path) - 1 :]
+                if len(self.site_root_paths) == 1:
+                    return page_path
+                return root.root_url + page_path
+        return None
+
+    def add_page(self, page):
+        self.add(page.id, page.title, page.path, page.url_path)
+
+    def add(self, page_id, title, path, url_path):
+        url = self.get_url(path, url_path)
+        with self._lock:
+            self._remove(page_id)
+            if url is None:
+                return
+            self.pages[page_id] = (title, url)
+            for key in get_title_keys(title):
+                insort(self.entries, (key, page_id))
+
+    def remove_page(self, page_id):
+        with self._lock:
+            self._remove(page_id)
+
+    def _remove(self, page_id):
+        page = self.pages.pop(page_id, None)
+        if page is None:
+            return
+        for key in get_title_keys(page[0]):
+            i = bisect_left(self.entries, (key, page_id))
+            if i < len(self.entries) and self.entries[i] == (key, page_id):
+                del self.entries[i]
+
+    def apply_changes(self, page_ids):
+        """
+        Reload the pages in ``page_ids`` from the database, removing those
+        that are no longer live.
+        """
+        live = get_live_pages().filter(id__in=page_ids)
+        found = set()
+        for page_id, title, path, url_path in live.values_list(
+            "id", "title", "path", "url_path"
+        ):
+            self.add(page_id, title, path, url_path)
+            found.add(page_id)
+        for page_id in set(page_ids) - found:
+            self.remove_page(page_id)
+
+    def search(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        entries = self.entries
+        i = bisect_left(entries, (prefix,))
+        while len(results) < limit:
+            try:
+                key, page_id = entries[i]
+            except IndexError:
+                # The end of the list, which may have shrunk meanwhile.
+                break
+            i += 1
+            if not key.startswith(prefix):
+                break
+            page = self.pages.get(page_id)
+            if page is None or page_id in seen:
+                continue
+            seen.add(page_id)
+            results.append({"title": page[0], "url": page[1]})
+        return results
+
+
+def get_live_pages():
+    return Page.objects.live().filter(depth__gt=1)
+
+
+_index = None
+_index_lock = threading.Lock()
+_last_version_check = 0
+_refresh_lock = threading.Lock()
+_refreshing = False
+_refresh_pending = False
+_rebuild_pending = False
+
+
+def get_autocomplete_index():
+    """
+    Return the current index, building it if it was not built at start-up,
+    and start a background refresh if other processes have published
+    changes.
+    """
+    global _index, _last_version_check
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build()
+                _last_version_check = time.monotonic()
+        return _index
+
+    interval = getattr(settings, "SEARCH_AUTOCOMPLETE_REFRESH_INTERVAL", 5)
+    if interval is not None and time.monotonic() - _last_version_check > interval:
+        _last_version_check = time.monotonic()
+        if get_shared_state() != (_index.generation, _index.sequence):
+            start_refresh()
+    return _index
+
+
+def warm():
+    """
+    Build the index when the application loads, so that no request waits
+    for it. A failure is logged, and the index is then built on first use.
+    """
+    global _index, _last_version_check
+
+    try:
+        _index = build()
+    except DatabaseError:
+        logger.exception("Could not build the autocomplete index")
+    _last_version_check = time.monotonic()
+
+
+def get_shared_state():
+    values = cache.get_many([GENERATION_CACHE_KEY, SEQUENCE_CACHE_KEY])
+    return values.get(GENERATION_CACHE_KEY), values.get(SEQUENCE_CACHE_KEY, 0)
+
+
+def build():
+    # Read the shared state first: changes made while building are applied
+    # again by the next refresh, which does no harm.
+    return AutocompleteIndex.build(*get_shared_state())
+
+
+def get_changed_page_ids(start, end):
+    """
+    Return the ids of the pages changed after sequence number ``start`` up
+    to ``end``, or ``None`` if they are not all in the log any more.
+    """
+    if end < start or end - start > MAX_INCREMENTAL_CHANGES:
+        return None
+    keys = [CHANGE_CACHE_KEY % n for n in range(start + 1, end + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return None
+    return set(changes.values())
+
+
+def refresh(rebuild=False):
+    """
+    Bring the index up to date with the shared change log, rebuilding it if
+    ``rebuild`` is true or the log does not cover the changes.
+    """
+    global _index
+
+    index = _index
+    generation, sequence = get_shared_state()
+    if not rebuild and index is not None and index.generation == generation:
+        page_ids = get_changed_page_ids(index.sequence, sequence)
+        if page_ids is not None:
+            index.apply_changes(page_ids)
+            index.sequence = sequence
+            return
+    _index = AutocompleteIndex.build(generation, sequence)
+
+
+def start_refresh(rebuild=False):
+    """
+    Refresh the index in a background thread, or once more after the
+    refresh already running.
+    """
+    global _refreshing, _refresh_pending, _rebuild_pending
+
+    with _refresh_lock:
+        _refresh_pending = True
+        _rebuild_pending = _rebuild_pending or rebuild
+        if _refreshing:
+            return
+        _refreshing = True
+    threading.Thread(target=run_refreshes, daemon=True).start()
+
+
+def run_refreshes():
+    global _refreshing, _refresh_pending, _rebuild_pending
+
+    try:
+        while True:
+            with _refresh_lock:
+                if not _refresh_pending:
+                    _refreshing = False
+                    return
+                rebuild = _rebuild_pending
+                _refresh_pending = _rebuild_pending = False
+            try:
+                refresh(rebuild)
+            except Exception:
+                logger.exception("Could not refresh the autocomplete index")
+    finally:
+        connection.close()
+
+
+def record_change(page_id):
+    """
+    Append ``page_id`` to the change log read by other processes.
+    """
+    cache.add(SEQUENCE_CACHE_KEY, 0, None)
+    try:
+        sequence = cache.incr(SEQUENCE_CACHE_KEY)
+    except ValueError:
+        # The key was evicted in the meantime; have every process rebuild.
+        cache.set(GENERATION_CACHE_KEY, uuid4().hex, None)
+        return
+    cache.set(CHANGE_CACHE_KEY % sequence, page_id, CHANGE_TIMEOUT)
+
+
+def update_page(page):
+    if _index is not None:
+        _index.add_page(page)
+    record_change(page.id)
+
+
+def remove_page(page_id):
+    if _index is not None:
+        _index.remove_page(page_id)
+    record_change(page_id)
+
+
+def invalidate():
+    """
+    Rebuild the index in every process, for changes such as moves or new
+    view restrictions that affect many pages at once. The current index is
+    served until the new one is ready.
+    """
+    cache.set(GENERATION_CACHE_KEY, uuid4().hex, None)
+    if _index is not None:
+        start_refresh(rebuild=True)
+
+
+def reset():
+    global _index
+    _index = None
@@ -0,0 +1,197 @@
+"""
+Queued search index updates.
+
+Wagtail updates an object's index entries when the object is saved, in the
+request that saved it (as a task run when the transaction commits). Moving,
+copying or publishing many pages at once therefore keeps the editor waiting
+while each page is indexed in turn.
+
+With SEARCH_INDEX_QUEUE, saving or deleting an indexed object only records
+it in the ``IndexQueueEntry`` table, in the same transaction, and
+``manage.py process_search_queue`` applies the queued updates in batches:
+objects that still exist (and are in their model's indexed objects) are
+added with one ``add_bulk()`` per model, the others are deleted from the
+index. An object saved many times before the worker gets to it is queued,
+and indexed, once. No broker is needed, and the queue survives restarts.
+
+The search backends should have AUTO_UPDATE off in this mode, so that
+Wagtail does not update the index itself as well (production.py does this).
+
+``queued_at`` is when an entry is next due. A worker claims due entries in
+a short transaction (with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+database supports it, so several workers can share the queue) by moving
+their ``queued_at`` CLAIM_TIMEOUT into the future, and indexes them outside
+any transaction. An editor saving a claimed object therefore never waits
+for the batch: the upsert just sets ``queued_at`` back to now, and the entry
+is kept for the next batch. If a worker dies mid-batch, its entries become
+due again once the claim expires.
+
+Each model's objects are indexed in a transaction of their own. If indexing
+them fails, the error is logged, the rest of the batch goes ahead, and their
+entries are retried after an exponentially growing delay. After MAX_ATTEMPTS
+failures an entry is left in the table but no longer claimed, until the
+object is saved again.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils import timezone
+
+from wagtail.models import Page
+from wagtail.search.backends import get_search_backends_with_name
+
+from search.models import IndexQueueEntry
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+# Doubled after each failed attempt.
+RETRY_DELAY = timedelta(minutes=1)
+
+# How long a worker has to index the entries it has claimed.
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def is_enabled():
+    return getattr(settings, "SEARCH_INDEX_QUEUE", False)
+
+
+def get_content_type_id(instance):
+    if isinstance(instance, Page):
+        # Index the specific page, as Wagtail does, even when a plain Page
+        # instance was saved.
+        return instance.content_type_id
+    return ContentType.objects.get_for_model(instance).pk
+
+
+def enqueue(instances):
+    """
+    Queue index updates for ``instances``, or move the existing entries to
+    the back of the queue.
+    """
+    now = timezone.now()
+    entries = [
+        IndexQueueEntry(
+            content_type_id=get_content_type_id(instance),
+            object_id=str(instance.pk),
+            queued_at=now,
+            attempts=0,
+        )
+        for instance in instances
+    ]
+    IndexQueueEntry.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=["content_type", "object_id"],
+        update_fields=["queued_at", "attempts"],
+    )
+
+
+def get_pending_count():
+    return IndexQueueEntry.objects.filter(attempts__lt=MAX_ATTEMPTS).count()
+
+
+def get_failed_count():
+    return IndexQueueEntry.objects.filter(attempts__gte=MAX_ATTEMPTS).count()
+
+
+def claim_entries(batch_size):
+    """
+    Claim up to ``batch_size`` due entries, oldest first, and return them
+    with their original ``queued_at``. The transaction only lasts as long as
+    the claim.
+    """
+    claimed_until = timezone.now() + CLAIM_TIMEOUT
+    with transaction.atomic():
+        queryset = IndexQueueEntry.objects.filter(
+            queued_at__lte=timezone.now(), attempts__lt=MAX_ATTEMPTS
+        ).order_by("queued_at", "pk")
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        entries = list(queryset[:batch_size])
+        IndexQueueEntry.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+            queued_at=claimed_until
+        )
+    return entries, claimed_until
+
+
+def update_index(model, ids, backends):
+    """
+    Bring the index entries of ``model``'s objects with ``ids`` up to date in
+    ``backends``, and return the number of objects indexed and removed.
+    """
+    objects = list(model.get_indexed_objects().filter(pk__in=ids))
+    missing = ids - {str(obj.pk) for obj in objects}
+    for backend in backends:
+        backend.add_bulk(model, objects)
+        for pk in missing:
+            backend.delete(model(pk=model._meta.pk.to_python(pk)))
+    return len(objects), len(missing)
+
+
+def apply_updates(entries):
+    """
+    Bring the index entries of the objects in ``entries`` up to date in every
+    search backend. Return the number of objects indexed and removed, and
+    the entries of the models that could not be indexed.
+    """
+    grouped = {}
+    for entry in entries:
+        grouped.setdefault(entry.content_type_id, []).append(entry)
+
+    backends = [backend for name, backend in get_search_backends_with_name()]
+    indexed = removed = 0
+    failed = []
+    for content_type_id, group in grouped.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None or not hasattr(model, "get_indexed_objects"):
+            continue
+
+        try:
+            with transaction.atomic():
+                counts = update_index(
+                    model, {entry.object_id for entry in group}, backends
+                )
+        except Exception:
+            logger.exception(
+                "Could not index %d %s objects", len(group), model._meta.label
+            )
+            failed.extend(group)
+            continue
+        indexed += counts[0]
+        removed += counts[1]
+    return indexed, removed, failed
+
+
+def process_batch(batch_size):
+    """
+    Apply up to ``batch_size`` queued updates, oldest first, and return the
+    number of objects indexed, removed and failed.
+
+    Entries queued again while their batch is being indexed no longer have
+    the claim's ``queued_at``, and are left in the queue for the next batch.
+    """
+    entries, claimed_until = claim_entries(batch_size)
+    if not entries:
+        return 0, 0, 0
+
+    indexed, removed, failed = apply_updates(entries)
+
+    with transaction.atomic():
+        claimed = IndexQueueEntry.objects.filter(
+            pk__in=[entry.pk for entry in entries], queued_at=claimed_until
+        )
+        now = timezone.now()
+        for entry in failed:
+            attempts = entry.attempts + 1
+            claimed.filter(pk=entry.pk).update(
+                attempts=attempts,
+                queued_at=now + RETRY_DELAY * 2 ** (attempts - 1),
+            )
+        claimed.exclude(pk__in=[entry.pk for entry in failed]).delete()
+    return indexed, removed, len(failed)
@@ -0,0 +1,75 @@
+import logging
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from search import index_queue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the search index updates queued by SEARCH_INDEX_QUEUE in "
+        "batches, polling for more until stopped (or once with --once)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Number of queued objects indexed per batch and transaction.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling again when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling.",
+        )
+
+    def handle(self, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while not self.stopping:
+            close_old_connections()
+            start = time.perf_counter()
+            try:
+                indexed, removed, failed = index_queue.process_batch(
+                    options["batch_size"]
+                )
+            except Exception:
+                # E.g. the database is unavailable; try again later.
+                if options["once"]:
+                    raise
+                logger.exception("Could not process the search index queue")
+                time.sleep(options["interval"])
+                continue
+            if indexed or removed or failed:
+                self.stdout.write(
+                    "Indexed %d and removed %d objects in %.2fs."
+                    % (indexed, removed, time.perf_counter() - start)
+                )
+                if failed:
+                    self.stdout.write(
+                        "Could not index %d objects; they will be retried." % failed
+                    )
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["interval"])
+
+    def stop(self, signum, frame):
+        # Finish the current batch, then exit.
+        self.stopping = True
@@ -0,0 +1,149 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wagtail.search.backends import get_search_backend
+from wagtail.search.index import get_indexed_models
+from wagtail.search.management.commands.update_index import group_models_by_index
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the search index in batches, recording progress in a "
+        "checkpoint file so an interrupted rebuild can be resumed with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            dest="backend_name",
+            default=None,
+            help="Only rebuild this search backend.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Number of objects indexed per batch and transaction.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(tempfile.gettempdir(), "rebuild_search_index.json"),
+            help="File used to record progress between batches.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue from the checkpoint file instead of starting over.",
+        )
+
+    def handle(self, **options):
+        self.checkpoint_path = options["checkpoint"]
+        self.state = self.load_checkpoint() if options["resume"] else {}
+
+        if options["backend_name"]:
+            backend_names = [options["backend_name"]]
+        else:
+            backend_names = list(
+                getattr(settings, "WAGTAILSEARCH_BACKENDS", {"default": {}})
+            )
+
+        for backend_name in backend_names:
+            self.rebuild_backend(backend_name, options["batch_size"])
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_checkpoint(self):
+        with open(self.checkpoint_path, "w") as f:
+            json.dump(self.state, f)
+
+    def rebuild_backend(self, backend_name, batch_size):
+        backend = get_search_backend(backend_name)
+        # Batches are committed one at a time so that progress survives an
+        # interruption, so the atomic rebuilder is never used here.
+        rebuilder_class = type(backend).rebuilder_class
+        if not rebuilder_class:
+            self.stdout.write(
+                "Backend '%s' doesn't require rebuilding" % backend_name
+            )
+            return
+
+        progress = self.state.setdefault(backend_name, {})
+
+        for index, models in group_models_by_index(
+            backend, get_indexed_models()
+        ).items():
+            index_progress = progress.setdefault(index.name, {"started": False})
+            rebuilder = rebuilder_class(index)
+
+            if index_progress["started"]:
+                self.stdout.write(
+                    "%s: Resuming index %s" % (backend_name, index.name)
+                )
+            else:
+                self.stdout.write(
+                    "%s: Rebuilding index %s" % (backend_name, index.name)
+                )
+                index = rebuilder.start()
+                index_progress["started"] = True
+                self.save_checkpoint()
+
+            for model in models:
+                index.add_model(model)
+                label = model._meta.label
+                if index_progress.get(label) == "done":
+                    continue
+
+                count = self.index_model(index, model, batch_size, index_progress)
+                self.stdout.write(
+                    "%s: %s indexed %d objects" % (backend_name, label, count)
+                )
+
+            rebuilder.finish()
+
+        del self.state[backend_name]
+        self.save_checkpoint()
+
+    def index_model(self, index, model, batch_size, index_progress):
+        """
+        Index ``model`` in primary key order, starting after the last primary
+        key recorded in ``index_progress``.
+        """
+        label = model._meta.label
+        queryset = model.get_indexed_objects().order_by("pk")
+        last_pk = index_progress.get(label)
+        count = 0
+
+        while True:
+            batch_queryset = queryset
+            if last_pk is not None:
+                batch_queryset = batch_queryset.filter(pk__gt=last_pk)
+            batch = list(batch_queryset[:batch_size])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                index.add_items(model, batch)
+
+            last_pk = batch[-1].pk
+            count += len(batch)
+            index_progress[label] = last_pk
+            self.save_checkpoint()
+
+        index_progress[label] = "done"
+        self.save_checkpoint()
+        return count
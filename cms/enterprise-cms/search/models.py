@@ -0,0 +1,28 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+
+class IndexQueueEntry(models.Model):
+    """
+    An object whose search index entries are out of date, waiting for
+    ``manage.py process_search_queue`` (see ``search.index_queue``). There is
+    at most one entry per object; queueing it again moves ``queued_at`` and
+    resets ``attempts``, the number of times indexing it has failed.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    queued_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_type", "object_id"],
+                name="unique_index_queue_entry",
+            )
+        ]
+        verbose_name_plural = "index queue entries"
+
+    def __str__(self):
+        return "%s %s" % (self.content_type, self.object_id)
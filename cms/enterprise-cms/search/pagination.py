@@ -0,0 +1,120 @@
+"""
+Pagination for site search that runs the search once per query.
+
+The ids of the first SEARCH_RESULTS_LIMIT results for a normalised query are
+cached for SEARCH_RESULTS_CACHE_TIMEOUT seconds. Every page of results is
+then served from that list with a single primary-key lookup, rather than a
+COUNT followed by a fresh search for each slice.
+
+By default the count is capped at the limit and reported as approximate
+("1,000+ results"). With SEARCH_EXACT_COUNT enabled, queries that hit the
+cap pay for one exact count, cached with the ids, and pages past the cap are
+fetched from the search backend directly.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+
+from wagtail.models import Page
+
+from cms.request_metrics import record_cache
+
+
+def get_results_limit():
+    return getattr(settings, "SEARCH_RESULTS_LIMIT", 1000)
+
+
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+
+def get_search_results(query, queryset=None):
+    if queryset is None:
+        queryset = Page.objects.live()
+    return queryset.search(query, order_by_relevance=True)
+
+
+class CachedSearchResults:
+    """
+    A sliceable sequence of live pages matching ``query``, backed by a cached
+    list of result ids.
+    """
+
+    def __init__(self, query):
+        self.query = normalize_query(query)
+        self.exact_count = getattr(settings, "SEARCH_EXACT_COUNT", False)
+        self.ids, self.total, self.capped = self._get_cached_results()
+
+    def _get_cache_key(self):
+        return "search:results:%s:%s" % (
+            "exact" if self.exact_count else "approximate",
+            hashlib.sha1(self.query.encode("utf-8")).hexdigest(),
+        )
+
+    def _get_cached_results(self):
+        key = self._get_cache_key()
+        cached = cache.get(key)
+        record_cache(cached is not None)
+        if cached is None:
+            limit = get_results_limit()
+            # Fetch one extra result to tell whether the limit was reached.
+            ids = [
+                page.pk
+                for page in get_search_results(
+                    self.query, Page.objects.live().only("pk")
+                )[: limit + 1]
+            ]
+            total = len(ids)
+            capped = total > limit
+            if capped:
+                ids = ids[:limit]
+                total = (
+                    get_search_results(self.query).count()
+                    if self.exact_count
+                    else limit
+                )
+            cached = (ids, total, capped)
+            cache.set(
+                key, cached, getattr(settings, "SEARCH_RESULTS_CACHE_TIMEOUT", 60)
+            )
+        return cached
+
+    @property
+    def is_approximate(self):
+        return self.capped and not self.exact_count
+
+    def count(self):
+        return self.total
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key : key + 1][0]
+
+        if key.stop is not None and key.stop > len(self.ids):
+            # Only reachable with an exact count beyond the cached ids.
+            return list(get_search_results(self.query)[key])
+
+        ids = self.ids[key]
+        pages = Page.objects.live().in_bulk(ids)
+        # Pages unpublished since the ids were cached are skipped.
+        return [pages[pk] for pk in ids if pk in pages]
+
+
+class SearchPaginator(Paginator):
+    """
+    Paginator over ``CachedSearchResults`` that knows whether its count is
+    approximate.
+    """
+
+    def __init__(self, query, per_page, **kwargs):
+        super().__init__(CachedSearchResults(query), per_page, **kwargs)
+
+    @property
+    def is_approximate(self):
+        return self.object_list.is_approximate
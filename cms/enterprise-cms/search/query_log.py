@@ -0,0 +1,180 @@
+"""
+Buffered logging of search queries for the "Promoted search results" module.
+
+``Query.add_hit()`` performs a get-or-create and an update on every search.
+Instead, hits are counted in memory per process and written by a background
+thread every SEARCH_HITS_FLUSH_INTERVAL seconds, or sooner once
+SEARCH_HITS_FLUSH_SIZE hits are waiting. Each flush upserts the missing
+``Query`` and ``QueryDailyHits`` rows and then adds the buffered counts with
+a single ``hits = hits + n`` update per day, so concurrent flushes from other
+workers cannot overwrite each other's counts.
+
+Hits still buffered when a process is killed are lost, which is acceptable
+for popularity statistics. Buffered hits are flushed on a normal exit.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from wagtail.contrib.search_promotions.models import (
+    Query,
+    QueryDailyHits,
+    SearchPromotion,
+)
+from wagtail.search.utils import normalise_query_string
+
+logger = logging.getLogger(__name__)
+
+_hits = Counter()
+_lock = threading.Lock()
+_flush_requested = threading.Event()
+_flusher_pid = None
+
+
+def get_flush_interval():
+    return getattr(settings, "SEARCH_HITS_FLUSH_INTERVAL", 30)
+
+
+def log_query(query_string):
+    """
+    Record a hit for ``query_string`` today. Never touches the database.
+    """
+    query_string = normalise_query_string(query_string)
+    if not query_string:
+        return
+
+    with _lock:
+        _hits[query_string, timezone.now().date()] += 1
+        pending = sum(_hits.values())
+
+    _start_flusher()
+    if pending >= getattr(settings, "SEARCH_HITS_FLUSH_SIZE", 100):
+        _flush_requested.set()
+
+
+def get_search_promotions(query_string):
+    """
+    Return the promoted results for ``query_string``. Unlike the
+    ``get_search_promotions`` template tag, this does not create a ``Query``
+    row for unseen queries.
+    """
+    return list(
+        SearchPromotion.objects.filter(
+            query__query_string=normalise_query_string(query_string)
+        )
+        .select_related("page")
+        .order_by("sort_order")
+    )
+
+
+def _start_flusher():
+    """
+    Start the background flush thread for this process, if it is enabled and
+    not already running. Threads do not survive a fork, so the pid is checked.
+    """
+    global _flusher_pid
+
+    interval = get_flush_interval()
+    if interval is None or _flusher_pid == os.getpid():
+        return
+
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+
+    def run():
+        while True:
+            _flush_requested.wait(interval)
+            _flush_requested.clear()
+            try:
+                flush()
+            except Exception:
+                logger.exception("Could not write search hits")
+            finally:
+                connection.close()
+
+    threading.Thread(target=run, name="search-hits-flusher", daemon=True).start()
+
+
+def flush():
+    """
+    Write all buffered hits to the database and return how many were written.
+    """
+    with _lock:
+        hits = dict(_hits)
+        _hits.clear()
+    if not hits:
+        return 0
+
+    try:
+        write_hits(hits)
+    except Exception:
+        # Keep the counts for the next attempt rather than dropping them.
+        with _lock:
+            _hits.update(hits)
+        raise
+    return sum(hits.values())
+
+
+def write_hits(hits):
+    """
+    Add ``hits``, a mapping of ``(query_string, date)`` to a count, to the
+    daily hits tables.
+    """
+    query_strings = {query_string for query_string, date in hits}
+
+    with transaction.atomic():
+        Query.objects.bulk_create(
+            [Query(query_string=query_string) for query_string in query_strings],
+            ignore_conflicts=True,
+        )
+        query_ids = dict(
+            Query.objects.filter(query_string__in=query_strings).values_list(
+                "query_string", "id"
+            )
+        )
+        QueryDailyHits.objects.bulk_create(
+            [
+                QueryDailyHits(query_id=query_ids[query_string], date=date)
+                for query_string, date in hits
+            ],
+            ignore_conflicts=True,
+        )
+
+        by_date = defaultdict(dict)
+        for (query_string, date), count in hits.items():
+            by_date[date][query_ids[query_string]] = count
+
+        for date, counts in by_date.items():
+            QueryDailyHits.objects.filter(date=date, query_id__in=counts).update(
+                hits=F("hits")
+                + Case(
+                    *[
+                        When(query_id=query_id, then=Value(count))
+                        for query_id, count in counts.items()
+                    ],
+                    output_field=IntegerField(),
+                )
+            )
+
+
+def reset():
+    with _lock:
+        _hits.clear()
+
+
+@atexit.register
+def flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Could not write search hits on exit")
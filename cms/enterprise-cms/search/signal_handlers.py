@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_save
+
+from wagtail.models import Page, PageViewRestriction, Site
+from wagtail.search.index import get_indexed_models
+from wagtail.signals import page_published, page_unpublished, post_page_move
+
+from search import autocomplete, index_queue
+
+
+def update_autocomplete_page(sender, instance, **kwargs):
+    autocomplete.update_page(instance)
+
+
+def remove_autocomplete_page(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        autocomplete.remove_page(instance.id)
+
+
+def invalidate_autocomplete(sender, **kwargs):
+    autocomplete.invalidate()
+
+
+def queue_index_update(sender, instance, raw=False, **kwargs):
+    if index_queue.is_enabled() and not raw:
+        index_queue.enqueue([instance])
+
+
+def register_signal_handlers():
+    page_published.connect(update_autocomplete_page)
+    page_unpublished.connect(remove_autocomplete_page)
+    post_delete.connect(remove_autocomplete_page)
+
+    # These can change the URL or visibility of a whole subtree.
+    post_page_move.connect(invalidate_autocomplete)
+    for model in (PageViewRestriction, Site):
+        post_save.connect(invalidate_autocomplete, sender=model)
+        post_delete.connect(invalidate_autocomplete, sender=model)
+
+    for model in get_indexed_models():
+        if getattr(model, "search_auto_update", True):
+            post_save.connect(queue_index_update, sender=model)
+            post_delete.connect(queue_index_update, sender=model)
@@ -0,0 +1,458 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from wagtail.contrib.search_promotions.models import (
+    Query,
+    QueryDailyHits,
+    SearchPromotion,
+)
+from wagtail import urls as wagtail_urls
+from wagtail.documents import get_document_model
+from wagtail.models import PageViewRestriction
+from wagtail.search.models import IndexEntry
+
+from cms import site_index
+from home.models import HomePage
+from search import autocomplete, index_queue, query_log
+from search.models import IndexQueueEntry
+from search.pagination import SearchPaginator
+from search.views import search_async
+
+# Routes for the async search view, which cms.urls only uses under ASGI.
+urlpatterns = [
+    path("search/", search_async, name="search"),
+    path("", include(wagtail_urls)),
+]
+
+
+@override_settings(SEARCH_HITS_FLUSH_INTERVAL=None, REQUEST_BUDGETS_STRICT=True)
+class SearchTestCase(TestCase):
+    """
+    Base class for search tests, with a handful of indexed pages.
+    """
+
+    def setUp(self):
+        cache.clear()
+        query_log.reset()
+        self.addCleanup(query_log.reset)
+        homepage = HomePage.objects.get(slug="home")
+        # Index entries are written once the transaction commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                homepage.add_child(
+                    instance=HomePage(title="Annual report %d" % i, slug="report-%d" % i)
+                )
+        # Budgets are for a warmed-up worker, which has sites in memory.
+        site_index.get_site_index()
+        self.addCleanup(site_index.reset)
+
+
+class SearchPaginatorTests(SearchTestCase):
+    """
+    Tests for paginating search results from cached result ids.
+    """
+
+    def test_later_pages_do_not_rerun_search(self):
+        self.assertEqual(len(SearchPaginator("report", 2).page(1)), 2)
+        with self.assertNumQueries(1):
+            page = SearchPaginator("Report ", 2).page(2)
+            self.assertEqual(len(page), 2)
+
+    def test_exact_count_below_limit(self):
+        paginator = SearchPaginator("report", 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(paginator.is_approximate)
+
+    @override_settings(SEARCH_RESULTS_LIMIT=3)
+    def test_count_capped_at_limit(self):
+        paginator = SearchPaginator("report", 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.is_approximate)
+        self.assertEqual(paginator.num_pages, 2)
+
+    @override_settings(SEARCH_RESULTS_LIMIT=3, SEARCH_EXACT_COUNT=True)
+    def test_exact_count_beyond_limit(self):
+        paginator = SearchPaginator("report", 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(paginator.is_approximate)
+        self.assertEqual(len(paginator.page(3)), 1)
+
+
+class SearchViewTests(SearchTestCase):
+    """
+    Tests for the search view.
+    """
+
+    @override_settings(SEARCH_RESULTS_LIMIT=3)
+    def test_approximate_count_shown(self):
+        response = self.client.get(reverse("search"), {"query": "report"})
+        self.assertContains(response, "3+ results")
+
+    def test_out_of_range_page_shows_last_page(self):
+        response = self.client.get(reverse("search"), {"query": "report", "page": 99})
+        self.assertEqual(response.context["search_results"].number, 1)
+
+    def test_no_results(self):
+        response = self.client.get(reverse("search"), {"query": "missing"})
+        self.assertContains(response, "No results found")
+
+
+@override_settings(ROOT_URLCONF="search.tests")
+class AsyncSearchViewTests(SearchTestCase):
+    """
+    Tests for the async search view served under ASGI.
+    """
+
+    async def test_results_rendered(self):
+        response = await self.async_client.get(reverse("search"), {"query": "report"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "5 results")
+        self.assertContains(response, 'href="/report-0/"')
+
+
+class SearchQueryLogTests(SearchTestCase):
+    """
+    Tests for buffered logging of search query hits.
+    """
+
+    def search(self, query):
+        return self.client.get(reverse("search"), {"query": query})
+
+    def test_hits_are_not_written_during_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search("report")
+        self.assertTrue(
+            all(query["sql"].startswith("SELECT") for query in queries.captured_queries)
+        )
+        self.assertFalse(QueryDailyHits.objects.exists())
+
+    def test_flush_writes_daily_hits(self):
+        self.search("report")
+        self.search("Report")
+        self.search("annual")
+        self.assertEqual(query_log.flush(), 3)
+
+        self.assertEqual(Query.get("report").hits, 2)
+        self.assertEqual(Query.get("annual").hits, 1)
+        self.assertEqual(query_log.flush(), 0)
+
+    def test_flush_adds_to_existing_hits(self):
+        Query.get("report").add_hit()
+        self.search("report")
+        query_log.flush()
+        self.assertEqual(QueryDailyHits.objects.get().hits, 2)
+
+    def test_promotions_shown(self):
+        page = HomePage.objects.get(slug="report-3")
+        SearchPromotion.objects.create(
+            query=Query.get("annual"), page=page, description="Latest report"
+        )
+        response = self.search("Annual")
+        self.assertEqual(
+            [promotion.page.id for promotion in response.context["search_promotions"]],
+            [page.id],
+        )
+        self.assertContains(response, "Latest report")
+
+
+@override_settings(SEARCH_AUTOCOMPLETE_REFRESH_INTERVAL=None)
+class AutocompleteTests(SearchTestCase):
+    """
+    Tests for the autocomplete endpoint and its prefix index.
+    """
+
+    def setUp(self):
+        super().setUp()
+        autocomplete.reset()
+        # Refresh in the test's thread, which can see its transaction.
+        patcher = mock.patch.object(
+            autocomplete, "start_refresh", autocomplete.refresh
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_titles(self, query):
+        response = self.client.get(reverse("search_autocomplete"), {"query": query})
+        self.assertEqual(response.status_code, 200)
+        return [result["title"] for result in response.json()["results"]]
+
+    def test_matches_start_of_any_word(self):
+        self.assertEqual(len(self.get_titles("ann")), 5)
+        self.assertEqual(self.get_titles("REPORT 3"), ["Annual report 3"])
+        self.assertEqual(self.get_titles("port"), [])
+
+    def test_results_include_url(self):
+        result = autocomplete.get_autocomplete_index().search("annual report 1")
+        self.assertEqual(result, [{"title": "Annual report 1", "url": "/report-1/"}])
+
+    def test_lookups_do_not_query_database(self):
+        autocomplete.get_autocomplete_index()
+        with self.assertNumQueries(0):
+            self.get_titles("annual")
+
+    def test_limit(self):
+        response = self.client.get(
+            reverse("search_autocomplete"), {"query": "annual", "limit": 2}
+        )
+        self.assertEqual(len(response.json()["results"]), 2)
+
+        response = self.client.get(
+            reverse("search_autocomplete"), {"query": "annual", "limit": 0}
+        )
+        self.assertEqual(len(response.json()["results"]), 1)
+        self.assertEqual(autocomplete.get_autocomplete_index().search("a", 0), [])
+
+    def test_publish_and_unpublish_update_index(self):
+        autocomplete.get_autocomplete_index()
+        page = HomePage.objects.get(slug="report-2")
+        page.title = "Budget summary"
+        page.save_revision().publish()
+        self.assertEqual(self.get_titles("budget"), ["Budget summary"])
+        self.assertNotIn("Annual report 2", self.get_titles("annual"))
+
+        page.unpublish()
+        self.assertEqual(self.get_titles("budget"), [])
+
+    @override_settings(SEARCH_AUTOCOMPLETE_REFRESH_INTERVAL=0)
+    def test_changes_in_other_processes_applied_without_rebuild(self):
+        index = autocomplete.get_autocomplete_index()
+        page = HomePage.objects.get(slug="report-2")
+        # Published by another process, whose index this one does not share.
+        with mock.patch.object(autocomplete, "_index", None):
+            page.title = "Budget summary"
+            page.save_revision().publish()
+            HomePage.objects.get(slug="report-3").unpublish()
+
+        with mock.patch.object(autocomplete.AutocompleteIndex, "build") as build:
+            self.assertEqual(self.get_titles("budget"), ["Budget summary"])
+        build.assert_not_called()
+        self.assertIs(autocomplete.get_autocomplete_index(), index)
+        self.assertEqual(
+            self.get_titles("annual"),
+            ["Annual report 0", "Annual report 1", "Annual report 4"],
+        )
+
+    @override_settings(SEARCH_AUTOCOMPLETE_REFRESH_INTERVAL=0)
+    def test_rebuild_when_change_log_is_incomplete(self):
+        autocomplete.get_autocomplete_index()
+        page = HomePage.objects.get(slug="report-2")
+        with mock.patch.object(autocomplete, "_index", None):
+            page.title = "Budget summary"
+            page.save_revision().publish()
+        cache.delete(
+            autocomplete.CHANGE_CACHE_KEY % cache.get(autocomplete.SEQUENCE_CACHE_KEY)
+        )
+        self.assertEqual(
+            autocomplete.get_autocomplete_index().search("budget"),
+            [{"title": "Budget summary", "url": "/report-2/"}],
+        )
+
+    def test_invalidate_serves_current_index_while_rebuilding(self):
+        index = autocomplete.get_autocomplete_index()
+        with mock.patch.object(autocomplete, "start_refresh") as start_refresh:
+            autocomplete.invalidate()
+            with self.assertNumQueries(0):
+                self.assertIs(autocomplete.get_autocomplete_index(), index)
+        start_refresh.assert_called_once_with(rebuild=True)
+
+    def test_restricted_pages_excluded(self):
+        page = HomePage.objects.get(slug="report-1")
+        PageViewRestriction.objects.create(
+            page=page, restriction_type=PageViewRestriction.LOGIN
+        )
+        self.assertNotIn("Annual report 1", self.get_titles("annual"))
+        self.assertEqual(len(self.get_titles("annual")), 4)
+
+
+class RebuildSearchIndexTests(SearchTestCase):
+    """
+    Tests for the batched, resumable rebuild_search_index command.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), "checkpoint.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.checkpoint))
+
+    def call_command(self, *args):
+        stdout = StringIO()
+        call_command(
+            "rebuild_search_index",
+            "--checkpoint",
+            self.checkpoint,
+            "--batch-size",
+            "2",
+            *args,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def test_rebuild_indexes_pages(self):
+        IndexEntry.objects.all().delete()
+        output = self.call_command()
+        self.assertIn("home.HomePage indexed 6 objects", output)
+        self.assertEqual(SearchPaginator("report", 10).count, 5)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_skips_completed_batches(self):
+        last_page = HomePage.objects.order_by("pk").last()
+        with open(self.checkpoint, "w") as f:
+            json.dump(
+                {
+                    "default": {
+                        "default": {
+                            "started": True,
+                            "home.HomePage": last_page.pk - 1,
+                        }
+                    }
+                },
+                f,
+            )
+        output = self.call_command("--resume")
+        self.assertIn("Resuming index default", output)
+        self.assertIn("home.HomePage indexed 1 objects", output)
+
+
+@override_settings(
+    SEARCH_INDEX_QUEUE=True,
+    WAGTAILSEARCH_BACKENDS={
+        "default": {
+            "BACKEND": "wagtail.search.backends.database",
+            "AUTO_UPDATE": False,
+        }
+    },
+)
+class IndexQueueTests(SearchTestCase):
+    """
+    Tests for queued search index updates and the process_search_queue worker.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Index the pages queued by SearchTestCase.
+        index_queue.process_batch(100)
+
+    def process_queue(self):
+        stdout = StringIO()
+        call_command("process_search_queue", "--once", stdout=stdout)
+        return stdout.getvalue()
+
+    def test_saves_are_queued_once(self):
+        homepage = HomePage.objects.get(slug="home")
+        with self.captureOnCommitCallbacks(execute=True):
+            page = homepage.add_child(instance=HomePage(title="Budget", slug="budget"))
+            page.title = "Budget 2026"
+            page.save()
+        self.assertEqual(IndexQueueEntry.objects.count(), 1)
+        self.assertEqual(IndexQueueEntry.objects.get().object_id, str(page.pk))
+        # The page is not indexed until the worker runs.
+        self.assertEqual(SearchPaginator("budget", 10).count, 0)
+
+    def test_worker_indexes_queued_pages(self):
+        homepage = HomePage.objects.get(slug="home")
+        homepage.add_child(instance=HomePage(title="Budget", slug="budget"))
+        output = self.process_queue()
+        self.assertIn("Indexed 1 and removed 0 objects", output)
+        self.assertEqual(SearchPaginator("budget", 10).count, 1)
+        self.assertEqual(index_queue.get_pending_count(), 0)
+
+    def test_worker_removes_deleted_pages(self):
+        page = HomePage.objects.get(slug="report-0")
+        page.delete()
+        self.assertTrue(IndexQueueEntry.objects.filter(object_id=str(page.pk)).exists())
+        output = self.process_queue()
+        self.assertIn("removed 1 objects", output)
+        self.assertFalse(IndexEntry.objects.filter(object_id=str(page.pk)).exists())
+
+    def test_enqueue_during_a_batch_does_not_wait(self):
+        page = HomePage.objects.get(slug="report-0")
+        page.save()
+        apply_updates = index_queue.apply_updates
+        depth = len(connection.atomic_blocks)
+
+        def save_again(entries):
+            # The claim is committed and no transaction (so no row lock) is
+            # held while indexing, so the editor's upsert goes straight
+            # through.
+            self.assertEqual(len(connection.atomic_blocks), depth)
+            self.assertGreater(
+                IndexQueueEntry.objects.get().queued_at, timezone.now()
+            )
+            page.save()
+            return apply_updates(entries)
+
+        with mock.patch.object(index_queue, "apply_updates", save_again):
+            self.assertEqual(index_queue.process_batch(10), (1, 0, 0))
+        self.assertEqual(index_queue.get_pending_count(), 1)
+        self.assertLessEqual(IndexQueueEntry.objects.get().queued_at, timezone.now())
+
+    def test_expired_claims_are_retried(self):
+        page = HomePage.objects.get(slug="report-0")
+        page.save()
+        index_queue.claim_entries(10)
+        self.assertEqual(index_queue.claim_entries(10)[0], [])
+        IndexQueueEntry.objects.update(queued_at=timezone.now())
+        self.assertEqual(index_queue.process_batch(10), (1, 0, 0))
+
+    def test_failing_model_is_retried_without_blocking_others(self):
+        page = HomePage.objects.get(slug="report-0")
+        page.save()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            document = get_document_model().objects.create(
+                title="Budget", file=ContentFile(b"budget", name="budget.txt")
+            )
+        update_index = index_queue.update_index
+
+        def fail_for_pages(model, ids, backends):
+            if issubclass(model, HomePage):
+                raise ValueError("Unindexable")
+            return update_index(model, ids, backends)
+
+        with mock.patch.object(index_queue, "update_index", fail_for_pages):
+            with self.assertLogs("search.index_queue", "ERROR"):
+                output = self.process_queue()
+        self.assertIn("Indexed 1 and removed 0 objects", output)
+        self.assertIn("Could not index 1 objects", output)
+        self.assertFalse(
+            IndexQueueEntry.objects.filter(object_id=str(document.pk)).exists()
+        )
+        entry = IndexQueueEntry.objects.get(object_id=str(page.pk))
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.queued_at, timezone.now())
+
+        # Not claimed again until the delay has passed.
+        self.assertEqual(index_queue.process_batch(10), (0, 0, 0))
+        entry.queued_at = timezone.now()
+        entry.save()
+        self.assertEqual(index_queue.process_batch(10), (1, 0, 0))
+        self.assertEqual(index_queue.get_pending_count(), 0)
+
+    def test_entries_fail_after_max_attempts(self):
+        page = HomePage.objects.get(slug="report-0")
+        page.save()
+        IndexQueueEntry.objects.update(attempts=index_queue.MAX_ATTEMPTS - 1)
+        with mock.patch.object(
+            index_queue, "update_index", side_effect=ValueError
+        ), self.assertLogs("search.index_queue", "ERROR"):
+            self.assertEqual(index_queue.process_batch(10), (0, 0, 1))
+        self.assertEqual(index_queue.get_pending_count(), 0)
+        self.assertEqual(index_queue.get_failed_count(), 1)
+
+        # Saving the page again gives it a fresh start.
+        page.save()
+        self.assertEqual(index_queue.get_pending_count(), 1)
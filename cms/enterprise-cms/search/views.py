@@ -1,46 +1,70 @@
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.http import JsonResponse
 from django.template.response import TemplateResponse
 
 from wagtail.models import Page
 
-# To enable logging of search queries for use with the "Promoted search results" module
-# <https://docs.wagtail.org/en/stable/reference/contrib/searchpromotions.html>
-# uncomment the following line and the lines indicated in the search function
-# (after adding wagtail.contrib.search_promotions to INSTALLED_APPS):
+from search.autocomplete import get_autocomplete_index
+from search.pagination import SearchPaginator
+from search.query_log import get_search_promotions, log_query
 
-# from wagtail.contrib.search_promotions.models import Query
+# Queries are logged for use with the "Promoted search results" module
+# <https://docs.wagtail.org/en/stable/reference/contrib/searchpromotions.html>.
+# Hits are buffered and written in bulk in the background (see search.query_log).
 
 
-def search(request):
-    search_query = request.GET.get("query", None)
-    page = request.GET.get("page", 1)
-
-    # Search
+def get_search_context(search_query, page):
+    # Search and pagination. Result ids are cached per query, so later pages
+    # do not re-run the search (see search.pagination).
     if search_query:
-        search_results = Page.objects.live().search(search_query)
-
-        # To log this query for use with the "Promoted search results" module:
-
-        # query = Query.get(search_query)
-        # query.add_hit()
-
+        paginator = SearchPaginator(search_query, 10)
+        search_promotions = get_search_promotions(search_query)
+        log_query(search_query)
     else:
-        search_results = Page.objects.none()
+        paginator = Paginator(Page.objects.none(), 10)
+        search_promotions = []
 
-    # Pagination
-    paginator = Paginator(search_results, 10)
-    try:
-        search_results = paginator.page(page)
-    except PageNotAnInteger:
-        search_results = paginator.page(1)
-    except EmptyPage:
-        search_results = paginator.page(paginator.num_pages)
+    return {
+        "search_query": search_query,
+        "search_results": paginator.get_page(page),
+        "search_promotions": search_promotions,
+    }
 
+
+def search(request):
     return TemplateResponse(
         request,
         "search/search.html",
-        {
-            "search_query": search_query,
-            "search_results": search_results,
-        },
+        get_search_context(
+            request.GET.get("query", None), request.GET.get("page", 1)
+        ),
+    )
+
+
+async def search_async(request):
+    """
+    Asynchronous version of ``search``, used when the site runs under ASGI.
+    The ORM is synchronous, so the queries run in this request's thread (and
+    database connection) while the event loop carries on serving others.
+    """
+    context = await sync_to_async(get_search_context)(
+        request.GET.get("query", None), request.GET.get("page", 1)
+    )
+    return TemplateResponse(request, "search/search.html", context)
+
+
+def autocomplete(request):
+    """
+    Return live page titles matching the start of any word in the query, as
+    JSON. Answered from an in-memory index without touching the database.
+    """
+    search_query = request.GET.get("query", "")
+    try:
+        limit = max(1, min(int(request.GET.get("limit", 10)), 20))
+    except ValueError:
+        limit = 10
+
+    return JsonResponse(
+        {"results": get_autocomplete_index().search(search_query, limit=limit)}
     )